@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'movies.metrics.RequestMetricsMiddleware',
+    'movies.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +75,15 @@ TEMPLATES = [
 WSGI_APPLICATION = 'moviebox.wsgi.application'
 
 
+REST_FRAMEWORK = {
+    # JSON rendering is counted as serialization in the request metrics (see movies.metrics)
+    'DEFAULT_RENDERER_CLASSES': [
+        'movies.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -87,6 +98,95 @@ DATABASES = {
     }
 }
 
+# Read replicas (comma-separated hosts, with the credentials of 'default').
+# GET requests read from them (see movies.routers); a client's reads stay
+# on the primary for READ_YOUR_WRITES_WINDOW seconds after its write.
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = dict(DATABASES['default'], HOST=host.strip(),
+                                         TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['movies.routers.ReplicaRouter']
+
+READ_YOUR_WRITES_WINDOW = int(os.environ.get('READ_YOUR_WRITES_WINDOW', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# 'omdb' keeps OMDb responses on disk, so they survive restarts;
+# when MAX_ENTRIES is reached, the backend deletes a random third
+# of the entries (1 / CULL_FREQUENCY, not the oldest ones).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'omdb': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('OMDB_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'omdb')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('OMDB_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # responses of read endpoints (see movies.response_cache)
+    'responses': {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'responses'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+# seconds the responses of GET /movies, /comments and /top are cached for
+MOVIES_CACHE_TTL = int(os.environ.get('MOVIES_CACHE_TTL', 5 * 60))
+COMMENTS_CACHE_TTL = int(os.environ.get('COMMENTS_CACHE_TTL', 60))
+TOP_CACHE_TTL = int(os.environ.get('TOP_CACHE_TTL', 10 * 60))
+
+
+# OMDb client (see movies.utils)
+
+OMDB_URL = os.environ.get('OMDB_URL', 'http://www.omdbapi.com/')
+OMDB_API_KEY = os.environ.get('OMDB_API_KEY')
+OMDB_CONNECT_TIMEOUT = float(os.environ.get('OMDB_CONNECT_TIMEOUT', 3.05))
+OMDB_READ_TIMEOUT = float(os.environ.get('OMDB_READ_TIMEOUT', 10))
+OMDB_RETRIES = int(os.environ.get('OMDB_RETRIES', 2))
+OMDB_BACKOFF_FACTOR = float(os.environ.get('OMDB_BACKOFF_FACTOR', 0.3))
+OMDB_POOL_SIZE = int(os.environ.get('OMDB_POOL_SIZE', 10))
+OMDB_FAILURE_THRESHOLD = int(os.environ.get('OMDB_FAILURE_THRESHOLD', 5))
+OMDB_RESET_TIMEOUT = float(os.environ.get('OMDB_RESET_TIMEOUT', 30))
+# seconds found and unknown titles are kept in the 'omdb' cache
+OMDB_CACHE_TTL = int(os.environ.get('OMDB_CACHE_TTL', 7 * 24 * 60 * 60))
+OMDB_NEGATIVE_CACHE_TTL = int(os.environ.get('OMDB_NEGATIVE_CACHE_TTL', 24 * 60 * 60))
+
+
+# Movies and comments
+
+# latest comments embedded in movie details: GET /movies?ids=, GET and PUT
+# /movies/<movie-id> and POST /movies
+MOVIE_COMMENTS_LIMIT = int(os.environ.get('MOVIE_COMMENTS_LIMIT', 10))
+
+# write-behind saving of POST /comments (see movies.comment_buffer)
+COMMENT_WRITE_BEHIND = os.environ.get('COMMENT_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+COMMENT_BUFFER_SIZE = int(os.environ.get('COMMENT_BUFFER_SIZE', 100))
+COMMENT_FLUSH_INTERVAL = float(os.environ.get('COMMENT_FLUSH_INTERVAL', 0.05))
+COMMENT_DURABILITY = os.environ.get('COMMENT_DURABILITY', 'commit')
+COMMENT_SAVE_TIMEOUT = float(os.environ.get('COMMENT_SAVE_TIMEOUT', 5))
+
+# ingest jobs of POST /movies (see movies.ingest)
+INGEST_ASYNC = os.environ.get('INGEST_ASYNC', '').lower() in ('1', 'true', 'yes')
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 8))
+INGEST_LEASE = int(os.environ.get('INGEST_LEASE', 60))
+INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 5))
+INGEST_RETRY_DELAY = float(os.environ.get('INGEST_RETRY_DELAY', 30))
+
+# import_movies and export_movies commands (see movies.importer and movies.export)
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 8))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 100))
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
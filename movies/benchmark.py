@@ -0,0 +1,210 @@
+"""
+Benchmark of every endpoint of movies.urls at several data sizes.
+
+Every request goes through the whole Django stack with the test client,
+against synthetic data (see movies.synthetic). For each endpoint
+the latency percentiles, the number of queries and the peak memory
+allocated while handling a request (measured in a separate, traced run)
+are reported. Results are plain JSON, so that two runs
+can be compared with 'compare()'.
+"""
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    Comment,
+    IngestJob,
+    Movie,
+)
+from .synthetic import (
+    generate_comments,
+    generate_movies,
+    movie_data,
+)
+from .utils import normalize_title
+
+
+class Case:
+    """
+    A request to benchmark. 'prepare' is called before every request
+    (outside of the measurement) and returns the path to request,
+    for requests which need fresh data, like DELETE.
+    """
+    def __init__(self, name, method, path, data=None, content_type=None, prepare=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.content_type = content_type
+        self.prepare = prepare
+
+    def request(self, client):
+        path = self.prepare() if self.prepare else self.path
+        kwargs = {'content_type': self.content_type} if self.content_type else {}
+        response = getattr(client, self.method)(path, self.data, **kwargs)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        if response.status_code >= 400:
+            raise RuntimeError(f'{self.name}: {response.status_code} {response.content[:200]}')
+        return response
+
+
+def cases(date_from, date_to, seed=0):
+    """ Requests covering every URL of movies.urls """
+    rng = random.Random(seed)
+    movies = list(Movie.objects.order_by('id').values_list('id', 'title'))
+    popular = Movie.objects.order_by('-comment_count').values_list('id', flat=True).first()
+    movie_id, title = rng.choice(movies)
+    titles = [title for movie_id, title in rng.sample(movies, min(10, len(movies)))]
+    commented = [movie_id for movie_id, title in rng.sample(movies, min(10, len(movies)))]
+    recent = date_to - timedelta(days=30)
+    job = IngestJob.objects.create(title=title, title_key=normalize_title(title),
+                                   status=IngestJob.DONE, movie_id=movie_id)
+
+    def new_movie():
+        data = movie_data(rng, Movie.objects.count() + 10 ** 7)
+        return f'/movies/{Movie.objects.create(**data).id}'
+
+    return [
+        Case('GET /movies', 'get', '/movies'),
+        Case('GET /movies?genre', 'get', '/movies?genre=drama'),
+        Case('GET /movies?order', 'get', '/movies?year_min=1990&min_rating=5&order=-imdbvotes'),
+        Case('POST /movies', 'post', '/movies', {'title': title}),
+        Case('POST /movies/bulk', 'post', '/movies/bulk', json.dumps({'titles': titles}),
+             content_type='application/json'),
+        Case('GET /movies/export', 'get', '/movies/export?comments=1'),
+        Case('GET /movies/search', 'get', '/movies/search?q=night city'),
+        Case('GET /movies/jobs/<id>', 'get', f'/movies/jobs/{job.id}'),
+        Case('GET /movies/<id>', 'get', f'/movies/{popular}'),
+        Case('GET /movies?ids', 'get', '/movies?ids={}'.format(','.join(map(str, commented)))),
+        Case('PUT /movies/<id>', 'put', f'/movies/{movie_id}',
+             json.dumps({'plot': 'A new plot.'}), content_type='application/json'),
+        Case('DELETE /movies/<id>', 'delete', None, prepare=new_movie),
+        Case('GET /comments', 'get', '/comments'),
+        Case('GET /comments?movie', 'get', f'/comments?movie={popular}'),
+        Case('POST /comments', 'post', '/comments', {'movie_id': movie_id, 'text': 'Benchmark.'}),
+        Case('POST /comments/bulk', 'post', '/comments/bulk',
+             json.dumps({'comments': [{'movie_id': movie_id, 'text': 'Benchmark.'}
+                                      for movie_id in commented]}),
+             content_type='application/json'),
+        Case('GET /top', 'get', f'/top?from={date_from}&to={date_to}'),
+        Case('GET /top (30 days)', 'get', f'/top?from={recent}&to={date_to}'),
+        Case('GET /top (top 10)', 'get', f'/top?from={recent}&to={date_to}&limit=10'),
+    ]
+
+
+def percentile(values, fraction):
+    """ Percentile with linear interpolation between the closest ranks """
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def measure(client, case, repeat, warm_cache=False):
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        if not warm_cache:
+            caches['responses'].clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            case.request(client)
+            timings.append(time.perf_counter() - start)
+        queries.append(len(context.captured_queries))
+    if not warm_cache:
+        caches['responses'].clear()
+    tracemalloc.start()
+    try:
+        case.request(client)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'endpoint': case.name,
+        'requests': repeat,
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(sizes, repeat=50, days=365, seed=0, warm_cache=False, log=None):
+    """
+    Benchmark every case at the given (movies, comments) sizes,
+    in increasing order; data is added to reach every next size.
+    Returns the results as a JSON-serializable dict.
+    """
+    date_to = timezone.localdate()
+    date_from = date_to - timedelta(days=days - 1)
+    client = Client()
+    results = []
+    for index, (movies, comments) in enumerate(sorted(sizes)):
+        movie_ids = list(Movie.objects.values_list('id', flat=True))
+        movie_ids += generate_movies(max(movies - len(movie_ids), 0), seed=seed + index)
+        generate_comments(max(comments - Comment.objects.count(), 0), movie_ids,
+                          date_from, date_to, seed=seed + index)
+        for case in cases(date_from, date_to, seed=seed + index):
+            result = measure(client, case, repeat, warm_cache)
+            result.update(movies=movies, comments=comments)
+            results.append(result)
+            if log:
+                log(result)
+    return {
+        'meta': {
+            'created': timezone.now().isoformat(),
+            'sizes': [list(size) for size in sorted(sizes)],
+            'repeat': repeat,
+            'days': days,
+            'seed': seed,
+            'warm_cache': warm_cache,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_delta_ms=1.0):
+    """
+    Compare results of two runs, matched by endpoint and data size.
+    A result is a regression when it makes more queries, or when its p95
+    grows by more than 'threshold' (a fraction) and 'min_delta_ms'.
+    """
+    def key(result):
+        return result['endpoint'], result['movies'], result['comments']
+
+    previous = {key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        delta = result['p95_ms'] - before['p95_ms']
+        slower = delta > min_delta_ms and delta > before['p95_ms'] * threshold
+        rows.append({
+            'endpoint': result['endpoint'],
+            'movies': result['movies'],
+            'comments': result['comments'],
+            'p95_ms': (before['p95_ms'], result['p95_ms']),
+            'queries': (before['queries'], result['queries']),
+            'regression': slower or result['queries'] > before['queries'],
+        })
+    return rows
@@ -0,0 +1,166 @@
+"""
+Batched saving of comments.
+
+'save_comments()' inserts many comments with a single 'bulk_create()'
+in one transaction. As 'bulk_create()' skips the signals on Comment,
+it updates the movies' counters, the daily rollup and the version
+stamps itself, each with a single statement for all the movies and days
+(see 'add_to_counts()'). The movies are locked for the transaction,
+so that comments of a movie deleted meanwhile are dropped, not the batch.
+It's used by POST /comments/bulk and by the write-behind buffer.
+
+With settings.COMMENT_WRITE_BEHIND on, POST /comments validates the comment
+and hands it to 'comment_buffer', which saves the comments of all
+the requests of the process in group commits: when COMMENT_BUFFER_SIZE
+comments are waiting or COMMENT_FLUSH_INTERVAL seconds have passed.
+Comments are only batched when a process serves requests concurrently
+(threaded or gevent workers); with sync workers, which serve one request
+at a time, every commit holds a single comment.
+COMMENT_DURABILITY decides when the request is answered:
+    'commit' - after the group commit with its comment (201),
+               so an answered comment is never lost; if it isn't committed
+               within COMMENT_SAVE_TIMEOUT seconds the answer is 503
+               (the comment may still be saved later)
+    'buffer' - as soon as the comment is buffered (202); comments
+               still buffered when the process exits normally are saved
+               at exit, but they are lost if it's killed or a commit fails
+In both modes 'created' is the time of the commit.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import (
+    connections,
+    transaction,
+)
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    Comment,
+    DailyCommentCount,
+    Movie,
+    ResourceVersion,
+    add_to_counts,
+)
+
+
+DURABILITIES = ('commit', 'buffer')
+
+logger = logging.getLogger(__name__)
+
+
+def comment_durability():
+    """ settings.COMMENT_DURABILITY, if it's one of DURABILITIES """
+    durability = settings.COMMENT_DURABILITY
+    if durability not in DURABILITIES:
+        raise ImproperlyConfigured(f"COMMENT_DURABILITY has to be one of: {', '.join(DURABILITIES)}.")
+    return durability
+
+
+def save_comments(comments):
+    """
+    Save new movie comments ('movie' set) at once and update
+    what the signals on Comment would, with the same number of queries
+    whatever the number of comments and movies; returns the comments saved.
+    Comments of movies deleted meanwhile are skipped.
+    """
+    movie_ids = {comment.movie_id for comment in comments}
+    with transaction.atomic():
+        # locked, so that the movies can't be deleted until the comments are saved
+        existing = set(Movie.objects
+                       .select_for_update()
+                       .filter(id__in=movie_ids)
+                       .order_by('id')
+                       .values_list('id', flat=True))
+        comments = [comment for comment in comments if comment.movie_id in existing]
+        if not comments:
+            return comments
+        Comment.objects.bulk_create(comments)
+        per_movie = Counter(comment.movie_id for comment in comments)
+        add_to_counts(Movie.objects.all(), 'comment_count',
+                      [(Q(pk=movie_id), count) for movie_id, count in per_movie.items()])
+        DailyCommentCount.objects.add_many(Counter(
+            (comment.movie_id, timezone.localdate(comment.created)) for comment in comments))
+        ResourceVersion.objects.bump(ResourceVersion.COMMENTS,
+                                     *map(ResourceVersion.comments_of, per_movie))
+    return comments
+
+
+class CommentBuffer:
+    """
+    Comments waiting to be saved by 'save', with a future per comment
+    resolved when it's saved (or failed to). A full buffer is flushed
+    by the thread adding the last comment, otherwise a background thread
+    flushes it every 'interval' seconds. Flushes never overlap.
+    """
+    def __init__(self, size, interval, save=save_comments):
+        self.size = size
+        self.interval = interval
+        self.save = save
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def add(self, comment):
+        future = Future()
+        with self.lock:
+            self.pending.append((comment, future))
+            full = len(self.pending) >= self.size
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        """ Save the buffered comments; returns their number """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            try:
+                saved = {id(comment) for comment in self.save([comment for comment, _ in batch])}
+            except Exception as exc:
+                logger.exception('Saving %d buffered comments failed.', len(batch))
+                for _, future in batch:
+                    future.set_exception(exc)
+            else:
+                for comment, future in batch:
+                    if id(comment) in saved:
+                        future.set_result(comment)
+                    else:
+                        future.set_exception(Movie.DoesNotExist())
+            return len(batch)
+
+    def run(self):
+        """ Flush every 'interval' seconds; errors are logged, so that the thread never stops """
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Flushing buffered comments failed.')
+                try:
+                    # connections of this thread, so that they aren't kept open between flushes
+                    connections.close_all()
+                except Exception:
+                    logger.exception('Closing connections of the flush thread failed.')
+        finally:
+            # the next comment added starts a new thread
+            with self.lock:
+                self.thread = None
+
+
+comment_buffer = CommentBuffer(settings.COMMENT_BUFFER_SIZE, settings.COMMENT_FLUSH_INTERVAL)
+atexit.register(comment_buffer.flush)
@@ -0,0 +1,74 @@
+"""
+Streaming export of the whole catalog.
+
+Movies are read with 'QuerySet.iterator()', which on PostgreSQL uses
+a server-side cursor, in chunks of a fixed size; the comments of
+a chunk are fetched with one query per chunk. Only one chunk is held
+in memory at a time, whatever the size of the catalog.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import (
+    Comment,
+    Movie,
+)
+
+
+NDJSON = 'ndjson'
+JSON = 'json'
+FORMATS = {
+    NDJSON: 'application/x-ndjson',
+    JSON: 'application/json',
+}
+
+EXCLUDED_FIELDS = {'title_key', *Movie.NUMBER_FIELDS}
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _add_comments(movies):
+    for movie in movies:
+        movie['comments'] = []
+    by_id = {movie['id']: movie for movie in movies}
+    comments = (Comment.objects
+                .filter(movie_id__in=list(by_id))
+                .order_by('movie_id', 'created', 'id')
+                .values_list('movie_id', 'id', 'text', 'created'))
+    for movie_id, comment_id, text, created in comments:
+        by_id[movie_id]['comments'].append({'id': comment_id, 'text': text, 'created': created})
+
+
+def export_movies(output_format=NDJSON, with_comments=False, chunk_size=None):
+    """
+    Generate the catalog as text chunks: one JSON object
+    per line (ndjson) or a single JSON array (json).
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    fields = [field.attname for field in Movie._meta.concrete_fields
+              if field.name not in EXCLUDED_FIELDS]
+    rows = Movie.objects.order_by('id').values(*fields).iterator(chunk_size=chunk_size)
+    encoder = DjangoJSONEncoder()
+    separator = '\n' if output_format == NDJSON else ',\n'
+    if output_format == JSON:
+        yield '['
+    first = True
+    for movies in _chunks(rows, chunk_size):
+        if with_comments:
+            _add_comments(movies)
+        chunk = separator.join(encoder.encode(movie) for movie in movies)
+        if output_format == NDJSON:
+            yield chunk + '\n'
+        else:
+            yield chunk if first else separator + chunk
+        first = False
+    if output_format == JSON:
+        yield ']\n'
@@ -0,0 +1,31 @@
+import json
+
+from django.db import models
+
+
+class JSONField(models.Field):
+    """
+    JSON document stored in a native 'jsonb' column on PostgreSQL
+    and as text on other databases (used by the tests on SQLite).
+    Values are Python objects on both sides, e.g. lists of dicts.
+    """
+    description = "A JSON document"
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return 'text'
+
+    def from_db_value(self, value, expression, connection):
+        # psycopg2 decodes jsonb columns by itself, also those holding a JSON string
+        if value is None or connection.vendor == 'postgresql':
+            return value
+        return json.loads(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return json.dumps(value)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj))
@@ -0,0 +1,158 @@
+"""
+Bulk import of movies from OMDb.
+
+Titles are fetched concurrently by a bounded pool of threads
+(sharing the pooled OMDb client and its cache), checked against
+movies already in the database and inserted in batches.
+Rows inserted meanwhile by other requests are skipped thanks to
+the unique 'imdbid' and reported as existing (see '_insert_new()').
+"""
+import contextvars
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models import AutoField
+
+from .models import (
+    Movie,
+    ResourceVersion,
+)
+from .search import index_movies
+from .utils import (
+    OmdbUnavailable,
+    fetch_movie,
+    normalize_title,
+)
+
+
+CREATED = 'created'
+EXISTS = 'exists'
+NOT_FOUND = 'not_found'
+UNAVAILABLE = 'unavailable'
+
+
+def _fetch(title):
+    try:
+        return fetch_movie(title)
+    except OmdbUnavailable:
+        return None
+
+
+def _can_return_inserted():
+    return (connection.vendor == 'postgresql'
+            or (connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)))
+
+
+def _insert_new(movies):
+    """
+    Insert the movies, skipping those whose 'imdbid' is already taken
+    (possibly by another request at the same time), and return the inserted ones.
+    The database reports which rows it inserted ('RETURNING'); before SQLite 3.35
+    they're told from those present before the insert instead, which is reliable
+    on SQLite as a transaction can't write over a commit made after its first read.
+    """
+    imdbids = [movie.imdbid for movie in movies]
+    if not _can_return_inserted():
+        before = set(Movie.objects.filter(imdbid__in=imdbids).values_list('imdbid', flat=True))
+        Movie.objects.bulk_create(movies, ignore_conflicts=True)
+        return list(Movie.objects.filter(imdbid__in=imdbids).exclude(imdbid__in=before))
+    fields = [field for field in Movie._meta.concrete_fields if not isinstance(field, AutoField)]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    batch_size = max(connection.ops.bulk_batch_size(fields, movies), 1)
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(movies), batch_size):
+            batch = movies[start:start + batch_size]
+            params = [field.get_db_prep_save(getattr(movie, field.attname), connection)
+                      for movie in batch for field in fields]
+            cursor.execute(f"""
+                INSERT INTO {Movie._meta.db_table} ({columns})
+                VALUES {', '.join([row] * len(batch))}
+                ON CONFLICT (imdbid) DO NOTHING
+                RETURNING id
+            """, params)
+            ids.extend(movie_id for movie_id, in cursor.fetchall())
+    return list(Movie.objects.filter(id__in=ids))
+
+
+def import_titles(titles, workers=None, batch_size=None):
+    """
+    Import movies with the given titles and return a report
+    with one {'title', 'status', 'id'} entry per title, in the given order.
+    Status is one of: 'created', 'exists' (already in the database,
+    inserted meanwhile by another request, or created for an earlier
+    title of the same import),
+    'not_found' (unknown to OMDb or not a movie) and 'unavailable'
+    (OMDb couldn't be reached); 'id' is None for the last two.
+    """
+    workers = workers or settings.IMPORT_WORKERS
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    unique_titles = {}
+    for title in titles:
+        unique_titles.setdefault(normalize_title(title), title)
+    results = {}
+
+    existing = (Movie.objects
+                .filter(title_key__in=list(unique_titles))
+                .order_by('id')
+                .values_list('title_key', 'id'))
+    for title_key, movie_id in existing:
+        results.setdefault(title_key, (EXISTS, movie_id))
+
+    to_fetch = [key for key in unique_titles if key not in results]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # every fetch runs in a copy of the caller's context, to be counted in its request metrics
+        futures = [executor.submit(contextvars.copy_context().run, _fetch, unique_titles[key])
+                   for key in to_fetch]
+        fetched = dict(zip(to_fetch, (future.result() for future in futures)))
+
+    found = {}
+    for key, movie_data in fetched.items():
+        if movie_data is None:
+            results[key] = (UNAVAILABLE, None)
+        elif movie_data.get('response') != 'True' or movie_data.get('type') != 'movie':
+            results[key] = (NOT_FOUND, None)
+        else:
+            found.setdefault(movie_data['imdbid'], movie_data)
+
+    movie_ids = dict(Movie.objects.filter(imdbid__in=list(found)).values_list('imdbid', 'id'))
+    to_create = [movie_data for imdbid, movie_data in found.items() if imdbid not in movie_ids]
+    created = set()
+    for start in range(0, len(to_create), batch_size):
+        batch = [Movie.from_omdb(movie_data) for movie_data in to_create[start:start + batch_size]]
+        with transaction.atomic():
+            new = _insert_new(batch)
+            if new:
+                Movie.link_lookups(new)
+                index_movies(connection, new)
+                ResourceVersion.objects.bump(ResourceVersion.MOVIES)
+            inserted = {movie.imdbid for movie in new}
+            movie_ids.update((movie.imdbid, movie.id) for movie in new)
+            movie_ids.update(Movie.objects
+                             .filter(imdbid__in=[movie.imdbid for movie in batch
+                                                 if movie.imdbid not in inserted])
+                             .values_list('imdbid', 'id'))
+        created.update(inserted)
+
+    for key, movie_data in fetched.items():
+        if key not in results:
+            imdbid = movie_data['imdbid']
+            results[key] = (CREATED if imdbid in created else EXISTS, movie_ids[imdbid])
+            created.discard(imdbid)
+
+    report = []
+    reported = set()
+    for title in titles:
+        key = normalize_title(title)
+        status, movie_id = results[key]
+        if key in reported and status == CREATED:
+            status = EXISTS
+        reported.add(key)
+        report.append({'title': title, 'status': status, 'id': movie_id})
+    return report
@@ -0,0 +1,106 @@
+"""
+Asynchronous ingestion of movies from OMDb.
+
+In asynchronous mode POST /movies doesn't wait for OMDb: a title
+which is neither in the database nor in the OMDb cache is queued
+as an IngestJob and the request is answered with 202 and the URL
+of the job. The 'ingest_worker' command claims due jobs from the
+database (no broker is needed), fetches them concurrently in a pool
+of threads and saves the movies. Fetches which fail because OMDb
+is unavailable, and jobs whose movie can't be saved, are retried with
+an exponential backoff up to INGEST_MAX_ATTEMPTS times.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import (
+    IngestJob,
+    Movie,
+)
+from .utils import (
+    OmdbUnavailable,
+    fetch_movie,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def wants_async(request):
+    """ Asynchronous mode is on for the whole site or asked for with 'Prefer: respond-async' """
+    return settings.INGEST_ASYNC or 'respond-async' in request.META.get('HTTP_PREFER', '')
+
+
+def _fetch(title):
+    try:
+        return fetch_movie(title), None
+    except OmdbUnavailable as exc:
+        return None, str(exc) or 'OMDb is unavailable.'
+    except Exception as exc:
+        logger.exception('Fetching %r from OMDb failed.', title)
+        return None, f'{exc.__class__.__name__}: {exc}'
+
+
+def finish(job, movie_data, error):
+    """ Save the outcome of a job's fetch and the movie, if it was found """
+    job.error = error or ''
+    job.locked_until = None
+    if error is not None:
+        if job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+            job.status = IngestJob.FAILED
+        else:
+            job.status = IngestJob.PENDING
+            job.run_after = timezone.now() + timedelta(
+                seconds=settings.INGEST_RETRY_DELAY * 2 ** (job.attempts - 1))
+    elif movie_data.get('response') == 'True' and movie_data.get('type') == 'movie':
+        job.movie = Movie.get_or_create_from_omdb(movie_data)[0]
+        job.status = IngestJob.DONE
+    else:
+        job.status = IngestJob.NOT_FOUND
+    # a job whose lease ran out may have been claimed again meanwhile - leave it to that worker
+    IngestJob.objects.filter(id=job.id, attempts=job.attempts).update(
+        status=job.status, movie=job.movie, error=job.error, run_after=job.run_after,
+        locked_until=None, updated=timezone.now())
+
+
+def run_jobs(jobs, workers=None):
+    """
+    Fetch the jobs' titles concurrently and save the results; a job
+    whose result can't be saved is retried, without stopping the others.
+    """
+    with ThreadPoolExecutor(max_workers=workers or settings.INGEST_WORKERS) as executor:
+        results = list(executor.map(_fetch, [job.title for job in jobs]))
+    for job, (movie_data, error) in zip(jobs, results):
+        try:
+            finish(job, movie_data, error)
+        except Exception as exc:
+            logger.exception('Saving the result of ingest job %s failed.', job.id)
+            try:
+                finish(job, None, f'{exc.__class__.__name__}: {exc}')
+            except Exception:
+                # left to run again once its lease runs out
+                logger.exception('Saving the failure of ingest job %s failed.', job.id)
+
+
+def work(workers=None, batch_size=None, lease=None, poll_interval=1.0, once=False):
+    """
+    Claim and run jobs until stopped or, with 'once',
+    until no job is due; returns the number of jobs run.
+    """
+    workers = workers or settings.INGEST_WORKERS
+    lease = lease or settings.INGEST_LEASE
+    done = 0
+    while True:
+        jobs = IngestJob.objects.claim(batch_size or workers, lease)
+        if jobs:
+            run_jobs(jobs, workers)
+            done += len(jobs)
+        elif once:
+            return done
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.models import DailyCommentCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily comment count rollup from existing comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rollup rows inserted per query.')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='First day to rebuild (YYYY-MM-DD, default: all days).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Last day to rebuild (YYYY-MM-DD, default: all days).')
+
+    def handle(self, *args, **options):
+        if (options['date_from'] is None) != (options['date_to'] is None):
+            raise CommandError("Both --from and --to have to be given.")
+        rows = DailyCommentCount.objects.rebuild(batch_size=options['batch_size'],
+                                                 date_from=options['date_from'],
+                                                 date_to=options['date_to'])
+        self.stdout.write(f'Rebuilt {rows} daily comment count rows.')
@@ -0,0 +1,92 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from movies.benchmark import (
+    compare,
+    run,
+)
+
+
+def size(value):
+    """ '<movies>:<comments>', e.g. '1000:10000' """
+    try:
+        movies, comments = map(int, value.split(':'))
+    except ValueError:
+        raise CommandError(f"Invalid size '{value}'. The right format is <movies>:<comments>.")
+    return movies, comments
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every endpoint at several data sizes, in a separate test database, '
+            'and optionally compare the results with a previous run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=size, default=[(100, 1000), (1000, 10000)],
+                            help='Data sizes as <movies>:<comments> (default: 100:1000 1000:10000).')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Number of requests per endpoint and size.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Number of days, up to today, comments are spread over.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the data generator.')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the response cache between requests '
+                                 '(by default every request is a cache miss).')
+        parser.add_argument('--output',
+                            help='Save the results as JSON to this file.')
+        parser.add_argument('--compare',
+                            help='JSON results of a previous run to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 growth reported as a regression (default: 0.2).')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Smallest p95 growth in ms reported as a regression.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask before deleting an existing test database.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'])
+        try:
+            results = run(options['sizes'], repeat=options['repeat'], days=options['days'],
+                          seed=options['seed'], warm_cache=options['warm_cache'],
+                          log=self.log_result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if baseline is not None:
+            rows = compare(baseline, results, options['threshold'], options['min_delta_ms'])
+            self.report(rows)
+            regressions = sum(row['regression'] for row in rows)
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) found.')
+
+    def log_result(self, result):
+        self.stdout.write(
+            '{movies:>8} {comments:>9}  {endpoint:<22} p50 {p50_ms:>9.2f} ms  p95 {p95_ms:>9.2f} ms  '
+            'p99 {p99_ms:>9.2f} ms  {queries:>3} queries  {peak_memory_kb:>9.1f} KB'.format(**result))
+
+    def report(self, rows):
+        for row in rows:
+            line = ('{movies:>8} {comments:>9}  {endpoint:<22} p95 {before:>9.2f} -> {after:>9.2f} ms  '
+                    'queries {queries[0]} -> {queries[1]}').format(
+                before=row['p95_ms'][0], after=row['p95_ms'][1], **row)
+            if row['regression']:
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
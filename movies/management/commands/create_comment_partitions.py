@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from movies.partitions import (
+    create_future_partitions,
+    is_partitioned,
+)
+
+
+class Command(BaseCommand):
+    help = ('Create monthly partitions of the comments table (PostgreSQL) '
+            'from the current month on; run it regularly, e.g. monthly.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3,
+                            help='Number of months ahead to create partitions for.')
+
+    def handle(self, *args, **options):
+        if not is_partitioned(connection):
+            self.stdout.write('Comments are not partitioned on this database.')
+            return
+        created = create_future_partitions(connection, options['months'])
+        self.stdout.write(f'Created {len(created)} partitions.')
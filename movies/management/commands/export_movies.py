@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from movies.export import (
+    FORMATS,
+    NDJSON,
+    export_movies,
+)
+
+
+class Command(BaseCommand):
+    help = 'Stream the whole movie catalog as NDJSON or JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default=NDJSON,
+                            help='Output format.')
+        parser.add_argument('--comments', action='store_true',
+                            help='Include comments of every movie.')
+        parser.add_argument('--output',
+                            help='Output file (standard output by default).')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Number of movies read from the database at once '
+                                 '(default: settings.EXPORT_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        chunks = export_movies(options['format'], options['comments'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
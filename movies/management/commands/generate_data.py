@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.models import Movie
+from movies.synthetic import (
+    generate_comments,
+    generate_movies,
+)
+
+
+class Command(BaseCommand):
+    help = 'Add synthetic movies and comments, e.g. to benchmark or try out the API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=1000,
+                            help='Number of movies to add.')
+        parser.add_argument('--comments', type=int, default=10000,
+                            help='Number of comments to add (to all the movies).')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            default=date.today() - timedelta(days=364),
+                            help='First day of comments (YYYY-MM-DD, default: a year ago).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            default=date.today(),
+                            help='Last day of comments (YYYY-MM-DD, default: today).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the random generator.')
+
+    def handle(self, *args, **options):
+        if options['date_from'] > options['date_to']:
+            raise CommandError("'--from' must not be later than '--to'.")
+        added = generate_movies(options['movies'], seed=options['seed'])
+        movie_ids = list(Movie.objects.values_list('id', flat=True))
+        generate_comments(options['comments'], movie_ids,
+                          options['date_from'], options['date_to'], seed=options['seed'])
+        self.stdout.write(f"Added {len(added)} movies and {options['comments']} comments.")
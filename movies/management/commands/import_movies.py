@@ -0,0 +1,38 @@
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from movies.importer import import_titles
+
+
+class Command(BaseCommand):
+    help = 'Import movies from OMDb by title, fetching them concurrently.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('titles', nargs='*',
+                            help='Titles of movies to import.')
+        parser.add_argument('--file',
+                            help="File with one title per line ('-' for standard input).")
+        parser.add_argument('--workers', type=int,
+                            help='Number of concurrent OMDb requests (default: settings.IMPORT_WORKERS).')
+        parser.add_argument('--batch-size', type=int,
+                            help='Number of movies inserted per query (default: settings.IMPORT_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        titles = list(options['titles'])
+        if options['file'] == '-':
+            titles.extend(self.read_titles(sys.stdin))
+        elif options['file']:
+            with open(options['file']) as lines:
+                titles.extend(self.read_titles(lines))
+        report = import_titles(titles, workers=options['workers'],
+                               batch_size=options['batch_size'])
+        for entry in report:
+            self.stdout.write('{status}\t{id}\t{title}'.format(**entry))
+        summary = Counter(entry['status'] for entry in report)
+        self.stdout.write(', '.join(f'{status}: {count}' for status, count in sorted(summary.items())))
+
+    @staticmethod
+    def read_titles(lines):
+        return [line.strip() for line in lines if line.strip()]
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from movies.ingest import work
+
+
+class Command(BaseCommand):
+    help = 'Run queued OMDb fetch jobs of POST /movies in asynchronous mode.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            help='Number of concurrent OMDb requests (default: settings.INGEST_WORKERS).')
+        parser.add_argument('--batch-size', type=int,
+                            help='Number of jobs claimed at once (default: --workers).')
+        parser.add_argument('--lease', type=int,
+                            help='Seconds after which a job of a stopped worker is run again '
+                                 '(default: settings.INGEST_LEASE).')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no job is due.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when no job is due instead of waiting for new ones.')
+
+    def handle(self, *args, **options):
+        done = work(workers=options['workers'], batch_size=options['batch_size'],
+                    lease=options['lease'], poll_interval=options['poll_interval'],
+                    once=options['once'])
+        self.stdout.write(f'Ran {done} jobs.')
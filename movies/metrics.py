@@ -0,0 +1,157 @@
+"""
+Per-request instrumentation: number of queries and time spent
+in SQL, serialization and outbound HTTP (OMDb) calls.
+
+RequestMetricsMiddleware collects them for every request,
+returns them in the 'Server-Timing' header and records them
+in Prometheus histograms labelled by URL name, exposed by
+'metrics_view' on /metrics.
+
+With several worker processes (gunicorn), set the environment
+variable 'prometheus_multiproc_dir' to an empty directory shared
+by the workers (and cleared when the server is restarted);
+/metrics then aggregates the metrics of all the processes.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from rest_framework.renderers import JSONRenderer
+
+
+LABELS = ['view', 'method']
+
+REQUEST_DURATION = Histogram(
+    'moviebox_request_duration_seconds', 'Time spent handling a request.', LABELS)
+SQL_DURATION = Histogram(
+    'moviebox_request_sql_duration_seconds', 'Time spent in SQL queries per request.', LABELS)
+SQL_QUERIES = Histogram(
+    'moviebox_request_sql_queries', 'Number of SQL queries per request.', LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, float('inf')))
+SERIALIZATION_DURATION = Histogram(
+    'moviebox_request_serialization_duration_seconds',
+    'Time spent serializing and rendering data per request.', LABELS)
+HTTP_DURATION = Histogram(
+    'moviebox_request_http_duration_seconds',
+    'Time spent in outbound HTTP (OMDb) calls per request.', LABELS)
+
+
+class RequestTimings:
+    """
+    Totals of a single request. Outbound calls may be made
+    by several threads at once (bulk import), hence the lock.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.serialization = 0.0
+        self.http = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + duration)
+
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time of the block to the current request's 'name' total
+    ('serialization' or 'http'). Outside of a request it does nothing.
+    SQL run inside the block (e.g. evaluating a queryset while
+    serializing it) is counted as SQL only.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    sql_before = timings.sql
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if name != 'http':
+            duration -= timings.sql - sql_before
+        timings.add(name, duration)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """ JSONRenderer counted as serialization in the request metrics """
+    def render(self, *args, **kwargs):
+        with timed('serialization'):
+            return super().render(*args, **kwargs)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with self.sql_timer(timings):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        duration = time.perf_counter() - start
+        self.observe(request, timings, duration)
+        response['Server-Timing'] = ', '.join([
+            f'sql;dur={timings.sql * 1000:.2f};desc="{timings.queries} queries"',
+            f'serialization;dur={timings.serialization * 1000:.2f}',
+            f'http;dur={timings.http * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ])
+        return response
+
+    @contextmanager
+    def sql_timer(self, timings):
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.queries += 1
+                timings.sql += time.perf_counter() - start
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            yield
+
+    @staticmethod
+    def observe(request, timings, duration):
+        match = getattr(request, 'resolver_match', None)
+        labels = (match.view_name if match else 'unmatched', request.method)
+        REQUEST_DURATION.labels(*labels).observe(duration)
+        SQL_DURATION.labels(*labels).observe(timings.sql)
+        SQL_QUERIES.labels(*labels).observe(timings.queries)
+        SERIALIZATION_DURATION.labels(*labels).observe(timings.serialization)
+        HTTP_DURATION.labels(*labels).observe(timings.http)
+
+
+def metrics_view(request):
+    """ Metrics in the Prometheus text format, of all the workers in multiprocess mode """
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
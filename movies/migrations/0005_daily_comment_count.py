@@ -0,0 +1,26 @@
+# Generated by Django 2.2 on 2026-10-18 18:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_auto_20190413_1501'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCommentCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_comment_counts', to='movies.Movie')),
+            ],
+            options={
+                'unique_together': {('movie', 'day')},
+            },
+        ),
+    ]
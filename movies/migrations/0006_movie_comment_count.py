@@ -0,0 +1,37 @@
+# Generated by Django 2.2 on 2026-10-18 18:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Comment = apps.get_model('movies', 'Comment')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Movie = apps.get_model('movies', 'Movie')
+    content_type = ContentType.objects.filter(app_label='movies', model='movie').first()
+    if content_type is None:
+        return
+    counts = (Comment.objects
+              .filter(content_type=content_type, object_id=OuterRef('pk'))
+              .values('object_id')
+              .annotate(count=Count('id'))
+              .values('count'))
+    Movie.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('movies', '0005_daily_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
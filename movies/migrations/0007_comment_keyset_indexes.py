@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_movie_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created', 'id'], name='movies_comm_created_d30f2b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['object_id', 'created', 'id'], name='movies_comm_object__e68fcd_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+def split_names(value):
+    names = (name.strip().lower() for name in value.split(','))
+    return sorted({name for name in names if name and name != 'n/a'})
+
+
+def fill_lookups(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    for field, relation, model_name in (('genre', 'genres', 'Genre'),
+                                        ('director', 'directors', 'Director')):
+        Lookup = apps.get_model('movies', model_name)
+        through = getattr(Movie, relation).through
+        links = {movie_id: split_names(value)
+                 for movie_id, value in Movie.objects.values_list('id', field)}
+        names = sorted({name for movie_names in links.values() for name in movie_names})
+        Lookup.objects.bulk_create([Lookup(name=name) for name in names], ignore_conflicts=True)
+        lookup_ids = dict(Lookup.objects.values_list('name', 'id'))
+        through.objects.bulk_create([
+            through(**{'movie_id': movie_id, f'{field}_id': lookup_ids[name]})
+            for movie_id, movie_names in links.items() for name in movie_names
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_comment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Director',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='directors',
+            field=models.ManyToManyField(related_name='movies', to='movies.Director'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genres',
+            field=models.ManyToManyField(related_name='movies', to='movies.Genre'),
+        ),
+        migrations.RunPython(fill_lookups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.2 on 2026-10-18 18:54
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.db.models.functions import TruncDate
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Keep the oldest of the movies sharing an imdbid,
+    moving the comments of the others to it.
+    """
+    Comment = apps.get_model('movies', 'Comment')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    DailyCommentCount = apps.get_model('movies', 'DailyCommentCount')
+    Movie = apps.get_model('movies', 'Movie')
+    content_type = ContentType.objects.filter(app_label='movies', model='movie').first()
+    duplicated = (Movie.objects
+                  .values('imdbid')
+                  .annotate(kept_id=Min('id'), movies=Count('id'))
+                  .filter(movies__gt=1))
+    for row in duplicated:
+        kept_id = row['kept_id']
+        duplicates = Movie.objects.filter(imdbid=row['imdbid']).exclude(id=kept_id)
+        if content_type is not None:
+            comments = Comment.objects.filter(content_type=content_type)
+            comments.filter(object_id__in=duplicates.values('id')).update(object_id=kept_id)
+            movie_comments = comments.filter(object_id=kept_id)
+            Movie.objects.filter(id=kept_id).update(comment_count=movie_comments.count())
+            DailyCommentCount.objects.filter(movie_id=kept_id).delete()
+            DailyCommentCount.objects.bulk_create([
+                DailyCommentCount(movie_id=kept_id, day=day['day'], count=day['count'])
+                for day in (movie_comments
+                            .annotate(day=TruncDate('created'))
+                            .values('day')
+                            .annotate(count=Count('id'))
+                            .order_by())
+            ])
+        duplicates.delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # the deletes queue deferred foreign key checks, and PostgreSQL can't
+        # ALTER a table with pending trigger events - run them now
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('movies', '0008_genre_director_lookups'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='movie',
+            name='imdbid',
+            field=models.TextField(unique=True),
+        ),
+    ]
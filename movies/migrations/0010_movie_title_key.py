@@ -0,0 +1,28 @@
+# Generated by Django 2.2 on 2026-10-18 18:56
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def fill_title_keys(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    movies = list(Movie.objects.only('id', 'title'))
+    for movie in movies:
+        movie.title_key = slugify(movie.title)
+    Movie.objects.bulk_update(movies, ['title_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_unique_imdbid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='title_key',
+            field=models.TextField(db_index=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_title_keys, migrations.RunPython.noop),
+    ]
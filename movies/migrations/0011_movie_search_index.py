@@ -0,0 +1,93 @@
+# Generated by Django 2.2 on 2026-10-18 18:58
+
+from django.db import migrations
+
+
+POSTGRESQL_INSTALL = [
+    "ALTER TABLE movies_movie ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION movies_movie_search_vector() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE'
+                AND NEW.title IS NOT DISTINCT FROM OLD.title
+                AND NEW.actors IS NOT DISTINCT FROM OLD.actors
+                AND NEW.writer IS NOT DISTINCT FROM OLD.writer
+                AND NEW.plot IS NOT DISTINCT FROM OLD.plot
+                AND NEW.search_vector IS NOT NULL THEN
+            RETURN NEW;
+        END IF;
+        NEW.search_vector :=
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.actors, '')), 'B') ||
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.writer, '')), 'B') ||
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.plot, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS movies_movie_search_vector ON movies_movie",
+    """
+    CREATE TRIGGER movies_movie_search_vector
+    BEFORE INSERT OR UPDATE ON movies_movie
+    FOR EACH ROW EXECUTE PROCEDURE movies_movie_search_vector()
+    """,
+    "UPDATE movies_movie SET search_vector = NULL WHERE search_vector IS NULL",
+    """
+    CREATE INDEX IF NOT EXISTS movies_movie_search_vector_idx
+    ON movies_movie USING GIN (search_vector)
+    """,
+]
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS movies_movie_fts
+    USING fts5(title, plot, actors, writer)
+    """,
+    """
+    INSERT INTO movies_movie_fts (rowid, title, plot, actors, writer)
+    SELECT id, title, plot, actors, writer FROM movies_movie
+    WHERE id NOT IN (SELECT rowid FROM movies_movie_fts)
+    """,
+]
+
+
+def install(apps, schema_editor):
+    """ Create the search index (and its triggers) and index existing movies """
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_INSTALL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_INSTALL
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def uninstall(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = [
+            "DROP TRIGGER IF EXISTS movies_movie_search_vector ON movies_movie",
+            "DROP FUNCTION IF EXISTS movies_movie_search_vector()",
+            "ALTER TABLE movies_movie DROP COLUMN IF EXISTS search_vector",
+        ]
+    elif connection.vendor == 'sqlite':
+        statements = ["DROP TABLE IF EXISTS movies_movie_fts"]
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0010_movie_title_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 2.2 on 2026-10-18 19:02
+
+import json
+import math
+import re
+from functools import partial
+
+from django.db import migrations, models
+import movies.fields
+
+
+SMALLINT_MAX = 2 ** 15 - 1
+INT_MAX = 2 ** 31 - 1
+
+
+def parse_int(value, maximum):
+    match = re.search(r'\d[\d,]*', value or '')
+    number = int(match.group().replace(',', '')) if match else None
+    return number if number is not None and number <= maximum else None
+
+
+def parse_float(value):
+    match = re.search(r'\d+(\.\d+)?', value or '')
+    number = float(match.group()) if match else None
+    return number if number is not None and math.isfinite(number) else None
+
+
+NUMBER_FIELDS = {
+    'year_number': ('year', partial(parse_int, maximum=SMALLINT_MAX)),
+    'runtime_minutes': ('runtime', partial(parse_int, maximum=INT_MAX)),
+    'metascore_number': ('metascore', partial(parse_int, maximum=SMALLINT_MAX)),
+    'imdbrating_number': ('imdbrating', parse_float),
+    'imdbvotes_number': ('imdbvotes', partial(parse_int, maximum=INT_MAX)),
+}
+
+
+def clean_ratings(apps, schema_editor):
+    """ Replace values which are not valid JSON, so they can be cast to jsonb """
+    Movie = apps.get_model('movies', 'Movie')
+    invalid = []
+    for movie_id, ratings in Movie.objects.values_list('id', 'ratings').iterator():
+        try:
+            json.loads(ratings)
+        except ValueError:
+            invalid.append(movie_id)
+    Movie.objects.filter(id__in=invalid).update(ratings='[]')
+
+
+def fill_numbers(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    sources = [source for source, parse in NUMBER_FIELDS.values()]
+    movies = list(Movie.objects.only('id', *sources))
+    for movie in movies:
+        for field, (source, parse) in NUMBER_FIELDS.items():
+            setattr(movie, field, parse(getattr(movie, source)))
+    Movie.objects.bulk_update(movies, list(NUMBER_FIELDS), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0011_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='imdbrating_number',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='imdbvotes_number',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='metascore_number',
+            field=models.PositiveSmallIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='runtime_minutes',
+            field=models.PositiveIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='year_number',
+            field=models.PositiveSmallIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_numbers, migrations.RunPython.noop),
+        migrations.RunPython(clean_ratings, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='movie',
+            name='ratings',
+            field=movies.fields.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,133 @@
+import logging
+from datetime import date
+
+from django.db import migrations
+from django.utils import timezone
+
+
+TABLE = 'movies_comment'
+DEFAULT_PARTITION = f'{TABLE}_default'
+MONTHS_AHEAD = 3
+
+logger = logging.getLogger(__name__)
+
+
+def supports_partitions(connection):
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned(cursor):
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table
+                       WHERE partrelid = to_regclass(%s))
+    """, [TABLE])
+    return cursor.fetchone()[0]
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def table_definition(cursor):
+    """ Definitions of the indexes and foreign keys of the table, to restore on its copy """
+    cursor.execute("""
+        SELECT indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s
+    """, [TABLE, f'{TABLE}_pkey'])
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+    """, [TABLE])
+    foreign_keys = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+    sequence = cursor.fetchone()[0]
+    return indexes, foreign_keys, sequence
+
+
+def replace_table(cursor, create_sql, primary_key, before_copy=None):
+    """
+    Copy the comments to a new table created by 'create_sql', replace the table
+    with it and restore the primary key, the indexes and the foreign keys.
+    """
+    new_table = f'{TABLE}_new'
+    indexes, foreign_keys, sequence = table_definition(cursor)
+    cursor.execute(create_sql.format(table=new_table))
+    if before_copy:
+        before_copy(cursor, new_table)
+    cursor.execute(f"INSERT INTO {new_table} SELECT * FROM {TABLE}")
+    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {new_table}.id")
+    cursor.execute(f"DROP TABLE {TABLE}")
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {TABLE}")
+    cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ({primary_key})")
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def partition(apps, schema_editor):
+    """
+    Turn movies_comment into a table partitioned by month of 'created' (UTC),
+    with partitions from the month of the oldest comment to MONTHS_AHEAD
+    months from now and a default partition for the other months.
+    """
+    connection = schema_editor.connection
+    if not supports_partitions(connection):
+        logger.warning('Comments are not partitioned: partitioning needs PostgreSQL 11 or newer, '
+                       'so %s stays a single table on this database (%s).',
+                       TABLE, connection.vendor)
+        return
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        cursor.execute(f"SELECT min(created) FROM {TABLE}")
+        oldest = cursor.fetchone()[0]
+        now = timezone.now().date()
+        month = (timezone.localtime(oldest, timezone.utc).date() if oldest else now).replace(day=1)
+        last = now.replace(day=1)
+        for _ in range(MONTHS_AHEAD):
+            last = next_month(last)
+
+        def add_partitions(cursor, new_table):
+            cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {new_table} DEFAULT")
+            first = month
+            while first <= last:
+                cursor.execute(f"""
+                    CREATE TABLE {TABLE}_p{first:%Y_%m} PARTITION OF {new_table}
+                    FOR VALUES FROM (%s) TO (%s)
+                """, [f'{first} 00:00:00+00', f'{next_month(first)} 00:00:00+00'])
+                first = next_month(first)
+
+        replace_table(
+            cursor,
+            f"CREATE TABLE {{table}} (LIKE {TABLE} INCLUDING DEFAULTS) PARTITION BY RANGE (created)",
+            primary_key='id, created',
+            before_copy=add_partitions,
+        )
+
+
+def unpartition(apps, schema_editor):
+    """ Turn movies_comment back into a single table """
+    connection = schema_editor.connection
+    if not supports_partitions(connection):
+        return
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return
+        replace_table(
+            cursor,
+            f"CREATE TABLE {{table}} (LIKE {TABLE} INCLUDING DEFAULTS)",
+            primary_key='id',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0014_ingest_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
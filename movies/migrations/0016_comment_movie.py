@@ -0,0 +1,46 @@
+# Generated by Django 2.2 on 2026-10-18 19:23
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+
+def fill_movies(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Comment = apps.get_model('movies', 'Comment')
+    Movie = apps.get_model('movies', 'Movie')
+    content_type = ContentType.objects.filter(app_label='movies', model='movie').first()
+    if content_type is None:
+        return
+    (Comment.objects
+     .filter(content_type=content_type, object_id__in=Movie.objects.values('id'))
+     .update(movie_id=F('object_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('movies', '0015_comment_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='movie',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='movie_comments', to='movies.Movie'),
+        ),
+        migrations.RunPython(fill_movies, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['content_type', 'object_id', 'created'], name='movies_comm_content_cbd5ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['movie', 'created', 'id'], name='movies_comm_movie_i_d63736_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='movies_comm_object__e68fcd_idx',
+        ),
+    ]
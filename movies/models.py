@@ -1,10 +1,137 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from functools import partial, reduce
+from itertools import chain
+from operator import or_
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    models,
+    router,
+    transaction,
+)
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import (
     GenericForeignKey,
     GenericRelation,
 )
 
+from .fields import JSONField
+from .utils import (
+    normalize_title,
+    parse_float,
+    parse_int,
+    split_names,
+)
+
+
+# keys of a single UPDATE of add_to_counts(), well below the parameter
+# and expression depth limits of SQLite
+COUNTS_BATCH_SIZE = 100
+
+
+def add_to_counts(queryset, field, deltas):
+    """
+    Shift 'field' of many rows of 'queryset' by different amounts,
+    given as a list of (Q matching the rows, delta), with one
+    UPDATE ... SET field = field + CASE ... per COUNTS_BATCH_SIZE of them.
+    """
+    for start in range(0, len(deltas), COUNTS_BATCH_SIZE):
+        batch = deltas[start:start + COUNTS_BATCH_SIZE]
+        increment = Case(*[When(condition, then=Value(delta)) for condition, delta in batch],
+                         default=Value(0), output_field=models.IntegerField())
+        queryset.filter(reduce(or_, [condition for condition, delta in batch])).update(
+            **{field: F(field) + increment})
+
+
+# largest values of the positive small and regular integer columns on every database
+SMALLINT_MAX = 2 ** 15 - 1
+INT_MAX = 2 ** 31 - 1
+
+
+def day_bounds(date_from, date_to):
+    """
+    Start of 'date_from' and start of the day after 'date_to'
+    in the current time zone, as aware datetimes.
+    """
+    start = timezone.make_aware(datetime.combine(date_from, time.min), is_dst=False)
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min),
+                              is_dst=False)
+    return start, end
+
+
+# deletions of movies in progress in this thread (see 'deleting_movies()')
+_deleting = threading.local()
+
+
+@contextmanager
+def deleting_movies(using):
+    """
+    Mark a deletion of movies from the database 'using' in this thread.
+    Meanwhile the delete signals tally the comments going with the movies
+    in the yielded dict, by movie id, instead of updating the counters
+    of the movies one by one (see movies.signals). The tally is dropped
+    once the deletion ends, also when it fails and is rolled back.
+    """
+    scopes = _deleting.__dict__.setdefault('scopes', {})
+    if using in scopes:
+        yield scopes[using]
+        return
+    scopes[using] = {}
+    try:
+        yield scopes[using]
+    finally:
+        del scopes[using]
+
+
+def movie_deletions(using):
+    """ The tally of the deletion of movies in progress on 'using', or None """
+    return getattr(_deleting, 'scopes', {}).get(using)
+
+
+class _InSubquery(RawSQL):
+    """ Raw SQL of a subquery for 'in', which puts the parentheses around it itself """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class CommentQuerySet(models.QuerySet):
+    def created_between(self, date_from, date_to):
+        """
+        Comments created on the days from 'date_from' to 'date_to' (inclusive,
+        in the current time zone). Unlike 'created__date__range', which casts
+        every row's 'created' to a date, the range is on the column itself,
+        so the index on 'created' and, on PostgreSQL, partition pruning
+        (see movies.partitions) can be used.
+        """
+        start, end = day_bounds(date_from, date_to)
+        return self.filter(created__gte=start, created__lt=end)
+
+    def latest_of_movies(self, movie_ids, limit):
+        """
+        The latest 'limit' comments of each of the movies. Their ids come from
+        a UNION ALL of a LIMIT query per movie, each reading only its 'limit'
+        entries of the (movie, created, id) index, however many comments
+        the movie has (a window function or a correlated subquery would
+        go through all of them).
+        """
+        parts, params = [], []
+        for number, movie_id in enumerate(movie_ids):
+            latest = (Comment.objects.filter(movie_id=movie_id)
+                      .order_by('-created', '-id').values('id')[:limit])
+            sql, latest_params = latest.query.sql_with_params()
+            parts.append(f'SELECT id FROM ({sql}) AS latest_{number}')
+            params.extend(latest_params)
+        if not parts:
+            return self.none()
+        return self.filter(id__in=_InSubquery(' UNION ALL '.join(parts), params))
+
 
 class Comment(models.Model):
     """
@@ -13,6 +140,12 @@ class Comment(models.Model):
     However, I decided to use contenttypes,
     what enables us to add possible new models
     in the future. (e.g. Series).
+    
+    'movie' is a denormalized foreign key, equal to 'object_id'
+    for comments of movies and None for any other content type.
+    It is set by 'set_movie()' on every save (code saving comments
+    with 'bulk_create()' has to set it itself), so queries
+    of movie comments join and filter on one indexed column.
     """
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
@@ -20,6 +153,61 @@ class Comment(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+    # indexed by ('movie', 'created', 'id') below
+    movie = models.ForeignKey('Movie', null=True, on_delete=models.CASCADE, db_index=False,
+                              editable=False, related_name='movie_comments')
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id']),
+            models.Index(fields=['content_type', 'object_id', 'created']),
+            models.Index(fields=['movie', 'created', 'id']),
+        ]
+
+    def set_movie(self):
+        if self.content_type_id == ContentType.objects.get_for_model(Movie).id:
+            self.movie_id = self.object_id
+        else:
+            self.movie_id = None
+
+    def save(self, *args, **kwargs):
+        self.set_movie()
+        super().save(*args, **kwargs)
+
+
+class NameLookupManager(models.Manager):
+    def for_names(self, names):
+        """ Get rows for the given names, creating the missing ones """
+        self.bulk_create([self.model(name=name) for name in names], ignore_conflicts=True)
+        return self.filter(name__in=names)
+
+
+class Genre(models.Model):
+    """
+    A single genre token of Movie.genre (lowercase),
+    used to filter movies by genre with an index.
+    """
+    name = models.TextField(unique=True)
+
+    objects = NameLookupManager()
+
+
+class Director(models.Model):
+    """
+    A single director of Movie.director (lowercase),
+    used to filter movies by director with an index.
+    """
+    name = models.TextField(unique=True)
+
+    objects = NameLookupManager()
+
+
+class MovieQuerySet(models.QuerySet):
+    def delete(self):
+        with deleting_movies(self.db):
+            return super().delete()
 
 
 class Movie(models.Model):
@@ -29,12 +217,30 @@ class Movie(models.Model):
     to use TextField instead of making assumptions on data size
     and limit entries in our tables using CharField.
     
-    I decided to make field 'ratings' JSON serialized,
-    as we don't use this field in our project.
-    If needed in possible GUI,
-    those values could be deserialized in JavaScript.
+    Field 'ratings' is kept as a JSON document (jsonb on PostgreSQL),
+    as we don't query into it, only return it as it came from OMDb.
+    
+    OMDb returns numbers as text ('136 min', '1,488,823', 'N/A'),
+    so 'year_number', 'runtime_minutes', 'metascore_number',
+    'imdbrating_number' and 'imdbvotes_number' hold them parsed,
+    as indexed columns which GET /movies can filter and sort on.
+    They are None when OMDb has no value. Like 'title_key',
+    they are set by 'set_derived_fields()' on every save.
+    
+    'comment_count' is a denormalized number of comments,
+    kept in sync by signals on Comment, so that lists of movies
+    don't need to count comments of every single movie.
+    
+    'title_key' is the title normalized the same way as titles
+    sent to OMDb, indexed for exact lookups by POST /movies.
+    It is set on every save.
+    
+    'genres' and 'directors' hold the comma-separated values
+    of 'genre' and 'director' split into indexed lookup tables.
+    They are refreshed by 'sync_lookups()' whenever a movie is saved.
     """
     title = models.TextField()
+    title_key = models.TextField(db_index=True, editable=False, default='')
     year = models.TextField()
     rated = models.TextField()
     released = models.TextField()
@@ -48,15 +254,294 @@ class Movie(models.Model):
     country = models.TextField()
     awards = models.TextField()
     poster = models.TextField()
-    ratings = models.TextField()
+    ratings = JSONField(default=list)
     metascore = models.TextField()
     imdbrating = models.TextField()
     imdbvotes = models.TextField()
-    imdbid = models.TextField()
+    imdbid = models.TextField(unique=True)
     type = models.TextField()
     dvd = models.TextField()
     boxoffice = models.TextField()
     production = models.TextField()
     website = models.TextField()
     response = models.TextField()
+    year_number = models.PositiveSmallIntegerField(null=True, db_index=True, editable=False)
+    runtime_minutes = models.PositiveIntegerField(null=True, db_index=True, editable=False)
+    metascore_number = models.PositiveSmallIntegerField(null=True, db_index=True, editable=False)
+    imdbrating_number = models.FloatField(null=True, db_index=True, editable=False)
+    imdbvotes_number = models.PositiveIntegerField(null=True, db_index=True, editable=False)
+    comment_count = models.PositiveIntegerField(default=0)
+    genres = models.ManyToManyField(Genre, related_name='movies')
+    directors = models.ManyToManyField(Director, related_name='movies')
     comments = GenericRelation(Comment, related_query_name='movies')
+
+    objects = MovieQuerySet.as_manager()
+
+    # typed column: (OMDb text field, parser); numbers which don't fit
+    # the column on every database are stored as None, like 'N/A'
+    NUMBER_FIELDS = {
+        'year_number': ('year', partial(parse_int, maximum=SMALLINT_MAX)),
+        'runtime_minutes': ('runtime', partial(parse_int, maximum=INT_MAX)),
+        'metascore_number': ('metascore', partial(parse_int, maximum=SMALLINT_MAX)),
+        'imdbrating_number': ('imdbrating', parse_float),
+        'imdbvotes_number': ('imdbvotes', partial(parse_int, maximum=INT_MAX)),
+    }
+
+    @classmethod
+    def from_omdb(cls, movie_data):
+        """ Build an unsaved movie from the data returned by 'fetch_movie()' """
+        field_names = {field.name for field in cls._meta.concrete_fields}
+        data = {key: value for key, value in movie_data.items() if key in field_names}
+        data['ratings'] = movie_data.get('ratings', [])
+        movie = cls(**data)
+        movie.set_derived_fields()
+        return movie
+
+    @classmethod
+    def get_or_create_from_omdb(cls, movie_data):
+        """
+        Idempotent insert keyed on the unique 'imdbid'.
+        When the movie is already there (or another request inserts it
+        at the same time) the existing row is returned instead.
+        Returns a (movie, created) tuple, like 'get_or_create()'.
+        """
+        movie = cls.from_omdb(movie_data)
+        try:
+            with transaction.atomic():
+                movie.save(force_insert=True)
+        except IntegrityError:
+            return cls.objects.get(imdbid=movie.imdbid), False
+        return movie, True
+
+    @classmethod
+    def link_lookups(cls, movies):
+        """
+        Link genres and directors of movies saved with 'bulk_create()',
+        which skips the post_save signal, using a few queries for all of them.
+        """
+        for field, lookup_model in (('genre', Genre), ('director', Director)):
+            through = cls._meta.get_field(f'{field}s').remote_field.through
+            names = {movie.pk: split_names(getattr(movie, field)) for movie in movies}
+            lookups = lookup_model.objects.for_names(sorted(set(chain(*names.values()))))
+            lookup_ids = dict(lookups.values_list('name', 'id'))
+            through.objects.bulk_create([
+                through(**{'movie_id': movie_id, f'{field}_id': lookup_ids[name]})
+                for movie_id, movie_names in names.items() for name in movie_names
+            ], ignore_conflicts=True)
+
+    def set_derived_fields(self):
+        """ Fill 'title_key' and the typed number columns from the OMDb fields """
+        self.title_key = normalize_title(self.title)
+        for field, (source, parse) in self.NUMBER_FIELDS.items():
+            setattr(self, field, parse(getattr(self, source)))
+
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+        super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        with deleting_movies(using or router.db_for_write(Movie, instance=self)):
+            return super().delete(using, keep_parents)
+
+    def sync_lookups(self):
+        self.genres.set(Genre.objects.for_names(split_names(self.genre)))
+        self.directors.set(Director.objects.for_names(split_names(self.director)))
+
+
+class DailyCommentCountManager(models.Manager):
+    def add(self, movie_id, day, delta):
+        """
+        Atomically shift the counter of a single (movie, day) row.
+        The row is created on the first comment of the day;
+        a concurrent insert of the same row is caught by the unique
+        constraint, after which the increment is simply retried.
+        """
+        rows = self.filter(movie_id=movie_id, day=day)
+        if rows.update(count=F('count') + delta) or delta < 0:
+            return
+        if not Movie.objects.filter(pk=movie_id).exists():
+            return
+        try:
+            with transaction.atomic():
+                self.create(movie_id=movie_id, day=day, count=delta)
+        except IntegrityError:
+            rows.update(count=F('count') + delta)
+
+    def add_many(self, deltas):
+        """
+        Shift the counters of many rows, given as {(movie_id, day): delta},
+        with a few queries whatever their number: the missing rows are
+        inserted empty (keeping the ones inserted meanwhile by others)
+        and then all of them are shifted at once (see add_to_counts()).
+        The movies must not be deleted meanwhile - lock them first.
+        """
+        if not deltas:
+            return
+        self.bulk_create([self.model(movie_id=movie_id, day=day, count=0)
+                          for movie_id, day in deltas], ignore_conflicts=True)
+        add_to_counts(self.all(), 'count', [(Q(movie_id=movie_id, day=day), delta)
+                                            for (movie_id, day), delta in deltas.items()])
+
+    def rebuild(self, batch_size=None, date_from=None, date_to=None):
+        """
+        Rebuild the rollup from existing comments, of all the days
+        or only from 'date_from' to 'date_to'; returns the number of rows.
+        Comments (and their history) are marked as changed, as the ranking
+        of GET /top may change.
+        """
+        comments = Comment.objects.filter(movie__isnull=False)
+        rollup_rows = self.all()
+        if date_from is not None and date_to is not None:
+            comments = comments.created_between(date_from, date_to)
+            rollup_rows = rollup_rows.filter(day__range=(date_from, date_to))
+        rows = (comments
+                .annotate(day=TruncDate('created'))
+                .values('movie_id', 'day')
+                .annotate(count=Count('id'))
+                .order_by())
+        rollup = [self.model(movie_id=row['movie_id'], day=row['day'], count=row['count'])
+                  for row in rows.iterator()]
+        with transaction.atomic():
+            rollup_rows.delete()
+            self.bulk_create(rollup, batch_size=batch_size)
+            ResourceVersion.objects.bump(ResourceVersion.COMMENTS, ResourceVersion.COMMENTS_HISTORY)
+        return len(rollup)
+
+
+class DailyCommentCount(models.Model):
+    """
+    Rollup of the number of comments posted for a movie on a given day
+    (in the current time zone, the same way as 'created__date' works).
+    It is kept up to date by signals on Comment, so MovieTopAPIView
+    sums a few rows per movie instead of scanning all the comments.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE,
+                              related_name='daily_comment_counts')
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    objects = DailyCommentCountManager()
+
+    class Meta:
+        unique_together = ('movie', 'day')
+
+
+class ResourceVersionManager(models.Manager):
+    def bump(self, *names):
+        """
+        Mark the resources as changed: increment their versions
+        and set their modification time, creating missing rows.
+        """
+        now = timezone.now()
+        if self.filter(name__in=names).update(version=F('version') + 1, modified=now) == len(names):
+            return
+        existing = set(self.filter(name__in=names).values_list('name', flat=True))
+        missing = set(names) - existing
+        # inserted empty and then bumped, as other requests may insert them meanwhile
+        self.bulk_create([self.model(name=name, version=0, modified=now) for name in missing],
+                         ignore_conflicts=True)
+        self.filter(name__in=missing).update(version=F('version') + 1, modified=now)
+
+    def stamps(self, names):
+        """ {name: (version, modified)} of the given resources, with a single query """
+        stamps = {name: (0, None) for name in names}
+        for name, version, modified in self.filter(name__in=names).values_list(
+                'name', 'version', 'modified'):
+            stamps[name] = (version, modified)
+        return stamps
+
+
+class ResourceVersion(models.Model):
+    """
+    Version stamp of a collection, bumped by signals on every write to it:
+    'movies', 'comments', comments of a single movie ('comments:<id>')
+    and 'comments-history' - comments from before today, which change
+    only when such an old comment is deleted.
+    Views build their ETag and response cache keys
+    from the stamps of the collections they read, so conditional
+    and cached requests are answered with a single small query
+    instead of the full one.
+    """
+    MOVIES = 'movies'
+    COMMENTS = 'comments'
+    COMMENTS_HISTORY = 'comments-history'
+
+    name = models.TextField(unique=True)
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField()
+
+    objects = ResourceVersionManager()
+
+    @staticmethod
+    def comments_of(movie_id):
+        return f'{ResourceVersion.COMMENTS}:{movie_id}'
+
+
+class IngestJobManager(models.Manager):
+    def enqueue(self, title):
+        """
+        Queue a fetch of the title from OMDb, unless one
+        is already waiting or running; returns the job.
+        """
+        title_key = normalize_title(title)
+        job = self.filter(title_key=title_key, status__in=IngestJob.ACTIVE).order_by('id').first()
+        return job or self.create(title=title, title_key=title_key)
+
+    def claim(self, limit, lease):
+        """
+        Take up to 'limit' jobs to run: pending ones which are due and running ones
+        whose worker's lease of 'lease' seconds has run out (the worker died).
+        Every job is claimed with a conditional UPDATE on its number of attempts,
+        so when several workers try to take the same job only one of them gets it.
+        Running jobs which have used up their INGEST_MAX_ATTEMPTS attempts
+        (their workers kept dying on them) are failed instead.
+        """
+        now = timezone.now()
+        expired = models.Q(status=IngestJob.RUNNING, locked_until__lt=now)
+        self.filter(expired, attempts__gte=settings.INGEST_MAX_ATTEMPTS).update(
+            status=IngestJob.FAILED, locked_until=None, updated=now,
+            error='The worker stopped while running the job on every attempt.')
+        due = models.Q(status=IngestJob.PENDING, run_after__lte=now) | expired
+        claimed = []
+        for job in self.filter(due).order_by('run_after', 'id')[:limit]:
+            claimed_rows = self.filter(due, id=job.id, attempts=job.attempts).update(
+                status=IngestJob.RUNNING, attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=lease))
+            if claimed_rows:
+                job.refresh_from_db()
+                claimed.append(job)
+        return claimed
+
+
+class IngestJob(models.Model):
+    """
+    A fetch of a movie from OMDb, queued by POST /movies in asynchronous
+    mode and run by the 'ingest_worker' command (see movies.ingest).
+    Failed fetches are retried after 'run_after'; 'locked_until' is
+    the end of the lease of the worker running the job.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    NOT_FOUND = 'not_found'
+    FAILED = 'failed'
+    STATUSES = [(status, status) for status in (PENDING, RUNNING, DONE, NOT_FOUND, FAILED)]
+    ACTIVE = (PENDING, RUNNING)
+
+    title = models.TextField()
+    title_key = models.TextField(db_index=True)
+    status = models.TextField(choices=STATUSES, default=PENDING)
+    movie = models.ForeignKey(Movie, null=True, on_delete=models.SET_NULL, related_name='+')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = IngestJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
@@ -0,0 +1,86 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination ordered by ('created', 'id').
+    
+    The cursor holds the position of the last object on the page,
+    so the next page is fetched with a range condition on
+    an index instead of OFFSET - the cost of getting page 10 000
+    is the same as the cost of getting the first one.
+    The cursor is opaque to clients: they only follow 'next' links.
+    """
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+    # largest id of the database's integer primary keys
+    max_pk = 2 ** 31 - 1
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by('created', 'id')
+        position = self.decode_cursor(request)
+        if position is not None:
+            created, pk = position
+            queryset = (queryset
+                        .filter(created__gte=created)
+                        .exclude(created=created, id__lte=pk))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_position = (page[-1].created, page[-1].id) if self.has_next else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        return None
+
+    def encode_cursor(self, position):
+        created, pk = position
+        return b64encode(f'{created.isoformat()}|{pk}'.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            created, pk = b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None or not 0 <= pk <= self.max_pk:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk
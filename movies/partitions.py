@@ -0,0 +1,117 @@
+"""
+Monthly partitions of the comments table on PostgreSQL.
+
+movies_comment is partitioned by range of 'created', one partition
+per calendar month (UTC), named movies_comment_p<yyyy>_<mm>, plus
+a default partition for the months without one, so that an insert
+never fails. A query with a range on 'created' itself (see
+CommentQuerySet.created_between) reads only the partitions
+of the months in range, however long the history is.
+
+Partitions of the coming months are created by the migration and by
+the 'create_comment_partitions' command, which should be run regularly
+(e.g. monthly from cron); rows which meanwhile landed in the default
+partition are moved to the new partition of their month, in the same
+transaction as attaching it.
+
+Partitioning needs PostgreSQL 11. As the primary key of a partitioned
+table has to include the partition key, it's (id, created); ids still
+come from a single sequence. There is no per-month fallback on other
+databases (SQLite is used locally): comments stay in one table, where
+the same ranges use the index on 'created', and migration 0015 logs
+a warning that it skipped partitioning.
+"""
+from datetime import date
+
+from django.db import transaction
+from django.utils import timezone
+
+
+TABLE = 'movies_comment'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def supports_partitions(connection):
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned(connection):
+    if not supports_partitions(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM pg_partitioned_table
+                           WHERE partrelid = to_regclass(%s))
+        """, [TABLE])
+        return cursor.fetchone()[0]
+
+
+def months(first, last):
+    """ First days of the months from the month of 'first' to the month of 'last' """
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def is_attached(cursor, name):
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_inherits
+                       WHERE inhrelid = to_regclass(%s) AND inhparent = to_regclass(%s))
+    """, [name, TABLE])
+    return cursor.fetchone()[0]
+
+
+def create_partitions(connection, first, last):
+    """
+    Create the missing partitions of the months from 'first' to 'last',
+    moving their rows out of the default partition; returns their names.
+    Every month is done in a transaction holding a lock on the default
+    partition, so that no row of the month lands there before the new
+    partition is attached. A table of the month left detached
+    (e.g. by an older, failed run) is reused, with the rows it holds.
+    """
+    created = []
+    if not is_partitioned(connection):
+        return created
+    with connection.cursor() as cursor:
+        for month in months(first, last):
+            name = partition_name(month)
+            if is_attached(cursor, name):
+                continue
+            bounds = [f'{month} 00:00:00+00', f'{next_month(month)} 00:00:00+00']
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+                # the default partition can't hold rows of an attached partition's range
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {DEFAULT_PARTITION}
+                        WHERE created >= %s AND created < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """, bounds)
+                cursor.execute(f"""
+                    ALTER TABLE {TABLE} ATTACH PARTITION {name}
+                    FOR VALUES FROM (%s) TO (%s)
+                """, bounds)
+            created.append(name)
+    return created
+
+
+def create_future_partitions(connection, months_ahead=3):
+    """ Partitions from the current month to 'months_ahead' months later """
+    first = timezone.now().date().replace(day=1)
+    last = first
+    for _ in range(months_ahead):
+        last = next_month(last)
+    return create_partitions(connection, first, last)
@@ -0,0 +1,63 @@
+"""
+Cache of responses of read endpoints, in the 'responses' cache.
+
+Entries are keyed on the endpoint, the normalized query parameters
+and the versions of the collections the response depends on
+(see movies.conditional). A write bumps the versions of
+the collections it changes, so only the entries depending on them
+stop being used - nothing is deleted or flushed. As the versions
+are kept in the database, this holds with a cache local
+to every process (local-memory, file-based) as well.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.decorators import method_decorator
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conditional import resource_stamps
+
+
+def normalized_params(query_dict):
+    """ Query parameters independent of their order, without empty values """
+    params = ((key, sorted(value for value in query_dict.getlist(key) if value))
+              for key in query_dict)
+    return sorted((key, values) for key, values in params if values)
+
+
+def cache_key(endpoint, request, stamps):
+    key = repr([
+        normalized_params(request.GET),
+        # with the time as well, so that versions repeated after restoring
+        # the database from a backup don't match old entries
+        sorted((name, version, str(modified)) for name, (version, modified) in stamps.items()),
+        request.get_host(),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    return f'response:{endpoint}:{hashlib.sha1(key.encode()).hexdigest()}'
+
+
+def cached_response(endpoint, ttl_setting, dependencies):
+    """
+    Decorator of a view's 'get()' caching the data of its successful
+    responses for as many seconds as the setting named 'ttl_setting'.
+    'dependencies' are the collections the response depends on,
+    as in 'versioned()'.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            cache = caches['responses']
+            key = cache_key(endpoint, request, resource_stamps(request, dependencies))
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, getattr(settings, ttl_setting))
+            return response
+        return wrapper
+    return method_decorator(decorator, name='get')
@@ -0,0 +1,82 @@
+"""
+Routing of reads to database replicas.
+
+ReplicaRoutingMiddleware picks one of settings.DATABASE_REPLICAS
+for every GET and HEAD request, so all the reads of a request see
+the same replica, and ReplicaRouter sends reads there. Writes
+(and reads outside of such requests, e.g. in management commands)
+always go to 'default', the primary.
+
+Replicas lag behind the primary, so after a successful write a client
+is given a cookie with the time of the write and its reads stay
+on the primary for settings.READ_YOUR_WRITES_WINDOW seconds.
+"""
+import contextvars
+import random
+import time
+
+from django.conf import settings
+
+
+LAST_WRITE_COOKIE = 'moviebox_last_write'
+READ_METHODS = ('GET', 'HEAD')
+
+current_read_database = contextvars.ContextVar('current_read_database', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return current_read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        database = self.read_database(request)
+        token = current_read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_read_database.reset(token)
+        if response.streaming:
+            response.streaming_content = self.routed(response.streaming_content, database)
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(LAST_WRITE_COOKIE, str(time.time()),
+                                max_age=settings.READ_YOUR_WRITES_WINDOW)
+        return response
+
+    @staticmethod
+    def read_database(request):
+        """ A random replica, or None (the primary) for writes and recent writers """
+        if not settings.DATABASE_REPLICAS or request.method not in READ_METHODS:
+            return None
+        try:
+            last_write = float(request.COOKIES[LAST_WRITE_COOKIE])
+        except (KeyError, ValueError):
+            last_write = None
+        if last_write is not None and time.time() - last_write < settings.READ_YOUR_WRITES_WINDOW:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    @staticmethod
+    def routed(content, database):
+        """ Streamed content, read from the database of its request """
+        iterator = iter(content)
+        while True:
+            token = current_read_database.set(database)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                current_read_database.reset(token)
+            yield chunk
@@ -0,0 +1,78 @@
+"""
+Full-text search over movie title, plot, actors and writer.
+
+On PostgreSQL the index is a weighted 'search_vector' tsvector column
+of movies_movie with a GIN index, kept up to date by a trigger
+on every insert and update. On SQLite (used locally) it is
+an FTS5 table, updated by signals on Movie in the same transaction
+as the change of the movie (a trigger writing to FTS5 would make
+concurrent SQLite transactions fail with 'database is locked').
+Either way searching never scans the movies table.
+The column, the trigger and the FTS5 table are not a part
+of the Movie model, they are created by migration 0011_movie_search_index.
+"""
+from django.db import NotSupportedError
+
+
+POSTGRESQL_SEARCH = """
+    SELECT id, ts_rank_cd(search_vector, query) AS score
+    FROM movies_movie, plainto_tsquery('pg_catalog.english', %s) AS query
+    WHERE search_vector @@ query
+    ORDER BY score DESC, id
+    LIMIT %s OFFSET %s
+"""
+
+# bm25() weights follow the column order: title, plot, actors, writer.
+# Lower bm25() values are better matches, so it is negated to get the score.
+SQLITE_SEARCH = """
+    SELECT rowid, -bm25(movies_movie_fts, 10.0, 1.0, 5.0, 5.0) AS score
+    FROM movies_movie_fts
+    WHERE movies_movie_fts MATCH %s
+    ORDER BY score DESC, rowid
+    LIMIT %s OFFSET %s
+"""
+
+
+def index_movies(connection, movies):
+    """
+    Add or replace movies in the SQLite index.
+    On PostgreSQL the trigger has already done it.
+    """
+    if connection.vendor != 'sqlite' or not movies:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany("DELETE FROM movies_movie_fts WHERE rowid = %s",
+                           [(movie.pk,) for movie in movies])
+        cursor.executemany(
+            "INSERT INTO movies_movie_fts (rowid, title, plot, actors, writer) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [(movie.pk, movie.title, movie.plot, movie.actors, movie.writer) for movie in movies])
+
+
+def unindex_movie(connection, movie_id):
+    """ Remove a deleted movie from the SQLite index """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM movies_movie_fts WHERE rowid = %s", [movie_id])
+
+
+def sqlite_match_query(query):
+    """ Quote every word, so that FTS5 matches all of them literally """
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+
+def search_movies(connection, query, limit, offset):
+    """
+    (id, score) pairs of movies matching all words of the query,
+    best matches first.
+    """
+    if connection.vendor == 'postgresql':
+        sql, query = POSTGRESQL_SEARCH, query
+    elif connection.vendor == 'sqlite':
+        sql, query = SQLITE_SEARCH, sqlite_match_query(query)
+    else:
+        raise NotSupportedError(f'Full-text search is not supported on {connection.vendor}.')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, limit, offset])
+        return cursor.fetchall()
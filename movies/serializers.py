@@ -1,76 +1,147 @@
 from rest_framework.serializers import (
+    FloatField,
+    HyperlinkedIdentityField,
     IntegerField,
+    JSONField,
+    ListSerializer,
     ModelSerializer,
-    SerializerMethodField,
 )
 
+from .metrics import timed
 from .models import (
     Comment,
+    IngestJob,
     Movie,
 )
 
 
-class CommentCreateSerializer(ModelSerializer):
+class TimedListSerializer(ListSerializer):
+    @property
+    def data(self):
+        with timed('serialization'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Counts building 'data' as serialization in the request metrics
+    (see movies.metrics); lists are timed by 'TimedListSerializer',
+    set as 'list_serializer_class' in Meta.
+    """
+    @property
+    def data(self):
+        with timed('serialization'):
+            return super().data
+
+
+class SparseFieldsetMixin:
+    """
+    Takes an optional 'fields' argument - names of the fields
+    to output instead of all of them (see '?fields=' in movies.views).
+    Only the output is trimmed, all fields are still accepted on input.
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.output_fields = None if fields is None else set(fields)
+
+    @property
+    def _readable_fields(self):
+        for field in super()._readable_fields:
+            if self.output_fields is None or field.field_name in self.output_fields:
+                yield field
+
+
+class CommentCreateSerializer(TimedSerializerMixin, SparseFieldsetMixin, ModelSerializer):
     class Meta:
         model = Comment
+        list_serializer_class = TimedListSerializer
         fields = [
             'text',
             'created',
         ]
 
 
-class CommentListSerializer(ModelSerializer):
-    movie_id = SerializerMethodField()
+class CommentListSerializer(TimedSerializerMixin, SparseFieldsetMixin, ModelSerializer):
+    movie_id = IntegerField(source='object_id', read_only=True)
 
     class Meta:
         model = Comment
+        list_serializer_class = TimedListSerializer
         fields = [
             'movie_id',
             'text',
         ]
 
-    def get_movie_id(self, obj):
-        return obj.movies.first().id
 
-
-class MovieDetailSerializer(ModelSerializer):
-    comments = CommentListSerializer(many=True)
+class MovieDetailSerializer(TimedSerializerMixin, SparseFieldsetMixin, ModelSerializer):
+    comments = CommentListSerializer(many=True, source='movie_comments')
+    ratings = JSONField(required=False)
 
     class Meta:
         model = Movie
-        fields = '__all__'
+        list_serializer_class = TimedListSerializer
+        exclude = [
+            'title_key',
+            *Movie.NUMBER_FIELDS,
+            'genres',
+            'directors',
+        ]
+        read_only_fields = [
+            'comment_count',
+        ]
 
 
-class MovieListSerializer(ModelSerializer):
-    comments = SerializerMethodField()
+class MovieListSerializer(TimedSerializerMixin, SparseFieldsetMixin, ModelSerializer):
+    comments = IntegerField(source='comment_count', read_only=True)
     
     class Meta:
         model = Movie
+        list_serializer_class = TimedListSerializer
         fields = [
             'id',
             'title',
             'comments',
         ]
-    
-    def get_comments(self, obj):
-        return obj.comments.count()
 
 
-class MovieRankSerializer(ModelSerializer):
-    movie_id = SerializerMethodField()
+class MovieSearchSerializer(MovieListSerializer):
+    rank = FloatField()
+
+    class Meta(MovieListSerializer.Meta):
+        fields = MovieListSerializer.Meta.fields + [
+            'rank',
+        ]
+
+
+class MovieRankSerializer(TimedSerializerMixin, ModelSerializer):
+    """ Serializes {'movie_id', 'total_comments', 'rank'} rows of MovieTopAPIView """
+    movie_id = IntegerField()
     rank = IntegerField()
-    total_comments = SerializerMethodField()
+    total_comments = IntegerField()
     
     class Meta:
         model = Movie
+        list_serializer_class = TimedListSerializer
         fields = [
             'movie_id',
             'total_comments',
             'rank',
         ]
-    
-    def get_total_comments(self, obj):
-        return obj.comment_count
-    
-    def get_movie_id(self, obj):
-        return obj.id
+
+
+class IngestJobSerializer(ModelSerializer):
+    url = HyperlinkedIdentityField(view_name='movies:ingest-job')
+
+    class Meta:
+        model = IngestJob
+        fields = [
+            'id',
+            'url',
+            'title',
+            'status',
+            'movie',
+            'attempts',
+            'error',
+            'created',
+            'updated',
+        ]
@@ -0,0 +1,125 @@
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Comment,
+    DailyCommentCount,
+    Movie,
+    ResourceVersion,
+    movie_deletions,
+)
+from .search import (
+    index_movies,
+    unindex_movie,
+)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, using, raw=False, **kwargs):
+    """
+    Refresh genre and director lookups and the search index of a saved movie
+    and bump the version of movies
+    """
+    if not raw:
+        instance.sync_lookups()
+        index_movies(connections[using], [instance])
+    ResourceVersion.objects.bump(ResourceVersion.MOVIES)
+
+
+class _Deletion:
+    """
+    Comments of a movie deleted with it: whether the movie itself goes,
+    how many comments go and whether any is from before today
+    """
+    def __init__(self):
+        self.movie = False
+        self.comments = 0
+        self.old = False
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting(sender, instance, using, **kwargs):
+    """
+    Mark the movie, so that the comments deleted with it (by the cascade)
+    don't update its counter and rollup rows, which go away with it,
+    nor bump versions one by one. The deletion sends every pre_delete
+    before any post_delete, in no particular order of models.
+    Without a deletion of movies in progress (see 'deleting_movies()')
+    nothing is marked and every comment is counted out on its own.
+    """
+    deletions = movie_deletions(using)
+    if deletions is not None:
+        deletions.setdefault(instance.pk, _Deletion()).movie = True
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, using, **kwargs):
+    """
+    Remove a deleted movie from the search index and bump the version
+    of movies and, once for all of them, of its comments
+    """
+    unindex_movie(connections[using], instance.pk)
+    deletion = (movie_deletions(using) or {}).get(instance.pk, _Deletion())
+    names = [ResourceVersion.MOVIES]
+    if deletion.comments:
+        names += [ResourceVersion.COMMENTS, ResourceVersion.comments_of(instance.pk)]
+    if deletion.old:
+        names.append(ResourceVersion.COMMENTS_HISTORY)
+    ResourceVersion.objects.bump(*names)
+
+
+def _bump_comments(comment):
+    names = [ResourceVersion.COMMENTS]
+    if comment.movie_id is not None:
+        names.append(ResourceVersion.comments_of(comment.movie_id))
+    if timezone.localdate(comment.created) < timezone.localdate():
+        names.append(ResourceVersion.COMMENTS_HISTORY)
+    ResourceVersion.objects.bump(*names)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    """
+    Count a new comment in the movie's counter and the daily rollup
+    and bump the version of comments
+    """
+    if created and instance.movie_id is not None:
+        Movie.objects.filter(pk=instance.movie_id).update(
+            comment_count=F('comment_count') + 1)
+        DailyCommentCount.objects.add(
+            instance.movie_id, timezone.localdate(instance.created), 1)
+    if created:
+        _bump_comments(instance)
+
+
+@receiver(pre_delete, sender=Comment)
+def comment_deleting(sender, instance, using, **kwargs):
+    deletions = movie_deletions(using)
+    if deletions is not None and instance.movie_id is not None:
+        deletion = deletions.setdefault(instance.movie_id, _Deletion())
+        deletion.comments += 1
+        deletion.old = deletion.old or timezone.localdate(instance.created) < timezone.localdate()
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, using, **kwargs):
+    """
+    Remove a deleted comment from the movie's counter and the daily rollup
+    and bump the version of comments, unless it's deleted with its movie
+    """
+    if instance.movie_id is not None:
+        deletion = (movie_deletions(using) or {}).get(instance.movie_id)
+        if deletion is not None and deletion.movie:
+            return
+        Movie.objects.filter(pk=instance.movie_id).update(
+            comment_count=F('comment_count') - 1)
+        DailyCommentCount.objects.add(
+            instance.movie_id, timezone.localdate(instance.created), -1)
+    _bump_comments(instance)
@@ -0,0 +1,155 @@
+"""
+Synthetic movies and comments for benchmarks and local testing.
+
+Data is generated from a seeded random generator, so the same
+arguments always give the same catalog. Movies look like OMDb data
+(genres, directors, numbers as text) and comments are spread
+over a date range, a few movies getting most of them.
+Everything is saved in bulk, without signals; the denormalized counters,
+lookups, search index and version stamps, normally kept by signals,
+are rebuilt afterwards.
+"""
+import random
+from datetime import datetime, time, timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    Comment,
+    DailyCommentCount,
+    Movie,
+    ResourceVersion,
+)
+from .search import index_movies
+
+
+WORDS = [
+    'night', 'city', 'dark', 'love', 'war', 'star', 'last', 'lost', 'river', 'king',
+    'secret', 'shadow', 'golden', 'silent', 'return', 'empire', 'dream', 'road', 'fire', 'ghost',
+    'winter', 'summer', 'blood', 'glass', 'iron', 'heart', 'storm', 'island', 'hunter', 'garden',
+]
+FIRST_NAMES = ['Anna', 'John', 'Maria', 'Peter', 'Lena', 'Tom', 'Sofia', 'Jan', 'Eva', 'Mark']
+LAST_NAMES = ['Novak', 'Smith', 'Kowalski', 'Brown', 'Meyer', 'Rossi', 'Dubois', 'Lee', 'Park', 'Silva']
+GENRES = ['Action', 'Adventure', 'Comedy', 'Crime', 'Drama', 'Fantasy', 'Horror',
+          'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'Western']
+BATCH_SIZE = 1000
+
+
+def _names(rng, count):
+    return ', '.join(f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}' for _ in range(count))
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def movie_data(rng, number):
+    """ OMDb-like data of a synthetic movie """
+    year = rng.randint(1920, 2019)
+    rating = round(rng.uniform(1, 10), 1)
+    return {
+        'title': f'{_words(rng, rng.randint(1, 3)).title()} {number}',
+        'year': str(year),
+        'rated': rng.choice(['G', 'PG', 'PG-13', 'R']),
+        'released': f'01 Jan {year}',
+        'runtime': f'{rng.randint(70, 200)} min',
+        'genre': ', '.join(rng.sample(GENRES, rng.randint(1, 3))),
+        'director': _names(rng, rng.randint(1, 2)),
+        'writer': _names(rng, rng.randint(1, 3)),
+        'actors': _names(rng, 4),
+        'plot': _words(rng, rng.randint(10, 40)).capitalize() + '.',
+        'language': 'English',
+        'country': 'USA',
+        'awards': 'N/A',
+        'poster': 'N/A',
+        'ratings': [{'Source': 'Internet Movie Database', 'Value': f'{rating}/10'}],
+        'metascore': str(rng.randint(1, 100)) if rng.random() > 0.1 else 'N/A',
+        'imdbrating': str(rating),
+        'imdbvotes': f'{rng.randint(5, 2000000):,}',
+        'imdbid': f'tt9{number:08d}',
+        'type': 'movie',
+        'dvd': 'N/A',
+        'boxoffice': 'N/A',
+        'production': 'N/A',
+        'website': 'N/A',
+        'response': 'True',
+    }
+
+
+def _insert_comments(comments):
+    """
+    Insert the comments with their own 'created', which 'bulk_create()'
+    would replace by the current time ('auto_now_add')
+    """
+    fields = [field for field in Comment._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    batch_size = max(connection.ops.bulk_batch_size(fields, comments), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(comments), batch_size):
+            batch = comments[start:start + batch_size]
+            params = [field.get_db_prep_save(getattr(comment, field.attname), connection)
+                      for comment in batch for field in fields]
+            cursor.execute(f"INSERT INTO {Comment._meta.db_table} ({columns}) "
+                           f"VALUES {', '.join([row] * len(batch))}", params)
+
+
+def generate_movies(count, seed=0):
+    """ Add 'count' movies; returns their ids """
+    rng = random.Random(seed)
+    first = Movie.objects.count()
+    ids = []
+    for start in range(first, first + count, BATCH_SIZE):
+        numbers = range(start, min(start + BATCH_SIZE, first + count))
+        batch = [Movie.from_omdb(movie_data(rng, number)) for number in numbers]
+        with transaction.atomic():
+            Movie.objects.bulk_create(batch, ignore_conflicts=True)
+            saved = list(Movie.objects.filter(imdbid__in=[movie.imdbid for movie in batch]))
+            Movie.link_lookups(saved)
+            index_movies(connection, saved)
+        ids.extend(movie.id for movie in saved)
+    ResourceVersion.objects.bump(ResourceVersion.MOVIES)
+    return ids
+
+
+def generate_comments(count, movie_ids, date_from, date_to, seed=0):
+    """
+    Add 'count' comments to the given movies, created at random times
+    between 'date_from' and 'date_to' (inclusive). Movies are picked
+    with a long-tailed distribution, like real popularity.
+    """
+    if not movie_ids or not count:
+        return
+    rng = random.Random(seed)
+    content_type = ContentType.objects.get_for_model(Movie)
+    start = timezone.make_aware(datetime.combine(date_from, time.min))
+    seconds = int((datetime.combine(date_to, time.max) - datetime.combine(date_from, time.min))
+                  .total_seconds())
+    commented = set()
+    for offset in range(0, count, BATCH_SIZE):
+        batch = []
+        for i in range(offset, min(offset + BATCH_SIZE, count)):
+            movie_id = movie_ids[min(int(rng.paretovariate(1.2)) - 1, len(movie_ids) - 1)
+                                 if rng.random() < 0.5 else rng.randrange(len(movie_ids))]
+            created = start + timedelta(seconds=rng.randint(0, seconds))
+            batch.append(Comment(text=f'{_words(rng, rng.randint(3, 30)).capitalize()}.',
+                                 created=created, content_type=content_type,
+                                 object_id=movie_id, movie_id=movie_id))
+            commented.add(movie_id)
+        _insert_comments(batch)
+
+    counts = (Comment.objects
+              .filter(movie=OuterRef('pk'))
+              .values('movie')
+              .annotate(count=Count('id'))
+              .values('count'))
+    Movie.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+    DailyCommentCount.objects.rebuild()
+    ResourceVersion.objects.bump(*map(ResourceVersion.comments_of, commented))
@@ -1,12 +1,79 @@
-from datetime import datetime
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.contrib.contenttypes.models import ContentType
-from rest_framework.test import APITestCase
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import DenseRank
+from django.db import connection, connections, router, transaction
+from django.db.models.signals import pre_delete
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
 
+from .comment_buffer import (
+    CommentBuffer,
+    save_comments,
+)
+from .benchmark import (
+    cases,
+    compare,
+    percentile,
+    run,
+)
+from .export import export_movies
+from .importer import _insert_new
+from .ingest import work
+from .partitions import (
+    create_future_partitions,
+    create_partitions,
+    is_attached,
+    is_partitioned,
+    months,
+    partition_name,
+)
+from .synthetic import (
+    generate_comments,
+    generate_movies,
+)
+from .urls import urlpatterns
 from .models import (
     Comment,
+    DailyCommentCount,
+    Director,
+    Genre,
+    IngestJob,
     Movie,
+    ResourceVersion,
+)
+from .utils import (
+    CircuitBreaker,
+    OmdbClient,
+    OmdbUnavailable,
+    SingleFlight,
+    fetch_movie,
+    parse_float,
+    parse_int,
 )
 
 
@@ -106,7 +173,7 @@ class MovieTest(APITestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['title'], 'Batman')
     
-    @patch('movies.utils.fetch_movie', mock_fetch_movie)
+    @patch('movies.views.fetch_movie', mock_fetch_movie)
     def test_movies_post_not_exists(self):
         response = self.client.post('/movies', {'title': 'Watchmen'})
         self.assertEqual(response.status_code, 201)
@@ -114,7 +181,7 @@ class MovieTest(APITestCase):
         self.assertEqual(created_obj.title, 'Watchmen')
         self.assertEqual(created_obj.id, response.json()['id'])
     
-    @patch('movies.utils.fetch_movie', mock_fetch_movie)
+    @patch('movies.views.fetch_movie', mock_fetch_movie)
     def test_movies_post_already_exists(self):
         response = self.client.post('/movies', {'title': 'The Matrix'})
         self.assertEqual(response.status_code, 200)
@@ -135,13 +202,13 @@ class MovieTest(APITestCase):
     def test_comments_get(self):
         response = self.client.get('/comments')
         self.assertEqual(response.status_code, 200)
-        results = response.json()
+        results = response.json()['results']
         self.assertEquals(len(results), 4)
         
     def test_comments_get_with_movie_id(self):
         response = self.client.get('/comments?movie=3')
         self.assertEqual(response.status_code, 200)
-        results = response.json()
+        results = response.json()['results']
         self.assertEquals(len(results), 3)
         for comment in results:
             self.assertEquals(comment['movie_id'], 3)
@@ -180,3 +247,1922 @@ class MovieTest(APITestCase):
         self.assertDictEqual(response.json(), {
                 "error": "Invalid date format. The right format is 'YYYY-MM-DD'."
         })
+
+
+class DailyCommentCountTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.godfather = Movie.objects.create(**godfather_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+        cls.content_type = ContentType.objects.get_for_model(Movie)
+
+    def comment(self, movie, days_ago=0):
+        comment = Comment.objects.create(text="comment", object_id=movie.id,
+                                         content_type=self.content_type)
+        if days_ago:
+            Comment.objects.filter(pk=comment.pk).update(
+                created=comment.created - timedelta(days=days_ago))
+            call_command('backfill_comment_counts', stdout=StringIO())
+        return comment
+
+    def top(self, date_from, date_to, **params):
+        response = self.client.get('/top', dict(params, **{'from': date_from, 'to': date_to}))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rollup_updated_on_comment_post(self):
+        self.client.post('/comments', {'movie_id': self.batman.id, 'text': 'Hi'})
+        self.client.post('/comments', {'movie_id': self.batman.id, 'text': 'Hi again'})
+        rollup = DailyCommentCount.objects.get(movie=self.batman)
+        self.assertEqual(rollup.day, timezone.localdate())
+        self.assertEqual(rollup.count, 2)
+
+    def test_rollup_updated_on_comment_delete(self):
+        comment = self.comment(self.matrix)
+        self.comment(self.matrix)
+        comment.delete()
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.matrix).count, 1)
+
+    def test_movie_delete_does_not_update_its_comments_one_by_one(self):
+        def versions():
+            names = [ResourceVersion.COMMENTS, ResourceVersion.COMMENTS_HISTORY,
+                     ResourceVersion.comments_of(self.matrix.id)]
+            stamps = ResourceVersion.objects.stamps(names)
+            return [stamps[name][0] for name in names]
+
+        for movie in (self.godfather, self.batman):
+            self.comment(movie)
+            self.comment(movie, days_ago=3)
+        # the first delete creates the version rows
+        self.client.delete(f'/movies/{self.godfather.id}')
+        with CaptureQueriesContext(connection) as context:
+            self.client.delete(f'/movies/{self.batman.id}')
+        self.comment(self.matrix, days_ago=3)
+        for _ in range(60):
+            self.comment(self.matrix)
+        before = versions()
+        # as many queries as for a movie with two comments
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = self.client.delete(f'/movies/{self.matrix.id}')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([after - version for after, version in zip(versions(), before)],
+                         [1, 1, 1])
+        self.assertFalse(Comment.objects.filter(object_id=self.matrix.id).exists())
+        self.assertFalse(DailyCommentCount.objects.filter(movie_id=self.matrix.id).exists())
+        # comments deleted on their own still update the counters
+        movie = Movie.objects.create(**dict(batman_sample, imdbid='tt-other'))
+        comment = self.comment(movie)
+        self.comment(movie)
+        comment.delete()
+        movie.refresh_from_db()
+        self.assertEqual(movie.comment_count, 1)
+        self.assertEqual(DailyCommentCount.objects.get(movie=movie).count, 1)
+
+    def test_failed_movie_delete_leaves_no_marks(self):
+        first, second = self.comment(self.matrix), self.comment(self.matrix)
+
+        def fail(sender, instance, **kwargs):
+            raise RuntimeError('delete failed')
+
+        pre_delete.connect(fail, sender=Movie)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.matrix.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=Movie)
+        first.delete()
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.comment_count, 1)
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.matrix).count, 1)
+
+    def test_backfill_rebuilds_rollup(self):
+        self.comment(self.matrix)
+        self.comment(self.matrix, days_ago=3)
+        self.comment(self.godfather, days_ago=3)
+        DailyCommentCount.objects.all().delete()
+        call_command('backfill_comment_counts', stdout=StringIO())
+        self.assertEqual(DailyCommentCount.objects.count(), 3)
+        old = timezone.localdate() - timedelta(days=3)
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.matrix, day=old).count, 1)
+
+    def test_backfill_changes_top(self):
+        self.comment(self.matrix, days_ago=3)
+        DailyCommentCount.objects.all().delete()
+        url = '/top?from=2019-01-01&to=2099-12-31'
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0]['total_comments'], 0)
+        call_command('backfill_comment_counts', stdout=StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['movie_id'], self.matrix.id)
+        self.assertEqual(response.json()[0]['total_comments'], 1)
+
+    def test_backfill_of_a_date_range(self):
+        self.comment(self.matrix)
+        self.comment(self.matrix, days_ago=3)
+        self.comment(self.godfather, days_ago=5)
+        today = timezone.localdate()
+        DailyCommentCount.objects.update(count=100)
+        call_command('backfill_comment_counts', '--from', str(today - timedelta(days=3)),
+                     '--to', str(today - timedelta(days=1)), stdout=StringIO())
+        counts = dict(DailyCommentCount.objects.values_list('day', 'count'))
+        self.assertEqual(counts, {today: 100, today - timedelta(days=3): 1,
+                                  today - timedelta(days=5): 100})
+
+    def test_created_between_matches_local_days(self):
+        comment = self.comment(self.matrix, days_ago=2)
+        day = timezone.localtime(Comment.objects.get(pk=comment.pk).created).date()
+        for date_from, date_to, found in [(day, day, True),
+                                          (day - timedelta(days=1), day - timedelta(days=1), False),
+                                          (day + timedelta(days=1), day + timedelta(days=1), False)]:
+            comments = Comment.objects.created_between(date_from, date_to)
+            self.assertEqual(comments.filter(pk=comment.pk).exists(), found)
+            self.assertEqual(comments.exists(), Comment.objects.filter(
+                created__date__range=(date_from, date_to)).exists())
+        # a plain range on the column, with no cast to a date
+        sql = str(Comment.objects.created_between(day, day).query)
+        self.assertNotIn('cast_date', sql)
+        self.assertIn('"created" >= ', sql)
+
+    def test_top_matches_raw_comment_count(self):
+        self.comment(self.matrix)
+        self.comment(self.matrix, days_ago=2)
+        self.comment(self.godfather)
+        self.comment(self.godfather, days_ago=5)
+        self.comment(self.batman, days_ago=1)
+        today = timezone.localdate()
+        for days in range(7):
+            date_from = today - timedelta(days=days)
+            window = Window(expression=DenseRank(), order_by=F('total_comments').desc())
+            expected = Movie.objects.annotate(
+                total_comments=Count('comments',
+                                    filter=Q(comments__created__date__range=(date_from, today))),
+                rank=window).order_by('rank', 'id')
+            results = self.top(date_from, today)
+            self.assertEqual(
+                [(r['movie_id'], r['total_comments'], r['rank']) for r in results],
+                [(m.id, m.total_comments, m.rank) for m in expected])
+
+    def test_top_limit_and_offset_slice_the_full_ranking(self):
+        extra = [Movie.objects.create(**dict(matrix_sample, title=f'Movie {i}', imdbid=f'tt-top-{i}'))
+                 for i in range(3)]
+        for movie, count in [(self.matrix, 2), (self.godfather, 1), (extra[0], 2), (extra[1], 1)]:
+            for _ in range(count):
+                self.comment(movie)
+        today = timezone.localdate()
+        full = self.top(today, today)
+        self.assertEqual([r['rank'] for r in full], [1, 1, 2, 2, 3, 3])
+        for offset in range(len(full) + 1):
+            for limit in range(1, len(full) + 2):
+                self.assertEqual(self.top(today, today, limit=limit, offset=offset),
+                                 full[offset:offset + limit])
+        self.assertEqual(self.top(today, today, offset=5), full[5:])
+        self.assertEqual(self.top(today, today, exclude_empty=1), full[:4])
+        self.assertEqual(self.top(today, today, exclude_empty=1, limit=3, offset=2), full[2:4])
+
+    def test_top_of_a_range_without_comments(self):
+        today = timezone.localdate()
+        results = self.top(today, today, limit=2, offset=1)
+        self.assertEqual([(r['movie_id'], r['total_comments'], r['rank']) for r in results],
+                         [(self.godfather.id, 0, 1), (self.batman.id, 0, 1)])
+        self.assertEqual(self.top(today, today, exclude_empty=1), [])
+
+    def test_top_limit_is_applied_in_the_query(self):
+        self.comment(self.matrix)
+        today = timezone.localdate()
+        with CaptureQueriesContext(connection) as context:
+            self.top(today, today, limit=1)
+        ranking = [query['sql'] for query in context.captured_queries if 'DENSE_RANK' in query['sql']]
+        self.assertEqual(len(ranking), 1)
+        self.assertIn('LIMIT 1', ranking[0])
+        self.assertNotIn('movies_movie', ranking[0])
+
+    def test_top_bad_limit(self):
+        for params in ['limit=-1', 'offset=x', 'limit=1.5', 'limit=%C2%B2',
+                       f'offset={10 ** 30}', f'limit={2 ** 31}']:
+            response = self.client.get(f'/top?from=2019-01-01&to=2019-01-02&{params}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+    def test_top_ties_and_zero_comment_movies(self):
+        self.comment(self.matrix)
+        self.comment(self.godfather)
+        today = timezone.localdate()
+        results = self.top(today, today)
+        self.assertEqual([r['rank'] for r in results], [1, 1, 2])
+        self.assertEqual(results[2]['movie_id'], self.batman.id)
+        self.assertEqual(results[2]['total_comments'], 0)
+
+
+class MovieCommentCountTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.content_type = ContentType.objects.get_for_model(Movie)
+
+    def create_movies(self, number):
+        for i in range(number):
+            movie = Movie.objects.create(**dict(matrix_sample, title=f'Movie {i}',
+                                                imdbid=f'tt-{number}-{i}'))
+            Comment.objects.create(text="comment", object_id=movie.id,
+                                   content_type=self.content_type)
+
+    def test_comment_count_kept_in_sync(self):
+        movie = Movie.objects.create(**matrix_sample)
+        self.client.post('/comments', {'movie_id': movie.id, 'text': 'First'})
+        comment = Comment.objects.create(text="Second", object_id=movie.id,
+                                         content_type=self.content_type)
+        movie.refresh_from_db()
+        self.assertEqual(movie.comment_count, 2)
+        comment.delete()
+        movie.refresh_from_db()
+        self.assertEqual(movie.comment_count, 1)
+        self.assertEqual(self.client.get('/movies').json()[0]['comments'], 1)
+
+    def test_movies_get_query_count_is_constant(self):
+        # the movies query and the version stamps (for the ETag)
+        self.create_movies(3)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.client.get('/movies').json()), 3)
+        self.create_movies(30)
+        with self.assertNumQueries(2):
+            results = self.client.get('/movies').json()
+        self.assertEqual(len(results), 33)
+        self.assertTrue(all(movie['comments'] == 1 for movie in results))
+
+
+class CommentPaginationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+        content_type = ContentType.objects.get_for_model(Movie)
+        created = timezone.now()
+        for i in range(7):
+            movie = cls.matrix if i % 2 else cls.batman
+            comment = Comment.objects.create(text=f"comment_{i}", object_id=movie.id,
+                                             content_type=content_type)
+            # two comments share every timestamp to exercise the 'id' tie-breaker
+            Comment.objects.filter(pk=comment.pk).update(created=created + timedelta(seconds=i // 2))
+
+    def fetch_all(self, url):
+        texts = []
+        while url:
+            # a page of comments and the version stamps (for the ETag)
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            texts.extend(comment['text'] for comment in page['results'])
+            url = page['next']
+        return texts
+
+    def test_pages_follow_created_and_id_order(self):
+        texts = self.fetch_all('/comments?page_size=2')
+        self.assertEqual(texts, [f"comment_{i}" for i in range(7)])
+
+    def test_pages_with_movie_filter(self):
+        texts = self.fetch_all(f'/comments?movie={self.matrix.id}&page_size=2')
+        self.assertEqual(texts, ["comment_1", "comment_3", "comment_5"])
+
+    def test_last_page_has_no_next_link(self):
+        page = self.client.get('/comments?page_size=7').json()
+        self.assertEqual(len(page['results']), 7)
+        self.assertIsNone(page['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/comments?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+        for pk in (99999999999999999999999, 2 ** 31, -1):
+            cursor = b64encode(f'2019-01-01T00:00:00+00:00|{pk}'.encode()).decode()
+            response = self.client.get('/comments', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class MovieLookupFilterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.godfather = Movie.objects.create(**godfather_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+
+    def titles(self, query):
+        response = self.client.get(f'/movies?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [movie['title'] for movie in response.json()]
+
+    def test_lookups_filled_on_save(self):
+        self.assertEqual(sorted(self.matrix.genres.values_list('name', flat=True)),
+                         ['action', 'sci-fi'])
+        self.assertEqual(sorted(self.matrix.directors.values_list('name', flat=True)),
+                         ['lana wachowski', 'lilly wachowski'])
+        self.assertEqual(Genre.objects.filter(name='action').count(), 1)
+
+    def test_lookups_follow_update(self):
+        self.client.put(f'/movies/{self.batman.id}', {'director': 'Monty Python'})
+        self.assertEqual(list(self.batman.directors.values_list('name', flat=True)),
+                         ['monty python'])
+        self.assertEqual(self.titles('director=python'), ['Batman'])
+        self.assertEqual(self.titles('director=burton'), [])
+
+    def test_substring_match(self):
+        self.assertEqual(self.titles('genre=act'), ['Batman', 'The Matrix'])
+        self.assertEqual(self.titles('director=wachowski'), ['The Matrix'])
+        self.assertEqual(self.titles('genre=CRIME&director=coppola'), ['The Godfather'])
+
+    def test_exact_match(self):
+        self.assertEqual(self.titles('genre=act&match=exact'), [])
+        self.assertEqual(self.titles('genre=Action&match=exact'), ['Batman', 'The Matrix'])
+        self.assertEqual(self.titles('director=lana wachowski&match=exact'), ['The Matrix'])
+        self.assertTrue(Director.objects.filter(name='francis ford coppola').exists())
+
+
+class OmdbStubServer:
+    """
+    Local HTTP server standing in for OMDb.
+    Replies are taken from 'replies' as (status, body, delay) tuples;
+    when the list is empty a 'Watchmen' result is returned.
+    """
+    def __init__(self):
+        self.replies = []
+        self.requests = 0
+        self.connections = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.replies:
+                    status, body, delay = stub.replies.pop(0)
+                else:
+                    status, body, delay = 200, {'Title': 'Watchmen', 'Response': 'True'}, 0
+                time.sleep(delay)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.handle_error = lambda request, client_address: None
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'omdb': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'omdb'},
+    'responses': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                  'LOCATION': 'responses'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OmdbClientTest(SimpleTestCase):
+
+    def setUp(self):
+        caches['omdb'].clear()
+        self.stub = OmdbStubServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.now = 0
+
+    def client_for_stub(self, retries=0, read_timeout=2, failure_threshold=5):
+        breaker = CircuitBreaker(failure_threshold, reset_timeout=30, clock=lambda: self.now)
+        return OmdbClient(self.stub.url, 'key', connect_timeout=1, read_timeout=read_timeout,
+                          retries=retries, backoff_factor=0, pool_size=2, breaker=breaker)
+
+    def test_fetch_lowercases_keys(self):
+        self.assertEqual(fetch_movie('Watchmen', client=self.client_for_stub()),
+                         {'title': 'Watchmen', 'response': 'True'})
+
+    def test_connection_is_kept_alive(self):
+        client = self.client_for_stub()
+        for title in ('watchmen', 'batman', 'the-matrix'):
+            client.get(title)
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_read_timeout(self):
+        self.stub.replies = [(200, {}, 1)]
+        start = time.monotonic()
+        with self.assertRaises(OmdbUnavailable):
+            self.client_for_stub(read_timeout=0.2).get('watchmen')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_server_errors_are_retried(self):
+        self.stub.replies = [(503, {}, 0), (502, {}, 0)]
+        self.assertEqual(self.client_for_stub(retries=2).get('watchmen')['Title'], 'Watchmen')
+        self.assertEqual(self.stub.requests, 3)
+
+    def test_retries_are_bounded(self):
+        self.stub.replies = [(500, {}, 0)] * 5
+        with self.assertRaises(OmdbUnavailable):
+            self.client_for_stub(retries=2).get('watchmen')
+        self.assertEqual(self.stub.requests, 3)
+
+    def test_circuit_breaker_fails_fast_and_recovers(self):
+        client = self.client_for_stub(failure_threshold=2)
+        self.stub.replies = [(500, {}, 0)] * 2
+        for _ in range(2):
+            with self.assertRaises(OmdbUnavailable):
+                client.get('watchmen')
+        with self.assertRaises(OmdbUnavailable):
+            client.get('watchmen')
+        self.assertEqual(self.stub.requests, 2)
+        self.now += 30
+        self.assertEqual(client.get('watchmen')['Title'], 'Watchmen')
+        client.get('watchmen')
+        self.assertEqual(self.stub.requests, 4)
+
+    def test_failed_trial_call_opens_circuit_again(self):
+        client = self.client_for_stub(failure_threshold=1)
+        self.stub.replies = [(500, {}, 0)] * 2
+        with self.assertRaises(OmdbUnavailable):
+            client.get('watchmen')
+        self.now += 30
+        with self.assertRaises(OmdbUnavailable):
+            client.get('watchmen')
+        with self.assertRaises(OmdbUnavailable):
+            client.get('watchmen')
+        self.assertEqual(self.stub.requests, 2)
+
+
+class MovieOmdbUnavailableTest(APITestCase):
+
+    @patch('movies.views.fetch_movie', side_effect=OmdbUnavailable('timeout'))
+    def test_movies_post_when_omdb_unavailable(self, fetch):
+        response = self.client.post('/movies', {'title': 'Watchmen'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Movie.objects.exists())
+
+
+class OmdbCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = OmdbStubServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        caches_settings = dict(LOCMEM_CACHES, omdb={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir,
+        })
+        settings_override = override_settings(CACHES=caches_settings)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        breaker = CircuitBreaker(5, reset_timeout=30)
+        self.client = OmdbClient(self.stub.url, 'key', connect_timeout=1, read_timeout=2,
+                                 retries=0, backoff_factor=0, pool_size=1, breaker=breaker)
+
+    def test_found_movie_is_cached(self):
+        for _ in range(3):
+            self.assertEqual(fetch_movie('Watchmen', client=self.client)['title'], 'Watchmen')
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_unknown_title_is_cached(self):
+        self.stub.replies = [(200, {'Response': 'False', 'Error': 'Movie not found!'}, 0)]
+        for _ in range(3):
+            self.assertEqual(fetch_movie('No Such Movie', client=self.client)['response'], 'False')
+        self.assertEqual(self.stub.requests, 1)
+
+    @override_settings(OMDB_NEGATIVE_CACHE_TTL=0)
+    def test_unknown_title_ttl(self):
+        self.stub.replies = [(200, {'Response': 'False', 'Error': 'Movie not found!'}, 0)] * 2
+        fetch_movie('No Such Movie', client=self.client)
+        fetch_movie('No Such Movie', client=self.client)
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_failures_are_not_cached(self):
+        self.stub.replies = [(500, {}, 0)]
+        with self.assertRaises(OmdbUnavailable):
+            fetch_movie('Watchmen', client=self.client)
+        self.assertEqual(fetch_movie('Watchmen', client=self.client)['title'], 'Watchmen')
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_cache_survives_restart(self):
+        fetch_movie('Watchmen', client=self.client)
+        restarted_cache = FileBasedCache(self.cache_dir, {})
+        self.assertEqual(restarted_cache.get('omdb:watchmen')['title'], 'Watchmen')
+
+
+def fake_omdb(title):
+    movies = {
+        'watchmen': mock_fetch_movie('Watchmen'),
+        'matrix': matrix_sample,
+        'the matrix reloaded': dict(matrix_sample, title='The Matrix Reloaded', imdbid='tt0234215'),
+        'batman': batman_sample,
+    }
+    if title == 'Broken':
+        raise OmdbUnavailable('timeout')
+    if title.lower() == 'friends':
+        return {'title': 'Friends', 'type': 'series', 'response': 'True'}
+    return movies.get(title.lower(), {'response': 'False', 'error': 'Movie not found!'})
+
+
+@patch('movies.importer.fetch_movie', fake_omdb)
+class MovieBulkImportTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.godfather = Movie.objects.create(**godfather_sample)
+
+    def test_bulk_import_report(self):
+        titles = ['Watchmen', 'The Godfather', 'Unknown', 'Friends', 'Broken',
+                  'The Matrix Reloaded', 'watchmen']
+        response = self.client.post('/movies/bulk', {'titles': titles}, format='json')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual([entry['title'] for entry in report], titles)
+        self.assertEqual([entry['status'] for entry in report],
+                         ['created', 'exists', 'not_found', 'not_found', 'unavailable',
+                          'created', 'exists'])
+        watchmen = Movie.objects.get(title='Watchmen')
+        self.assertEqual(report[0]['id'], watchmen.id)
+        self.assertEqual(report[6]['id'], watchmen.id)
+        self.assertEqual(report[1]['id'], self.godfather.id)
+        self.assertIsNone(report[2]['id'])
+        self.assertEqual(Movie.objects.count(), 3)
+
+    def test_titles_of_the_same_movie_are_deduplicated(self):
+        report = self.client.post('/movies/bulk', {'titles': ['Matrix', 'The Matrix']},
+                                  format='json').json()
+        self.assertEqual([entry['status'] for entry in report], ['created', 'not_found'])
+        report = self.client.post('/movies/bulk', {'titles': ['Matrix']}, format='json').json()
+        self.assertEqual(report[0]['status'], 'exists')
+        self.assertEqual(Movie.objects.filter(imdbid=matrix_sample['imdbid']).count(), 1)
+
+    def test_movie_inserted_meanwhile_is_reported_as_existing(self):
+        from_omdb = Movie.from_omdb
+
+        def insert_meanwhile(movie_data):
+            # another request saves the movie after this import has checked the database
+            if movie_data['title'] == 'Batman':
+                Movie.objects.create(**batman_sample)
+            return from_omdb(movie_data)
+
+        with patch.object(Movie, 'from_omdb', side_effect=insert_meanwhile):
+            report = self.client.post('/movies/bulk', {'titles': ['Batman', 'Watchmen']},
+                                      format='json').json()
+        self.assertEqual([entry['status'] for entry in report], ['exists', 'created'])
+        self.assertEqual(report[0]['id'], Movie.objects.get(title='Batman').id)
+        self.assertEqual(Movie.objects.filter(title='Batman').count(), 1)
+
+    def test_movie_inserted_right_before_the_insert_is_reported_as_existing(self):
+        def insert_meanwhile(movies):
+            # another request commits the movie after every check made by this import
+            Movie.objects.create(**batman_sample)
+            return _insert_new(movies)
+
+        with patch('movies.importer._insert_new', side_effect=insert_meanwhile):
+            report = self.client.post('/movies/bulk', {'titles': ['Batman', 'Watchmen']},
+                                      format='json').json()
+        self.assertEqual([entry['status'] for entry in report], ['exists', 'created'])
+        self.assertEqual(report[0]['id'], Movie.objects.get(title='Batman').id)
+        self.assertEqual(report[1]['id'], Movie.objects.get(title='Watchmen').id)
+        self.assertEqual(Movie.objects.get(title='Watchmen').genres.count(), 4)
+
+    def test_imported_movies_are_complete(self):
+        self.client.post('/movies/bulk', {'titles': ['Batman', 'Watchmen']}, format='json')
+        batman = Movie.objects.get(title='Batman')
+        self.assertEqual(batman.ratings, batman_sample['ratings'])
+        self.assertEqual(self.client.get('/movies?genre=mystery').json()[0]['title'], 'Watchmen')
+        self.assertEqual(self.client.get('/movies?director=burton').json()[0]['title'], 'Batman')
+
+    def test_bad_request(self):
+        response = self.client.post('/movies/bulk', {'titles': 'Batman'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/movies/bulk', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_form_data(self):
+        response = self.client.post('/movies/bulk', {'titles': ['Batman', 'Watchmen']})
+        self.assertEqual([entry['status'] for entry in response.json()], ['created', 'created'])
+
+    def test_import_command(self):
+        out = StringIO()
+        call_command('import_movies', 'Batman', 'Unknown', '--batch-size', '1', stdout=out)
+        self.assertTrue(Movie.objects.filter(title='Batman').exists())
+        self.assertIn('created: 1, not_found: 1', out.getvalue())
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_call(value):
+            calls.append(value)
+            started.set()
+            release.wait(5)
+            return value * 2
+
+        flight = SingleFlight()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow_call, 21)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(flight.do('key', slow_call, 1), 2)
+
+    def test_exception_is_shared_and_not_remembered(self):
+        flight = SingleFlight()
+        with self.assertRaises(OmdbUnavailable):
+            flight.do('key', self.fail_call)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+
+    @staticmethod
+    def fail_call():
+        raise OmdbUnavailable('timeout')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConcurrentMoviePostTest(TransactionTestCase):
+
+    def setUp(self):
+        caches['omdb'].clear()
+
+    def test_concurrent_posts_fetch_once_and_create_one_row(self):
+        fetches = []
+        barrier = threading.Barrier(8)
+
+        def slow_get(title_slug):
+            fetches.append(title_slug)
+            time.sleep(0.3)
+            return {key.capitalize(): value for key, value in mock_fetch_movie('Watchmen').items()}
+
+        def post():
+            try:
+                barrier.wait(5)
+                statuses.append(APIClient().post('/movies', {'title': 'Watchmen'}).status_code)
+            finally:
+                connection.close()
+
+        statuses = []
+        with patch('movies.utils.omdb_client.get', side_effect=slow_get):
+            threads = [threading.Thread(target=post) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(fetches, ['watchmen'])
+        self.assertEqual(Movie.objects.filter(imdbid='tt0409459').count(), 1)
+        self.assertEqual(sorted(statuses), [200] * 7 + [201])
+
+    def test_upsert_is_idempotent(self):
+        movie, created = Movie.get_or_create_from_omdb(matrix_sample)
+        self.assertTrue(created)
+        again, created = Movie.get_or_create_from_omdb(dict(matrix_sample, title='Matrix'))
+        self.assertFalse(created)
+        self.assertEqual(again.id, movie.id)
+        self.assertEqual(Movie.objects.count(), 1)
+
+
+@patch('movies.views.fetch_movie', side_effect=fake_omdb)
+class MovieTitleKeyTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.batman_begins = Movie.objects.create(
+            **dict(batman_sample, title='Batman Begins', imdbid='tt0372784'))
+
+    def test_title_key_set_on_save(self, fetch):
+        self.assertEqual(self.batman_begins.title_key, 'batman-begins')
+        self.client.put(f'/movies/{self.batman_begins.id}', {'title': 'Batman: Begins!'})
+        self.batman_begins.refresh_from_db()
+        self.assertEqual(self.batman_begins.title_key, 'batman-begins')
+
+    def test_post_does_not_match_substring(self, fetch):
+        response = self.client.post('/movies', {'title': 'Batman'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['title'], 'Batman')
+        self.assertEqual(Movie.objects.get(pk=response.json()['id']).title_key, 'batman')
+
+    def test_post_matches_normalized_title(self, fetch):
+        with self.assertNumQueries(2):
+            response = self.client.post('/movies', {'title': '  batman BEGINS '})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.batman_begins.id)
+        fetch.assert_not_called()
+
+
+class MovieSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.godfather = Movie.objects.create(**godfather_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+
+    def search(self, query):
+        response = self.client.get(f'/movies/search?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def titles(self, query):
+        return [movie['title'] for movie in self.search(query)['results']]
+
+    def test_search_fields(self):
+        self.assertEqual(self.titles('q=matrix'), ['The Matrix'])
+        self.assertEqual(self.titles('q=keanu'), ['The Matrix'])
+        self.assertEqual(self.titles('q=puzo'), ['The Godfather'])
+        self.assertEqual(self.titles('q=Joker'), ['Batman'])
+        self.assertEqual(self.titles('q=hacker rebels'), ['The Matrix'])
+        self.assertEqual(self.titles('q=hacker joker'), [])
+
+    def test_results_are_ranked(self):
+        Movie.objects.create(**dict(matrix_sample, title='Crime Story', imdbid='tt1', plot='Drama.'))
+        results = self.search('q=crime')['results']
+        self.assertEqual(results[0]['title'], 'Crime Story')
+        self.assertEqual({movie['title'] for movie in results[1:]}, {'The Godfather', 'Batman'})
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+
+    def test_pagination(self):
+        page = self.search('q=crime&page_size=1')
+        self.assertEqual(len(page['results']), 1)
+        self.assertIn('page=2', page['next'])
+        last_page = self.client.get(page['next']).json()
+        self.assertEqual(len(last_page['results']), 1)
+        self.assertNotEqual(last_page['results'][0]['id'], page['results'][0]['id'])
+        self.assertIsNone(last_page['next'])
+
+    def test_page_out_of_range(self):
+        response = self.client.get(f'/movies/search?q=crime&page={10 ** 30}')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        self.assertEqual(self.search(f'q=crime&page={2 ** 31 - 1}')['results'], [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.client.put(f'/movies/{self.batman.id}', {'plot': 'A caped crusader in Gotham.'})
+        self.assertEqual(self.titles('q=crusader'), ['Batman'])
+        self.assertEqual(self.titles('q=clownishly'), [])
+        self.client.delete(f'/movies/{self.matrix.id}')
+        self.assertEqual(self.titles('q=matrix'), [])
+
+    def test_bulk_imported_movies_are_indexed(self):
+        with patch('movies.importer.fetch_movie', fake_omdb):
+            self.client.post('/movies/bulk', {'titles': ['Watchmen']}, format='json')
+        self.assertEqual(self.titles('q=rorschach'), ['Watchmen'])
+
+    def test_special_characters(self):
+        self.assertEqual(self.titles('q="matrix" OR (NEAR'), [])
+        self.assertEqual(self.titles('q=matrix*'), ['The Matrix'])
+
+    def test_missing_query(self):
+        response = self.client.get('/movies/search')
+        self.assertEqual(response.status_code, 400)
+
+
+class MovieExportTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [Movie.objects.create(**dict(matrix_sample, title=f'Movie {i}', imdbid=f'tt{i}'))
+                      for i in range(5)]
+        content_type = ContentType.objects.get_for_model(Movie)
+        Comment.objects.create(text="first", object_id=cls.movies[0].id, content_type=content_type)
+        Comment.objects.create(text="second", object_id=cls.movies[0].id, content_type=content_type)
+        Comment.objects.create(text="last", object_id=cls.movies[4].id, content_type=content_type)
+
+    def export(self, query=''):
+        response = self.client.get(f'/movies/export{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        movies = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([movie['title'] for movie in movies], [f'Movie {i}' for i in range(5)])
+        self.assertEqual(movies[0]['imdbid'], 'tt0')
+        self.assertNotIn('comments', movies[0])
+        self.assertNotIn('title_key', movies[0])
+
+    def test_json_with_comments(self):
+        response, content = self.export('?format=json&comments=1')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        movies = json.loads(content)
+        self.assertEqual(len(movies), 5)
+        self.assertEqual([comment['text'] for comment in movies[0]['comments']], ['first', 'second'])
+        self.assertEqual(movies[1]['comments'], [])
+        self.assertEqual([comment['text'] for comment in movies[4]['comments']], ['last'])
+
+    def test_empty_catalog(self):
+        Movie.objects.all().delete()
+        self.assertEqual(json.loads(self.export('?format=json')[1]), [])
+        self.assertEqual(self.export()[1], '')
+
+    def test_comments_are_fetched_per_chunk(self):
+        with self.assertNumQueries(4):
+            chunks = list(export_movies('ndjson', with_comments=True, chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+
+    def test_invalid_format(self):
+        response = self.client.get('/movies/export?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_movies', '--format', 'json', '--comments', '--chunk-size', '2', stdout=out)
+        self.assertEqual(len(json.loads(out.getvalue())), 5)
+
+
+class MovieNumberFieldsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.godfather = Movie.objects.create(**godfather_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+        cls.unknown = Movie.objects.create(**dict(
+            matrix_sample, title='Unknown', year='2005–2008', runtime='N/A', metascore='N/A',
+            imdbrating='N/A', imdbvotes='N/A', imdbid='tt-unknown'))
+
+    def titles(self, query):
+        response = self.client.get(f'/movies{query}')
+        self.assertEqual(response.status_code, 200)
+        return [movie['title'] for movie in response.json()]
+
+    def test_parsers(self):
+        self.assertEqual(parse_int('1,488,823'), 1488823)
+        self.assertEqual(parse_int('136 min'), 136)
+        self.assertEqual(parse_int('2005–2008'), 2005)
+        self.assertIsNone(parse_int('N/A'))
+        self.assertEqual(parse_float('8.7'), 8.7)
+        self.assertIsNone(parse_float('N/A'))
+
+    def test_numbers_are_set_on_save(self):
+        self.assertEqual(self.matrix.year_number, 1999)
+        self.assertEqual(self.matrix.runtime_minutes, 136)
+        self.assertEqual(self.matrix.metascore_number, 73)
+        self.assertEqual(self.matrix.imdbrating_number, 8.7)
+        self.assertEqual(self.matrix.imdbvotes_number, 1488823)
+        self.assertEqual(self.unknown.year_number, 2005)
+        self.assertIsNone(self.unknown.imdbvotes_number)
+        self.client.put(f'/movies/{self.batman.id}', {'imdbvotes': '400,000'})
+        self.batman.refresh_from_db()
+        self.assertEqual(self.batman.imdbvotes_number, 400000)
+
+    def test_numbers_out_of_range_are_stored_as_none(self):
+        self.assertIsNone(parse_int('99999', maximum=32767))
+        self.assertIsNone(parse_float('9' * 400))
+        response = self.client.put(f'/movies/{self.batman.id}', {
+            'year': '9' * 20, 'metascore': '40000', 'imdbvotes': '3,000,000,000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['year'], '9' * 20)
+        self.batman.refresh_from_db()
+        self.assertIsNone(self.batman.year_number)
+        self.assertIsNone(self.batman.metascore_number)
+        self.assertIsNone(self.batman.imdbvotes_number)
+
+    def test_ratings_are_stored_as_json(self):
+        movie = Movie.objects.get(id=self.matrix.id)
+        self.assertEqual(movie.ratings, matrix_sample['ratings'])
+        response = self.client.post('/movies', {'title': 'The Matrix'})
+        self.assertEqual(response.json()['ratings'], matrix_sample['ratings'])
+        self.assertNotIn('imdbvotes_number', response.json())
+
+    def test_ratings_holding_a_json_string_are_decoded_once(self):
+        for ratings in ('abc', '123'):
+            response = self.client.put(f'/movies/{self.batman.id}', {'ratings': ratings},
+                                       format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Movie.objects.get(id=self.batman.id).ratings, ratings)
+            self.assertEqual(self.client.get(f'/movies/{self.batman.id}').json()['ratings'],
+                             ratings)
+        field = Movie._meta.get_field('ratings')
+        self.assertEqual(field.value_to_string(self.matrix), json.dumps(matrix_sample['ratings']))
+
+    def test_range_filters(self):
+        self.assertEqual(self.titles('?year_min=1980&year_max=2000'), ['Batman', 'The Matrix'])
+        self.assertEqual(self.titles('?min_rating=8.7'), ['The Godfather', 'The Matrix'])
+        self.assertEqual(self.titles('?min_votes=1000000&genre=crime'), ['The Godfather'])
+
+    def test_order(self):
+        self.assertEqual(self.titles('?order=-imdbvotes'),
+                         ['The Matrix', 'The Godfather', 'Batman', 'Unknown'])
+        self.assertEqual(self.titles('?order=imdbvotes'),
+                         ['Batman', 'The Godfather', 'The Matrix', 'Unknown'])
+        self.assertEqual(self.titles('?order=-year&min_rating=8'), ['The Matrix', 'The Godfather'])
+
+    def test_invalid_values(self):
+        for query in ('?year_min=abc', '?min_rating=nan', '?order=plot',
+                      f'?min_votes={10 ** 30}', f'?year_max=-{10 ** 30}'):
+            response = self.client.get(f'/movies{query}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class SparseFieldsetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+        content_type = ContentType.objects.get_for_model(Movie)
+        for i in range(3):
+            Comment.objects.create(text=f"comment_{i}", object_id=cls.matrix.id,
+                                   content_type=content_type)
+
+    def sql(self, method, url, *args):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, *args)
+        self.assertIn(response.status_code, (200, 201))
+        return response.json(), ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_movie_list(self):
+        movies, sql = self.sql('get', '/movies?fields=title')
+        self.assertEqual(movies, [{'title': 'Batman'}, {'title': 'The Matrix'}])
+        self.assertNotIn('"comment_count"', sql)
+        movies, sql = self.sql('get', '/movies')
+        self.assertEqual(set(movies[0]), {'id', 'title', 'comments'})
+        self.assertNotIn('"plot"', sql)
+
+    def test_movie_post(self):
+        with self.assertNumQueries(1):
+            movie, sql = self.sql('post', '/movies?fields=title,year', {'title': 'The Matrix'})
+        self.assertEqual(movie, {'title': 'The Matrix', 'year': '1999'})
+        self.assertNotIn('"plot"', sql)
+        movie, sql = self.sql('post', '/movies?fields=id,comments', {'title': 'The Matrix'})
+        self.assertEqual(len(movie['comments']), 3)
+
+    def test_movie_put(self):
+        movie, sql = self.sql('put', f'/movies/{self.batman.id}?fields=director',
+                              {'director': 'Someone Else'})
+        self.assertEqual(movie, {'director': 'Someone Else'})
+        self.batman.refresh_from_db()
+        self.assertEqual(self.batman.director, 'Someone Else')
+        self.assertEqual(self.batman.title, 'Batman')
+
+    def test_comments(self):
+        page, sql = self.sql('get', '/comments?fields=text&page_size=2')
+        self.assertEqual(page['results'], [{'text': 'comment_0'}, {'text': 'comment_1'}])
+        self.assertNotIn('"object_id"', sql.split('FROM')[0])
+        next_page = self.client.get(page['next']).json()
+        self.assertEqual(next_page['results'], [{'text': 'comment_2'}])
+        comment, sql = self.sql('post', '/comments?fields=created',
+                                {'movie_id': self.batman.id, 'text': 'new'})
+        self.assertEqual(set(comment), {'created'})
+        self.assertTrue(Comment.objects.filter(text='new', object_id=self.batman.id).exists())
+
+    def test_invalid_fields(self):
+        for url in ('/movies?fields=plot', '/comments?fields=', '/movies/search?q=x&fields=x'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class ConditionalGetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]+"$')
+        return response['ETag']
+
+    def test_not_modified_without_the_main_query(self):
+        for url in ('/movies', '/comments', '/top?from=2019-01-01&to=2019-12-31',
+                    '/movies/search?q=matrix'):
+            etag = self.etag(url)
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_is_ignored(self):
+        self.assertFalse(self.client.get('/movies').has_header('Last-Modified'))
+        # a date after any change, which can't tell changes within the same second apart
+        response = self.client.get('/movies', HTTP_IF_MODIFIED_SINCE='Sun, 18 Oct 2099 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_the_query(self):
+        self.assertNotEqual(self.etag('/movies'), self.etag('/movies?genre=action'))
+        self.assertNotEqual(self.etag('/movies'),
+                            self.client.get('/movies', HTTP_ACCEPT='text/html')['ETag'])
+
+    def test_comment_changes_movies_comments_and_top(self):
+        urls = ['/movies', '/comments', '/top?from=2019-01-01&to=2099-12-31']
+        etags = [self.etag(url) for url in urls]
+        self.client.post('/comments', {'movie_id': self.matrix.id, 'text': 'new'})
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_movie_changes(self):
+        movies_etag, comments_etag = self.etag('/movies'), self.etag('/comments')
+        self.client.put(f'/movies/{self.batman.id}', {'director': 'Someone Else'})
+        self.assertNotEqual(self.etag('/movies'), movies_etag)
+        self.assertEqual(self.etag('/comments'), comments_etag)
+        movies_etag = self.etag('/movies')
+        self.client.delete(f'/movies/{self.batman.id}')
+        self.assertNotEqual(self.etag('/movies'), movies_etag)
+
+    @patch('movies.importer.fetch_movie', fake_omdb)
+    def test_bulk_import_bumps_movies(self):
+        version = ResourceVersion.objects.stamps([ResourceVersion.MOVIES])[ResourceVersion.MOVIES][0]
+        self.client.post('/movies/bulk', {'titles': ['Watchmen']}, format='json')
+        stamps = ResourceVersion.objects.stamps([ResourceVersion.MOVIES])
+        self.assertEqual(stamps[ResourceVersion.MOVIES][0], version + 1)
+
+
+class ResponseCacheTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def assertCached(self, url, cached=True):
+        """ The response of 'url' is the same and, if cached, costs only the stamps query """
+        expected = self.client.get(url).json()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context.captured_queries) == 1, cached)
+        return expected, response.json()
+
+    def comment(self, movie):
+        self.client.post('/comments', {'movie_id': movie.id, 'text': 'new'})
+
+    def test_repeated_reads_are_cached(self):
+        for url in ('/movies', '/movies?genre=action&director=burton', '/comments',
+                    f'/comments?movie={self.matrix.id}', '/top?from=2019-01-01&to=2099-12-31'):
+            expected, cached = self.assertCached(url)
+            self.assertEqual(cached, expected)
+
+    @override_settings(COMMENTS_CACHE_TTL=0)
+    def test_ttl_is_read_from_settings(self):
+        self.assertCached('/comments', cached=False)
+        self.assertCached('/movies')
+
+    def test_key_is_normalized(self):
+        self.client.get('/movies?genre=action&director=burton&order=')
+        with self.assertNumQueries(1):
+            response = self.client.get('/movies?director=burton&genre=action')
+        self.assertEqual([movie['title'] for movie in response.json()], ['Batman'])
+
+    def test_comment_invalidates_only_affected_entries(self):
+        matrix_comments = f'/comments?movie={self.matrix.id}'
+        batman_comments = f'/comments?movie={self.batman.id}'
+        urls = ['/movies', '/movies?fields=title', matrix_comments, batman_comments,
+                '/top?from=2019-01-01&to=2019-12-31', '/top?from=2019-01-01&to=2099-12-31']
+        for url in urls:
+            self.client.get(url)
+        self.comment(self.matrix)
+        self.assertEqual(len(self.client.get(matrix_comments).json()['results']), 1)
+        self.assertEqual(self.client.get('/top?from=2019-01-01&to=2099-12-31').json()[0]['total_comments'], 1)
+        self.assertEqual(self.client.get('/movies').json()[1]['comments'], 1)
+        for url in ('/movies?fields=title', batman_comments, '/top?from=2019-01-01&to=2019-12-31'):
+            with self.assertNumQueries(1):
+                self.client.get(url)
+
+    def test_comment_counts_with_spaced_fields(self):
+        for url in ('/movies?fields=title,%20comments',
+                    f'/movies?ids={self.matrix.id}&fields=title,%20comments'):
+            etag = self.client.get(url)['ETag']
+            self.comment(self.matrix)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            movie = next(movie for movie in response.json() if movie['title'] == 'The Matrix')
+            comments = movie['comments']
+            self.assertEqual(len(comments) if isinstance(comments, list) else comments,
+                             Comment.objects.filter(movie=self.matrix).count())
+
+    @patch('movies.views.fetch_movie', mock_fetch_movie)
+    def test_movie_writes_invalidate(self):
+        self.client.get('/movies?fields=title')
+        self.client.post('/movies', {'title': 'Watchmen'})
+        titles = [movie['title'] for movie in self.client.get('/movies?fields=title').json()]
+        self.assertEqual(titles, ['Batman', 'The Matrix', 'Watchmen'])
+        self.client.put(f'/movies/{self.batman.id}', {'title': 'Batman 1989'})
+        self.assertEqual(self.client.get('/movies?fields=title').json()[0]['title'], 'Batman 1989')
+        self.client.delete(f'/movies/{self.batman.id}')
+        self.assertEqual(len(self.client.get('/movies?fields=title').json()), 2)
+
+    def test_file_based_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        caches_settings = dict(LOCMEM_CACHES, responses={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_dir,
+        })
+        with override_settings(CACHES=caches_settings):
+            expected, cached = self.assertCached('/comments')
+            self.assertEqual(cached, expected)
+            self.comment(self.batman)
+            self.assertEqual(len(self.client.get('/comments').json()['results']), 1)
+
+
+class SyntheticDataTest(APITestCase):
+
+    def generate(self, movies, comments, seed=0):
+        call_command('generate_data', '--movies', str(movies), '--comments', str(comments),
+                     '--from', '2019-01-01', '--to', '2019-03-31', '--seed', str(seed),
+                     stdout=StringIO())
+
+    def test_generated_data_is_consistent(self):
+        self.generate(30, 300)
+        self.generate(10, 100, seed=1)
+        self.assertEqual(Movie.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 400)
+        self.assertEqual(sum(Movie.objects.values_list('comment_count', flat=True)), 400)
+        self.assertEqual(sum(DailyCommentCount.objects.values_list('count', flat=True)), 400)
+        days = Comment.objects.dates('created', 'day')
+        self.assertGreaterEqual(days.first(), datetime(2019, 1, 1).date())
+        self.assertLessEqual(days.last(), datetime(2019, 3, 31).date())
+        self.assertTrue(Movie.objects.filter(year_number__isnull=False, genres__isnull=False).exists())
+        # comments created later get the current time again
+        self.assertTrue(Comment._meta.get_field('created').auto_now_add)
+
+    def test_generated_data_is_reproducible(self):
+        self.generate(5, 0)
+        first = list(Movie.objects.order_by('id').values_list('title', 'imdbvotes'))
+        Movie.objects.all().delete()
+        self.generate(5, 0)
+        self.assertEqual(list(Movie.objects.order_by('id').values_list('title', 'imdbvotes')), first)
+
+
+class BenchmarkTest(APITestCase):
+
+    def test_cases_cover_every_url_and_method(self):
+        expected = {
+            (pattern.name, method.upper())
+            for pattern in urlpatterns
+            for method in pattern.callback.view_class.http_method_names
+            if method not in ('head', 'options') and hasattr(pattern.callback.view_class, method)
+        }
+        generate_comments(50, generate_movies(10), timezone.localdate(), timezone.localdate())
+        covered = set()
+        for case in cases(timezone.localdate(), timezone.localdate()):
+            path = case.prepare() if case.prepare else case.path
+            covered.add((resolve(path.split('?')[0]).url_name, case.method.upper()))
+        self.assertEqual(covered, expected)
+
+    def test_run(self):
+        results = run([(10, 50)], repeat=2, days=30)
+        self.assertEqual(len({result['endpoint'] for result in results['results']}),
+                         len(results['results']))
+        for result in results['results']:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries'], 0)
+        json.dumps(results)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([3, 1, 2, 4], 0.5), 2.5)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0.99), 4.96)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    def test_compare(self):
+        def results(p95, queries):
+            return {'results': [{'endpoint': 'GET /movies', 'movies': 10, 'comments': 50,
+                                 'p95_ms': p95, 'queries': queries}]}
+        self.assertFalse(compare(results(10, 2), results(11, 2))[0]['regression'])
+        self.assertFalse(compare(results(0.1, 2), results(0.5, 2))[0]['regression'])
+        self.assertTrue(compare(results(10, 2), results(15, 2))[0]['regression'])
+        self.assertTrue(compare(results(10, 2), results(10, 3))[0]['regression'])
+
+
+class RequestMetricsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+
+    def setUp(self):
+        caches['omdb'].clear()
+        caches['responses'].clear()
+
+    def server_timing(self, response):
+        return {name: (float(duration), rest)
+                for name, duration, rest in re.findall(r'(\w+);dur=([\d.]+)([^,]*)',
+                                                        response['Server-Timing'])}
+
+    def stub_client(self, delay):
+        stub = OmdbStubServer().__enter__()
+        self.addCleanup(stub.__exit__)
+        stub.replies = [(200, {'Response': 'False'}, delay)] * 2
+        return OmdbClient(stub.url, 'key', connect_timeout=1, read_timeout=2, retries=0,
+                          backoff_factor=0, pool_size=2, breaker=CircuitBreaker(5, 30))
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/movies')
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'sql', 'serialization', 'http', 'total'})
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"', timing['sql'][1])
+        self.assertEqual(timing['http'][0], 0)
+        self.assertLessEqual(timing['sql'][0] + timing['serialization'][0], timing['total'][0])
+
+    def test_outbound_http_time(self):
+        with patch('movies.utils.omdb_client', self.stub_client(0.05)):
+            response = self.client.post('/movies', {'title': 'Unknown Title'})
+        self.assertEqual(response.status_code, 404)
+        self.assertGreaterEqual(self.server_timing(response)['http'][0], 50)
+
+    def test_outbound_http_time_of_import_threads(self):
+        with patch('movies.utils.omdb_client', self.stub_client(0.05)):
+            response = self.client.post('/movies/bulk', {'titles': ['First', 'Second']},
+                                        format='json')
+        self.assertGreaterEqual(self.server_timing(response)['http'][0], 100)
+
+    def test_metrics(self):
+        self.client.get('/top?from=2019-01-01&to=2019-12-31')
+        metrics = self.client.get('/metrics').content.decode()
+        for name in ('moviebox_request_duration_seconds', 'moviebox_request_sql_duration_seconds',
+                     'moviebox_request_sql_queries', 'moviebox_request_serialization_duration_seconds',
+                     'moviebox_request_http_duration_seconds'):
+            self.assertRegex(metrics, name + r'_count\{method="GET",view="movies:top"\} [1-9]')
+
+    def test_metrics_of_other_processes(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        environment = dict(os.environ, prometheus_multiproc_dir=metrics_dir)
+        script = ('import django; django.setup(); from django.test import Client; '
+                  'Client().get("/metrics")')
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', script], env=environment, check=True)
+        with patch.dict(os.environ, prometheus_multiproc_dir=metrics_dir):
+            metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('moviebox_request_duration_seconds_count{method="GET",view="metrics"} 2.0',
+                      metrics)
+
+
+class ReplicaRoutingTest(APITestCase):
+    """ Two SQLite databases: 'default' (the primary) and 'replica', with different movies """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        cls.settings_override = override_settings(DATABASE_REPLICAS=['replica'],
+                                                  READ_YOUR_WRITES_WINDOW=60)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+        shutil.rmtree(cls.replica_dir)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        Movie.objects.using('replica').bulk_create([Movie.from_omdb(batman_sample)])
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def titles(self):
+        return [movie['title'] for movie in self.client.get('/movies').json()]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.titles(), ['Batman'])
+        content = b''.join(self.client.get('/movies/export').streaming_content).decode()
+        self.assertEqual(json.loads(content)['title'], 'Batman')
+
+    def test_writes_go_to_primary_and_its_reads_follow(self):
+        response = self.client.post('/comments', {'movie_id': self.matrix.id, 'text': 'new'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('moviebox_last_write', response.cookies)
+        self.assertTrue(Comment.objects.using('default').filter(text='new').exists())
+        self.assertFalse(Comment.objects.using('replica').exists())
+        self.assertEqual(self.titles(), ['The Matrix'])
+        self.client.cookies.clear()
+        self.assertEqual(self.titles(), ['Batman'])
+
+    def test_read_your_writes_window_expires(self):
+        with override_settings(READ_YOUR_WRITES_WINDOW=0):
+            self.client.post('/comments', {'movie_id': self.matrix.id, 'text': 'new'})
+            self.assertEqual(self.titles(), ['Batman'])
+
+    def test_failed_writes_keep_reads_on_replica(self):
+        response = self.client.get('/movies?order=plot')
+        self.assertEqual(response.status_code, 400)
+        self.client.post('/movies/bulk', {'titles': []}, format='json')
+        self.assertEqual(self.titles(), ['Batman'])
+
+    def test_primary_outside_of_requests(self):
+        self.assertEqual(router.db_for_read(Movie), 'default')
+        self.assertEqual(Movie.objects.get().title, 'The Matrix')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch('movies.ingest.fetch_movie', fake_omdb)
+@patch('movies.views.fetch_movie', side_effect=AssertionError('fetched synchronously'))
+class IngestJobTest(APITestCase):
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def post_async(self, title):
+        return self.client.post('/movies', {'title': title}, HTTP_PREFER='respond-async')
+
+    def test_post_returns_job_and_worker_creates_movie(self, sync_fetch):
+        response = self.post_async('Matrix')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(job['status'], IngestJob.PENDING)
+        self.assertEqual(response['Location'], job['url'])
+        self.assertTrue(job['url'].endswith(f'/movies/jobs/{job["id"]}'))
+        self.assertFalse(Movie.objects.exists())
+
+        self.assertEqual(work(workers=2, once=True), 1)
+        job = self.client.get(f'/movies/jobs/{job["id"]}').json()
+        self.assertEqual(job['status'], IngestJob.DONE)
+        self.assertEqual(Movie.objects.get(id=job['movie']).title, 'The Matrix')
+        # the movie is in the database now, so it's returned at once
+        response = self.post_async('the matrix')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], job['movie'])
+
+    def test_same_title_is_queued_once(self, sync_fetch):
+        first = self.post_async('Matrix').json()
+        second = self.post_async(' MATRIX ').json()
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(IngestJob.objects.count(), 1)
+
+    def test_synchronous_by_default(self, sync_fetch):
+        with patch('movies.views.fetch_movie', fake_omdb):
+            response = self.client.post('/movies', {'title': 'Matrix'})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_cached_title_is_answered_synchronously(self, sync_fetch):
+        caches['omdb'].set('omdb:matrix', matrix_sample)
+        with patch('movies.views.fetch_movie', fake_omdb):
+            response = self.post_async('Matrix')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_not_found(self, sync_fetch):
+        job_id = self.post_async('Friends').json()['id']
+        work(once=True)
+        job = IngestJob.objects.get(id=job_id)
+        self.assertEqual(job.status, IngestJob.NOT_FOUND)
+        self.assertIsNone(job.movie)
+
+    @override_settings(INGEST_MAX_ATTEMPTS=2)
+    def test_unavailable_is_retried_with_backoff(self, sync_fetch):
+        job_id = self.post_async('Broken').json()['id']
+        work(once=True)
+        job = IngestJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), (IngestJob.PENDING, 1))
+        self.assertEqual(job.error, 'timeout')
+        self.assertGreater(job.run_after, timezone.now())
+        # not due yet
+        self.assertEqual(work(once=True), 0)
+
+        IngestJob.objects.update(run_after=timezone.now())
+        work(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestJob.FAILED, 2))
+
+    def test_claimed_job_is_not_claimed_again(self, sync_fetch):
+        IngestJob.objects.enqueue('Matrix')
+        self.assertEqual(len(IngestJob.objects.claim(10, lease=60)), 1)
+        self.assertEqual(IngestJob.objects.claim(10, lease=60), [])
+
+    def test_expired_lease_is_claimed_again(self, sync_fetch):
+        job = IngestJob.objects.enqueue('Matrix')
+        IngestJob.objects.claim(10, lease=60)
+        IngestJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = IngestJob.objects.claim(10, lease=60)
+        self.assertEqual([(j.id, j.attempts) for j in reclaimed], [(job.id, 2)])
+
+    @override_settings(INGEST_MAX_ATTEMPTS=2)
+    def test_job_of_workers_dying_on_every_attempt_fails(self, sync_fetch):
+        job = IngestJob.objects.enqueue('Matrix')
+        for attempt in range(2):
+            self.assertEqual(len(IngestJob.objects.claim(10, lease=60)), 1)
+            IngestJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(IngestJob.objects.claim(10, lease=60), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestJob.FAILED, 2))
+        self.assertTrue(job.error)
+
+    def test_job_failing_to_save_does_not_stop_the_others(self, sync_fetch):
+        for title in ['Matrix', 'Batman']:
+            self.post_async(title)
+        get_or_create = Movie.get_or_create_from_omdb
+
+        def save(movie_data):
+            if movie_data['title'] == 'Batman':
+                raise ValueError('broken data')
+            return get_or_create(movie_data)
+
+        with patch('movies.ingest.Movie.get_or_create_from_omdb', side_effect=save), \
+                self.assertLogs('movies.ingest', 'ERROR'):
+            self.assertEqual(work(once=True), 2)
+        statuses = dict(IngestJob.objects.values_list('title', 'status'))
+        self.assertEqual(statuses, {'Matrix': IngestJob.DONE, 'Batman': IngestJob.PENDING})
+        failed = IngestJob.objects.get(title='Batman')
+        self.assertEqual((failed.attempts, failed.error), (1, 'ValueError: broken data'))
+        self.assertEqual(list(Movie.objects.values_list('title', flat=True)), ['The Matrix'])
+
+    def test_worker_command(self, sync_fetch):
+        for title in ['Matrix', 'Batman', 'Watchmen']:
+            self.post_async(title)
+        out = StringIO()
+        call_command('ingest_worker', '--once', '--workers=2', stdout=out)
+        self.assertIn('Ran 3 jobs.', out.getvalue())
+        self.assertEqual(Movie.objects.count(), 3)
+        self.assertFalse(IngestJob.objects.exclude(status=IngestJob.DONE).exists())
+
+
+class CommentPartitionsTest(APITestCase):
+
+    def test_months(self):
+        self.assertEqual(list(months(datetime(2018, 11, 15).date(), datetime(2019, 2, 1).date())),
+                         [datetime(2018, 11, 1).date(), datetime(2018, 12, 1).date(),
+                          datetime(2019, 1, 1).date(), datetime(2019, 2, 1).date()])
+        self.assertEqual(partition_name(datetime(2019, 4, 1).date()), 'movies_comment_p2019_04')
+
+    def test_nothing_is_partitioned_on_sqlite(self):
+        self.assertEqual(create_future_partitions(connection), [])
+        out = StringIO()
+        call_command('create_comment_partitions', stdout=out)
+        self.assertIn('not partitioned', out.getvalue())
+
+    @skipUnless(connection.vendor != 'postgresql', 'Comments are partitioned on PostgreSQL.')
+    def test_migration_warns_that_it_did_not_partition(self):
+        migration = import_module('movies.migrations.0015_comment_partitions')
+        with self.assertLogs(migration.logger, 'WARNING') as logs:
+            migration.partition(None, SimpleNamespace(connection=connection))
+        self.assertIn('not partitioned', logs.output[0])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Comments are partitioned on PostgreSQL only.')
+    def test_rows_of_the_default_partition_are_moved(self):
+        if not is_partitioned(connection):
+            self.skipTest('Partitioning needs PostgreSQL 11.')
+        movie = Movie.objects.create(**matrix_sample)
+        content_type = ContentType.objects.get_for_model(Movie)
+        months_ahead = [date(2099, 1, 1), date(2099, 2, 1)]
+        comments = []
+        for month in months_ahead:
+            comment = Comment.objects.create(text='future', object_id=movie.id,
+                                             content_type=content_type)
+            Comment.objects.filter(pk=comment.pk).update(
+                created=datetime(month.year, month.month, 15, tzinfo=timezone.utc))
+            comments.append(comment)
+        with connection.cursor() as cursor:
+            # a table of the second month left detached by a failed run
+            cursor.execute(f"CREATE TABLE {partition_name(months_ahead[1])} "
+                           f"(LIKE movies_comment INCLUDING DEFAULTS)")
+        self.assertEqual(create_partitions(connection, *months_ahead),
+                         [partition_name(month) for month in months_ahead])
+        self.assertEqual(create_partitions(connection, *months_ahead), [])
+        with connection.cursor() as cursor:
+            for month, comment in zip(months_ahead, comments):
+                self.assertTrue(is_attached(cursor, partition_name(month)))
+                cursor.execute(f"SELECT id FROM {partition_name(month)}")
+                self.assertEqual(cursor.fetchall(), [(comment.pk,)])
+            cursor.execute("SELECT count(*) FROM movies_comment_default WHERE created >= '2099-01-01'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(Comment.objects.filter(text='future').count(), 2)
+
+
+class CommentMovieForeignKeyTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+
+    def test_movie_is_set_for_movie_comments_only(self):
+        self.client.post('/comments', {'movie_id': self.matrix.id, 'text': 'movie'})
+        # a comment of another content type, with the same object id
+        other = Comment.objects.create(text='genre', object_id=self.matrix.id,
+                                       content_type=ContentType.objects.get_for_model(Genre))
+        self.assertIsNone(other.movie_id)
+        self.assertEqual(Comment.objects.get(text='movie').movie_id, self.matrix.id)
+
+        results = self.client.get(f'/comments?movie={self.matrix.id}').json()['results']
+        self.assertEqual([comment['text'] for comment in results], ['movie'])
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.comment_count, 1)
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.matrix).count, 1)
+        # the generic relation keeps working
+        self.assertEqual(list(self.matrix.comments.values_list('text', flat=True)), ['movie'])
+
+    def test_movie_comments_are_filtered_on_the_foreign_key(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f'/comments?movie={self.matrix.id}')
+        sql = context.captured_queries[-1]['sql']
+        self.assertIn('"movie_id" = ', sql)
+        self.assertNotIn('object_id" = ', sql)
+
+    def test_comment_of_missing_movie_is_rejected(self):
+        for movie_id in [self.matrix.id + 1000, 'abc', '', '\u00b2', 99999999999999999999999]:
+            response = self.client.post('/comments', {'movie_id': movie_id, 'text': 'lost'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_comment_posted_as_json(self):
+        for movie_id in [self.matrix.id, str(self.matrix.id)]:
+            response = self.client.post('/comments', {'movie_id': movie_id, 'text': 'json'},
+                                        format='json')
+            self.assertEqual(response.status_code, 201)
+        for movie_id in [True, self.matrix.id + 1000, 1.5, None]:
+            response = self.client.post('/comments', {'movie_id': movie_id, 'text': 'json'},
+                                        format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/comments', [{'movie_id': self.matrix.id}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.objects.filter(movie=self.matrix).count(), 2)
+
+    def test_invalid_movie_filter(self):
+        for movie_id in ['abc', '99999999999999999999999']:
+            response = self.client.get('/comments', {'movie': movie_id})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class CommentBulkTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+
+    def post(self, comments):
+        return self.client.post('/comments/bulk', {'comments': comments}, format='json')
+
+    def test_comments_are_saved_with_counters(self):
+        comments_version = ResourceVersion.objects.stamps([ResourceVersion.COMMENTS])
+        response = self.post([{'movie_id': self.matrix.id, 'text': 'one'},
+                              {'movie_id': self.batman.id, 'text': 'two'},
+                              {'movie_id': self.matrix.id, 'text': 'three'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([comment['text'] for comment in response.json()], ['one', 'two', 'three'])
+        self.assertTrue(all(comment['created'] for comment in response.json()))
+        self.assertEqual(Comment.objects.filter(movie=self.matrix).count(), 2)
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.comment_count, 2)
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.batman).count, 1)
+        self.assertNotEqual(ResourceVersion.objects.stamps([ResourceVersion.COMMENTS]),
+                            comments_version)
+        results = self.client.get(f'/comments?movie={self.matrix.id}').json()['results']
+        self.assertEqual([comment['text'] for comment in results], ['one', 'three'])
+
+    def test_movie_ids_are_accepted_as_posted_to_comments(self):
+        response = self.post([{'movie_id': str(self.matrix.id), 'text': 'string'},
+                              {'movie_id': self.matrix.id, 'text': 'number'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.filter(movie=self.matrix).count(), 2)
+
+    def test_query_count_does_not_depend_on_the_number_of_comments(self):
+        def queries(number):
+            with CaptureQueriesContext(connection) as context:
+                self.post([{'movie_id': self.matrix.id, 'text': 'hi'}] * number)
+            return len(context.captured_queries)
+
+        # the first post creates the rollup and version rows
+        queries(1)
+        self.assertEqual(queries(2), queries(50))
+
+    def test_query_count_does_not_depend_on_the_number_of_movies(self):
+        movies = [self.matrix, self.batman] + [
+            Movie.objects.create(**dict(matrix_sample, title=f'Sequel {number}', imdbid=f'tt{number}'))
+            for number in range(8)]
+
+        def queries(movies):
+            with CaptureQueriesContext(connection) as context:
+                self.post([{'movie_id': movie.id, 'text': 'hi'} for movie in movies] * 2)
+            return len(context.captured_queries)
+
+        # the first post loads the content type, the next ones create rollup and version rows
+        queries(movies[:1])
+        self.assertEqual(queries(movies[1:3]), queries(movies))
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.comment_count, 4)
+        self.assertEqual(DailyCommentCount.objects.get(movie=movies[-1]).count, 2)
+        self.assertEqual(ResourceVersion.objects.stamps([ResourceVersion.comments_of(movies[-1].id)])
+                         [ResourceVersion.comments_of(movies[-1].id)][0], 1)
+
+    def test_comments_of_deleted_movies_are_dropped(self):
+        content_type = ContentType.objects.get_for_model(Movie)
+        comments = [Comment(content_type=content_type, object_id=movie.id, text='hi')
+                    for movie in (self.matrix, self.batman)]
+        for comment in comments:
+            comment.set_movie()
+        Movie.objects.filter(pk=self.batman.pk).delete()
+        self.assertEqual(save_comments(comments), comments[:1])
+        self.assertEqual(list(Comment.objects.values_list('movie_id', flat=True)), [self.matrix.id])
+        self.assertEqual(list(DailyCommentCount.objects.values_list('movie_id', 'count')),
+                         [(self.matrix.id, 1)])
+
+    def test_invalid_comments_are_rejected_together(self):
+        for comments in [[], 'text', [1, 2],
+                         [{'movie_id': self.matrix.id, 'text': 'ok'}, {'movie_id': self.matrix.id}],
+                         [{'movie_id': self.matrix.id, 'text': 'ok'}, {'movie_id': 0, 'text': 'x'}],
+                         [{'movie_id': True, 'text': 'ok'}],
+                         [{'movie_id': f'{self.matrix.id}.0', 'text': 'ok'}],
+                         [{'movie_id': 2 ** 31, 'text': 'ok'}]]:
+            response = self.post(comments)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        with patch('movies.views.CommentBulkAPIView.max_comments', 1):
+            response = self.post([{'movie_id': self.matrix.id, 'text': 'ok'}] * 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Comment.objects.exists())
+
+
+class CommentBufferTest(SimpleTestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def save(self, comments):
+        self.batches.append(comments)
+        return comments
+
+    def test_full_buffer_is_flushed_at_once(self):
+        buffer = CommentBuffer(size=3, interval=3600, save=self.save)
+        futures = [buffer.add(f'comment {i}') for i in range(4)]
+        self.assertEqual(self.batches, [['comment 0', 'comment 1', 'comment 2']])
+        self.assertEqual(futures[2].result(timeout=0), 'comment 2')
+        self.assertFalse(futures[3].done())
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(futures[3].result(timeout=0), 'comment 3')
+
+    def test_buffer_is_flushed_after_the_interval(self):
+        buffer = CommentBuffer(size=100, interval=0.05, save=self.save)
+        future = buffer.add('comment')
+        self.assertEqual(future.result(timeout=5), 'comment')
+        self.assertEqual(self.batches, [['comment']])
+
+    def test_failures_are_passed_to_the_waiting_requests(self):
+        def save(comments):
+            raise RuntimeError('database is down')
+
+        buffer = CommentBuffer(size=2, interval=3600, save=save)
+        with self.assertLogs('movies.comment_buffer', 'ERROR'):
+            futures = [buffer.add('one'), buffer.add('two')]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=0)
+
+    def test_flush_thread_survives_errors(self):
+        buffer = CommentBuffer(size=100, interval=0.01, save=self.save)
+        with patch('movies.comment_buffer.connections.close_all',
+                   side_effect=RuntimeError('connection lost')), \
+                self.assertLogs('movies.comment_buffer', 'ERROR'):
+            self.assertEqual(buffer.add('one').result(timeout=5), 'one')
+            time.sleep(0.05)
+            self.assertEqual(buffer.add('two').result(timeout=5), 'two')
+            self.assertTrue(buffer.thread.is_alive())
+
+    def test_skipped_comments(self):
+        buffer = CommentBuffer(size=2, interval=3600, save=lambda comments: comments[:1])
+        saved, skipped = buffer.add('one'), buffer.add('two')
+        self.assertEqual(saved.result(timeout=0), 'one')
+        with self.assertRaises(Movie.DoesNotExist):
+            skipped.result(timeout=0)
+
+
+@override_settings(COMMENT_WRITE_BEHIND=True)
+class WriteBehindCommentTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+
+    def post(self, movie_id, text='buffered'):
+        return self.client.post('/comments', {'movie_id': movie_id, 'text': text})
+
+    def test_commit_durability_answers_after_saving(self):
+        with patch('movies.views.comment_buffer', CommentBuffer(size=1, interval=3600)):
+            response = self.post(self.matrix.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['created'])
+        comment = Comment.objects.get()
+        self.assertEqual((comment.text, comment.movie_id), ('buffered', self.matrix.id))
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.comment_count, 1)
+
+    @override_settings(COMMENT_SAVE_TIMEOUT=0.01)
+    def test_commit_durability_gives_up_waiting(self):
+        with patch('movies.views.comment_buffer', CommentBuffer(size=100, interval=3600)):
+            response = self.post(self.matrix.id)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('error', response.json())
+
+    @override_settings(COMMENT_DURABILITY='buffer')
+    def test_buffer_durability_answers_before_saving(self):
+        buffer = CommentBuffer(size=100, interval=3600)
+        with patch('movies.views.comment_buffer', buffer):
+            responses = [self.post(self.matrix.id, f'comment {i}') for i in range(3)]
+        self.assertEqual([response.status_code for response in responses], [202] * 3)
+        self.assertIsNone(responses[0].json()['created'])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertEqual(DailyCommentCount.objects.get(movie=self.matrix).count, 3)
+
+    def test_invalid_comments_are_not_buffered(self):
+        buffer = CommentBuffer(size=100, interval=3600)
+        with patch('movies.views.comment_buffer', buffer):
+            self.assertEqual(self.post(self.matrix.id + 1).status_code, 400)
+            self.assertEqual(self.post(self.matrix.id, '').status_code, 400)
+        self.assertEqual(buffer.pending, [])
+
+    @override_settings(COMMENT_DURABILITY='eventually')
+    def test_unknown_durability_is_a_configuration_error(self):
+        buffer = CommentBuffer(size=100, interval=3600)
+        with patch('movies.views.comment_buffer', buffer):
+            with self.assertRaises(ImproperlyConfigured):
+                self.post(self.matrix.id)
+        self.assertEqual(buffer.pending, [])
+
+
+@override_settings(COMMENT_WRITE_BEHIND=True)
+class ConcurrentWriteBehindCommentTest(TransactionTestCase):
+
+    def test_concurrent_requests_are_committed_together(self):
+        matrix = Movie.objects.create(**matrix_sample)
+        batches = []
+
+        def save(comments):
+            batches.append(len(comments))
+            return save_comments(comments)
+
+        def post(number):
+            try:
+                response = APIClient().post('/comments', {'movie_id': matrix.id,
+                                                          'text': f'comment {number}'})
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        statuses = []
+        # flushed when all of them are buffered, or by the thread after a second
+        buffer = CommentBuffer(size=5, interval=1, save=save)
+        with patch('movies.views.comment_buffer', buffer):
+            threads = [threading.Thread(target=post, args=(number,)) for number in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(statuses, [201] * 5)
+        self.assertEqual(batches, [5])
+        matrix.refresh_from_db()
+        self.assertEqual(matrix.comment_count, 5)
+        self.assertEqual(DailyCommentCount.objects.get(movie=matrix).count, 5)
+
+
+class MovieDetailCommentsTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Movie.objects.create(**matrix_sample)
+        cls.batman = Movie.objects.create(**batman_sample)
+        content_type = ContentType.objects.get_for_model(Movie)
+        start = timezone.now() - timedelta(days=1)
+        for movie in (cls.matrix, cls.batman):
+            for number in range(5):
+                comment = Comment.objects.create(content_type=content_type, object_id=movie.id,
+                                                 text=f'{movie.title} {number}')
+                Comment.objects.filter(pk=comment.pk).update(
+                    created=start + timedelta(minutes=number))
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def texts(self, movie):
+        return [comment['text'] for comment in movie['comments']]
+
+    @override_settings(MOVIE_COMMENTS_LIMIT=3)
+    def test_movies_by_ids_with_latest_comments(self):
+        response = self.client.get(f'/movies?ids={self.batman.id},{self.matrix.id}')
+        self.assertEqual(response.status_code, 200)
+        movies = response.json()
+        self.assertEqual([movie['id'] for movie in movies], [self.batman.id, self.matrix.id])
+        self.assertEqual(self.texts(movies[0]), ['Batman 2', 'Batman 3', 'Batman 4'])
+        self.assertEqual(self.texts(movies[1]), ['The Matrix 2', 'The Matrix 3', 'The Matrix 4'])
+        self.assertEqual(movies[1]['comments'][0]['movie_id'], self.matrix.id)
+
+    def test_latest_comments_are_read_from_the_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The query plan is checked on SQLite.')
+        comments = Comment.objects.latest_of_movies([self.matrix.id, self.batman.id], 3)
+        self.assertEqual(sorted(comments.values_list('text', flat=True)),
+                         ['Batman 2', 'Batman 3', 'Batman 4',
+                          'The Matrix 2', 'The Matrix 3', 'The Matrix 4'])
+        sql, params = comments.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        # every movie's branch reads only the (movie, created, id) index,
+        # in its order, and the comments found are read by primary key
+        index = next(index.name for index in Comment._meta.indexes
+                     if index.fields == ['movie', 'created', 'id'])
+        self.assertEqual(len([step for step in plan if f'COVERING INDEX {index}' in step]), 2)
+        self.assertFalse([step for step in plan if 'TEMP B-TREE' in step])
+        self.assertIn('PRIMARY KEY', ' '.join(plan))
+        self.assertFalse([step for step in plan if step.startswith('SCAN movies_comment')])
+
+    @override_settings(MOVIE_COMMENTS_LIMIT=2)
+    def test_updated_movie_has_latest_comments(self):
+        response = self.client.put(f'/movies/{self.matrix.id}', {'director': 'Someone Else'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['director'], 'Someone Else')
+        self.assertEqual(self.texts(response.json()), ['The Matrix 3', 'The Matrix 4'])
+
+    @override_settings(MOVIE_COMMENTS_LIMIT=2)
+    @patch('movies.views.fetch_movie', return_value=matrix_sample)
+    def test_posted_title_of_an_existing_movie_has_latest_comments(self, fetch):
+        # 'matrix' isn't the title of the saved movie, but OMDb finds it
+        response = self.client.post('/movies', {'title': 'matrix'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.matrix.id)
+        self.assertEqual(self.texts(response.json()), ['The Matrix 3', 'The Matrix 4'])
+        fetch.assert_called_once_with('matrix')
+
+    def test_number_of_queries_does_not_grow_with_movies(self):
+        for ids in (f'{self.matrix.id}', f'{self.matrix.id},{self.batman.id},{self.batman.id + 100}'):
+            caches['responses'].clear()
+            # stamps, movies and comments
+            with self.assertNumQueries(3):
+                response = self.client.get(f'/movies?ids={ids}')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_comments_are_not_loaded_unless_returned(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/movies?ids={self.matrix.id}&fields=id,title')
+        self.assertEqual(response.json(), [{'id': self.matrix.id, 'title': 'The Matrix'}])
+
+    def test_invalid_ids(self):
+        for ids in ('', 'abc', '1,-2', '\u00b2', '99999999999999999999999', f'1,{2 ** 31}',
+                    ','.join(map(str, range(1, 102)))):
+            response = self.client.get(f'/movies?ids={ids}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+    @override_settings(MOVIE_COMMENTS_LIMIT=2)
+    def test_movie_detail(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/movies/{self.matrix.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'The Matrix')
+        self.assertEqual(self.texts(response.json()), ['The Matrix 3', 'The Matrix 4'])
+        self.assertEqual(self.client.get(f'/movies/{self.batman.id + 100}').status_code, 404)
+
+    def test_movie_detail_etag_follows_its_comments(self):
+        etag = self.client.get(f'/movies/{self.matrix.id}')['ETag']
+        self.client.post('/comments', {'movie_id': self.batman.id, 'text': 'other movie'})
+        response = self.client.get(f'/movies/{self.matrix.id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.post('/comments', {'movie_id': self.matrix.id, 'text': 'new'})
+        response = self.client.get(f'/movies/{self.matrix.id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.texts(response.json())[-1], 'new')
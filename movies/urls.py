@@ -2,8 +2,13 @@ from django.urls import path, include
 
 from .views import (
     CommentAPIView,
+    CommentBulkAPIView,
+    IngestJobAPIView,
     MovieAPIView,
+    MovieBulkImportAPIView,
     MovieDeleteUpdateAPIView,
+    MovieExportView,
+    MovieSearchAPIView,
     MovieTopAPIView,
 )
 
@@ -11,7 +16,12 @@ app_name = 'movies'
 
 urlpatterns = [
     path('movies', MovieAPIView.as_view(), name='add-fetch'),
+    path('movies/bulk', MovieBulkImportAPIView.as_view(), name='bulk-import'),
+    path('movies/export', MovieExportView.as_view(), name='export'),
+    path('movies/search', MovieSearchAPIView.as_view(), name='search'),
+    path('movies/jobs/<int:pk>', IngestJobAPIView.as_view(), name='ingest-job'),
     path('movies/<int:pk>', MovieDeleteUpdateAPIView.as_view(), name='update-delete'),
     path('comments', CommentAPIView.as_view(), name='comments'),
+    path('comments/bulk', CommentBulkAPIView.as_view(), name='comments-bulk'),
     path('top', MovieTopAPIView.as_view(), name='top'),
 ]
@@ -1,16 +1,211 @@
-import os
+import math
+import re
+import threading
+import time
+from concurrent.futures import Future
 
 import requests
+from django.conf import settings
+from django.core.cache import caches
 from django.utils.text import slugify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from .metrics import timed
 
-OMDB_URL_BASE = 'http://www.omdbapi.com/?apikey'
-OMDB_API_KEY = os.environ.get('OMDB_API_KEY')
 
+class OmdbUnavailable(Exception):
+    """ Raised by fetch_movie when OMDb fails or the circuit breaker is open """
 
-def fetch_movie(title):
-    title_slug = slugify(title)
-    url = f"{OMDB_URL_BASE}={OMDB_API_KEY}&t={title_slug}"
-    result = requests.get(url)
-    raw_dict = result.json()
-    return {key.lower(): value for key, value in raw_dict.items()}
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service to let requests fail fast.
+    
+    After 'failure_threshold' consecutive failures the circuit opens
+    and 'allow()' returns False. Once 'reset_timeout' seconds pass,
+    a single trial call is let through: its success closes the circuit,
+    its failure opens it again for another 'reset_timeout'.
+    """
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key within a process.
+    The first caller runs the function, the ones arriving
+    while it is in flight wait for it and share its result
+    (or its exception) instead of repeating the call.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            call.set_result(function(*args))
+        except Exception as exc:
+            call.set_exception(exc)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return call.result()
+
+
+class OmdbClient:
+    """
+    HTTP client for the OMDb API shared by all the requests of a process.
+    
+    The session keeps connections alive in a pool, every call
+    is bounded by connect and read timeouts, connection errors
+    and 5xx responses are retried with exponential backoff,
+    and a circuit breaker fails fast while OMDb is unhealthy.
+    """
+    def __init__(self, url, api_key, connect_timeout, read_timeout,
+                 retries, backoff_factor, pool_size, breaker):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, title_slug):
+        if not self.breaker.allow():
+            raise OmdbUnavailable('OMDb is unavailable, not retrying yet.')
+        try:
+            with timed('http'):
+                response = self.session.get(self.url,
+                                            params={'apikey': self.api_key, 't': title_slug},
+                                            timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            self.breaker.record_failure()
+            raise OmdbUnavailable(str(exc)) from exc
+        self.breaker.record_success()
+        return data
+
+
+omdb_client = OmdbClient(
+    url=settings.OMDB_URL,
+    api_key=settings.OMDB_API_KEY,
+    connect_timeout=settings.OMDB_CONNECT_TIMEOUT,
+    read_timeout=settings.OMDB_READ_TIMEOUT,
+    retries=settings.OMDB_RETRIES,
+    backoff_factor=settings.OMDB_BACKOFF_FACTOR,
+    pool_size=settings.OMDB_POOL_SIZE,
+    breaker=CircuitBreaker(settings.OMDB_FAILURE_THRESHOLD, settings.OMDB_RESET_TIMEOUT),
+)
+
+
+omdb_flight = SingleFlight()
+
+
+def _cache_key(title_slug):
+    return f'omdb:{title_slug}'
+
+
+def _fetch_and_cache(title_slug, client):
+    cache = caches['omdb']
+    cache_key = _cache_key(title_slug)
+    movie = cache.get(cache_key)
+    if movie is None:
+        raw_dict = client.get(title_slug)
+        movie = {key.lower(): value for key, value in raw_dict.items()}
+        ttl = (settings.OMDB_CACHE_TTL if movie.get('response') == 'True'
+               else settings.OMDB_NEGATIVE_CACHE_TTL)
+        cache.set(cache_key, movie, ttl)
+    return movie
+
+
+def normalize_title(title):
+    """ Key under which a title is looked up, both in OMDb and in Movie.title_key """
+    return slugify(title)
+
+
+def fetch_movie(title, client=None):
+    """
+    Get movie data from OMDb, going through the 'omdb' cache.
+    Found movies are cached for settings.OMDB_CACHE_TTL seconds and titles
+    OMDb doesn't know (response == 'False') for settings.OMDB_NEGATIVE_CACHE_TTL,
+    so repeated lookups of unknown titles don't reach the network.
+    Failures (OmdbUnavailable) are never cached.
+    Concurrent lookups of the same title share a single call.
+    """
+    title_slug = normalize_title(title)
+    return omdb_flight.do(title_slug, _fetch_and_cache, title_slug, client or omdb_client)
+
+
+def cached_movie(title):
+    """ Data of the title from the 'omdb' cache, without calling OMDb; None if it isn't cached """
+    return caches['omdb'].get(_cache_key(normalize_title(title)))
+
+
+def split_names(value):
+    """
+    Split a comma-separated OMDb value (e.g. 'Action, Sci-Fi')
+    into lowercase tokens, skipping empty and 'N/A' entries.
+    """
+    names = (name.strip().lower() for name in value.split(','))
+    return sorted({name for name in names if name and name != 'n/a'})
+
+
+def parse_int(value, maximum=None):
+    """
+    The first whole number in an OMDb value, ignoring thousands separators:
+    '1,488,823' -> 1488823, '136 min' -> 136, '2005–2008' -> 2005.
+    None if there is no number (e.g. 'N/A') or it is greater than 'maximum'.
+    """
+    match = re.search(r'\d[\d,]*', value or '')
+    if not match:
+        return None
+    number = int(match.group().replace(',', ''))
+    return number if maximum is None or number <= maximum else None
+
+
+def parse_float(value):
+    """ The first decimal number in an OMDb value ('8.7' -> 8.7), or None (also if it's infinite) """
+    match = re.search(r'\d+(\.\d+)?', value or '')
+    number = float(match.group()) if match else None
+    return number if number is not None and math.isfinite(number) else None
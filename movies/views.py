@@ -1,49 +1,118 @@
 """
 Views and endpoints handled:
     CommentAPIView:
-        POST /comments
-        GET /comments [?<movie=id>]
+        POST /comments (buffered in write-behind mode, see movies.comment_buffer)
+        GET /comments [?<movie=id>][?<page_size=n>][?<cursor=c>]
     MovieAPIView:
-        POST /movies
-        GET /movies [?<genre=genrename>][?<director=directorname>]
+        POST /movies (202 with a job in asynchronous mode, see movies.ingest)
+        GET /movies?ids=<movie-id>[,<movie-id>...]
+        GET /movies [?<genre=genrename>][?<director=directorname>][?<match=exact>]
+                    [?<year_min=yyyy>][?<year_max=yyyy>][?<min_rating=x.y>][?<min_votes=n>]
+                    [?<order=[-]title|year|runtime|metascore|imdbrating|imdbvotes|comments>]
+    CommentBulkAPIView:
+        POST /comments/bulk {"comments": [{"movie_id": <id>, "text": <text>}, ...]}
+    IngestJobAPIView:
+        GET /movies/jobs/<job-id>
+    MovieBulkImportAPIView:
+        POST /movies/bulk titles=<title>[&titles=<title>...]
+    MovieExportView:
+        GET /movies/export [?<format=ndjson|json>][?<comments=1>]
+    MovieSearchAPIView:
+        GET /movies/search?q=<words>[&<page=n>][&<page_size=n>]
     MovieDeleteUpdateAPIView:
+        GET /movies/<movie-id>
         DELETE /movies/<movie-id>
         PUT /movies/<movie-id>
     MovieTopAPIView:
-        GET /top?from=<yyyy-mm-dd>&to=<yyyy-mm-dd>
+        GET /top?from=<yyyy-mm-dd>&to=<yyyy-mm-dd>[&<limit=n>][&<offset=n>][&<exclude_empty=1>]
+
+GET /comments, /movies, /movies/<movie-id>, /movies/search and /top answer conditional
+requests (If-None-Match) based on version stamps
+of the collections they read (see movies.conditional).
+Responses of GET /comments, /movies and /top are also cached
+until one of those collections changes (see movies.response_cache).
+
+Movie details (GET /movies?ids=, GET and PUT /movies/<movie-id>, POST /movies)
+embed only the latest MOVIE_COMMENTS_LIMIT comments of every movie,
+all of them loaded with a single query (see 'prefetch_latest_comments()');
+the rest are paged by GET /comments?movie=<movie-id>.
+
+All the endpoints of CommentAPIView, MovieAPIView, MovieSearchAPIView
+and MovieDeleteUpdateAPIView accept [?<fields=name,name...>]
+to return only the given fields (see SparseFieldsetViewMixin).
 
 """
-import json
+import math
 from datetime import datetime
 
-from django.db.models import Count, F, Q, Window
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F, Prefetch, Sum, Window, prefetch_related_objects
 from django.db.models.functions import DenseRank
 from django.contrib.contenttypes.models import ContentType
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views import View
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
     GenericAPIView,
     ListAPIView,
+    RetrieveAPIView,
 )
 from rest_framework.mixins import (
     CreateModelMixin,
     DestroyModelMixin,
     ListModelMixin,
-    UpdateModelMixin,
 )
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
+from .comment_buffer import (
+    comment_buffer,
+    comment_durability,
+    save_comments,
+)
+from .conditional import versioned
+from .export import (
+    FORMATS,
+    NDJSON,
+    export_movies,
+)
+from .importer import import_titles
+from .ingest import wants_async
 from .models import (
     Comment,
+    DailyCommentCount,
+    IngestJob,
     Movie,
+    ResourceVersion,
 )
+from .pagination import KeysetPagination
+from .response_cache import cached_response
 from .serializers import (
     CommentCreateSerializer,
     CommentListSerializer,
+    IngestJobSerializer,
     MovieDetailSerializer,
     MovieListSerializer,
     MovieRankSerializer,
+    MovieSearchSerializer,
+)
+from .search import search_movies
+from .utils import (
+    OmdbUnavailable,
+    cached_movie,
+    fetch_movie,
+    normalize_title,
 )
-from .utils import fetch_movie
+
+
+MAX_MOVIE_IDS = 100
+# largest value of integer query parameters, so that they (and sums of them)
+# fit the database's integers
+MAX_INT_PARAM = 2 ** 31 - 1
 
 
 class NoDateRangeException(Exception):
@@ -54,8 +123,167 @@ class BadDateFormatException(Exception):
     """ Raised by MovieTopAPIView when date has a wrong format """
 
 
-class CommentAPIView(CreateModelMixin, ListModelMixin, GenericAPIView):
+class BadFilterException(Exception):
+    """ Raised by MovieAPIView and MovieTopAPIView when a filter or the ordering has a wrong value """
+
+
+def bounded_int(value):
+    value = int(value)
+    if abs(value) > MAX_INT_PARAM:
+        raise ValueError(value)
+    return value
+
+
+def finite_float(value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(value)
+    return value
+
+
+def movie_ids(value):
+    """ Unique ids from a comma-separated list, in the given order """
+    ids = [part.strip() for part in value.split(',') if part.strip()]
+    if not ids or not all(part.isdecimal() and int(part) <= MAX_INT_PARAM for part in ids):
+        raise BadFilterException(
+            "Invalid value of 'ids'. It must be a comma-separated list of movie ids.")
+    ids = list(dict.fromkeys(map(int, ids)))
+    if len(ids) > MAX_MOVIE_IDS:
+        raise BadFilterException(f"Up to {MAX_MOVIE_IDS} movies can be requested at once.")
+    return ids
+
+
+def prefetch_latest_comments(movies, fields=None, limit=None):
+    """
+    Prefetch the latest 'limit' comments of every movie (MovieDetailSerializer's
+    'comments'), oldest first, for all the movies with one query
+    (see CommentQuerySet.latest_of_movies). Nothing is prefetched
+    when 'fields' leaves out 'comments'.
+    """
+    if not movies or (fields is not None and 'comments' not in fields):
+        return
+    comments = (Comment.objects
+                .latest_of_movies([movie.pk for movie in movies], limit or settings.MOVIE_COMMENTS_LIMIT)
+                .order_by('created', 'id'))
+    prefetch_related_objects(movies, Prefetch('movie_comments', queryset=comments))
+
+
+def comment_movie_id(value):
+    """
+    Movie id of a posted comment, given as a decimal string or (in JSON)
+    a number; None unless it's a non-negative integer of the database's range.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str) or not value.isdecimal() or int(value) > MAX_INT_PARAM:
+        return None
+    return int(value)
+
+
+def comment_list_versions(request):
+    """ Comments of the movie given by 'movie', or all of them """
+    try:
+        return [ResourceVersion.comments_of(int(request.GET['movie']))]
+    except (KeyError, ValueError):
+        return [ResourceVersion.COMMENTS]
+
+
+def field_names(value, serializer_class):
+    """
+    Names of a comma-separated 'fields' value; raises ValidationError
+    unless they are all readable fields of the serializer
+    """
+    available = [name for name, field in serializer_class().fields.items()
+                 if not field.write_only]
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    if not fields or set(fields) - set(available):
+        raise ValidationError({
+            "error": "Invalid fields. The available fields are: {}.".format(
+                ', '.join(available))})
+    return fields
+
+
+def movie_list_versions(request):
+    """
+    Movies, and comments when their counts are returned or sorted by;
+    only comments of the given movies for 'ids'.
+    """
+    serializer_class = MovieDetailSerializer if 'ids' in request.GET else MovieListSerializer
+    try:
+        fields = field_names(request.GET['fields'], serializer_class)
+    except (KeyError, ValidationError):
+        # no 'fields' (or invalid ones, answered with 400): all fields
+        fields = None
+    order = request.GET.get('order', '')
+    if 'ids' in request.GET and (fields is None or 'comments' in fields):
+        try:
+            ids = movie_ids(request.GET['ids'])
+        except BadFilterException:
+            return [ResourceVersion.MOVIES]
+        return [ResourceVersion.MOVIES, *map(ResourceVersion.comments_of, ids)]
+    if fields is None or 'comments' in fields or order.lstrip('-') == 'comments':
+        return [ResourceVersion.MOVIES, ResourceVersion.COMMENTS]
+    return [ResourceVersion.MOVIES]
+
+
+def movie_detail_versions(request):
+    """ Movies and comments of the movie """
+    return [ResourceVersion.MOVIES,
+            ResourceVersion.comments_of(request.resolver_match.kwargs['pk'])]
+
+
+def top_versions(request):
+    """
+    Movies and comments, but only comments from before today
+    ('comments-history') when the date range ends before today.
+    """
+    try:
+        date_to = datetime.strptime(request.GET['to'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        date_to = None
+    if date_to is not None and date_to < timezone.localdate():
+        return [ResourceVersion.MOVIES, ResourceVersion.COMMENTS_HISTORY]
+    return [ResourceVersion.MOVIES, ResourceVersion.COMMENTS, ResourceVersion.COMMENTS_HISTORY]
+
+
+class SparseFieldsetViewMixin:
+    """
+    Handles the 'fields' query parameter - a comma-separated list
+    of fields to return. The serializer only outputs those fields
+    and 'project()' makes the query load only the columns they need,
+    so unrequested (often long) values never leave the database.
+    Without 'fields', the columns of all the fields of the serializer are loaded.
+    """
+    # columns loaded whatever the requested fields (e.g. needed by pagination)
+    always_loaded = ('id',)
+
+    def requested_fields(self, serializer_class=None):
+        value = self.request.GET.get('fields')
+        if value is None:
+            return None
+        return field_names(value, serializer_class or self.get_serializer_class())
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def project(self, queryset, serializer_class=None):
+        """ Defer the columns which none of the returned fields reads """
+        serializer_class = serializer_class or self.get_serializer_class()
+        fields = self.requested_fields(serializer_class)
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        sources = [field.source for name, field in serializer_class().fields.items()
+                   if fields is None or name in fields]
+        return queryset.only(*self.always_loaded,
+                             *(source for source in sources if source in columns))
+
+
+@versioned(comment_list_versions)
+@cached_response('comments', 'COMMENTS_CACHE_TTL', comment_list_versions)
+class CommentAPIView(SparseFieldsetViewMixin, CreateModelMixin, ListModelMixin, GenericAPIView):
     queryset = Comment.objects.all()
+    pagination_class = KeysetPagination
+    always_loaded = ('id', 'created')
     
     def get(self, request):
         self.serializer_class = CommentListSerializer
@@ -64,68 +292,371 @@ class CommentAPIView(CreateModelMixin, ListModelMixin, GenericAPIView):
     def get_queryset(self):
         """ Enables getting comments by movie id """
         movie_id = self.request.GET.get('movie')
+        queryset = self.project(super().get_queryset())
         if movie_id:
-            return super().get_queryset().filter(object_id=movie_id)
-        return super().get_queryset()
+            try:
+                return queryset.filter(movie_id=bounded_int(movie_id))
+            except ValueError:
+                raise ValidationError({"error": f"Invalid value of 'movie': {movie_id}."})
+        return queryset
 
     def post(self, request, *args, **kwargs):
         self.serializer_class = CommentCreateSerializer
+        if settings.COMMENT_WRITE_BEHIND:
+            return self.create_buffered(request)
         return self.create(request, args, kwargs)
 
     def perform_create(self, serializer):
-        movie_id = self.request.POST.get('movie_id')
+        movie_id = self.validated_movie_id()
         content_type = ContentType.objects.get_for_model(Movie)
         serializer.save(content_type=content_type, object_id=movie_id)
 
+    def validated_movie_id(self):
+        """ 'movie_id' of the form or JSON body, of an existing movie """
+        data = self.request.data
+        movie_id = comment_movie_id(data.get('movie_id') if isinstance(data, dict) else None)
+        if movie_id is None or not Movie.objects.filter(pk=movie_id).exists():
+            raise ValidationError({"error": "No movie with the given 'movie_id'."})
+        return movie_id
+
+    def create_buffered(self, request):
+        """
+        Validate the comment and leave saving it to the write-behind buffer;
+        depending on settings.COMMENT_DURABILITY answer once it's saved (201)
+        or right away (202, with 'created' unknown yet).
+        """
+        durability = comment_durability()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        comment = Comment(content_type=ContentType.objects.get_for_model(Movie),
+                          object_id=self.validated_movie_id(), **serializer.validated_data)
+        comment.set_movie()
+        saved = comment_buffer.add(comment)
+        if durability == 'buffer':
+            return Response(self.get_serializer(comment).data, status=status.HTTP_202_ACCEPTED)
+        try:
+            saved.result(timeout=settings.COMMENT_SAVE_TIMEOUT)
+        except Movie.DoesNotExist:
+            raise ValidationError({"error": "No movie with the given 'movie_id'."})
+        except Exception:
+            return Response({
+                "error": "The comment couldn't be saved. Please try again later."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(self.get_serializer(comment).data, status=status.HTTP_201_CREATED)
 
-class MovieAPIView(CreateModelMixin, ListModelMixin, GenericAPIView):
+
+class CommentBulkAPIView(APIView):
+    """
+    Post many comments at once, as a list 'comments' of
+    {'movie_id', 'text'} objects; they are saved together
+    in a single transaction, or none of them when one is invalid.
+    """
+    max_comments = 1000
+
+    def post(self, request):
+        items = request.data.get('comments') if isinstance(request.data, dict) else None
+        if not items or not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            return Response({
+                "error": "The request must include 'comments' - a list of "
+                         "{\"movie_id\": <id>, \"text\": <text>} objects."},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_comments:
+            return Response({
+                "error": f"Up to {self.max_comments} comments can be posted at once."},
+                status=status.HTTP_400_BAD_REQUEST)
+        movie_ids = [comment_movie_id(item.get('movie_id')) for item in items]
+        existing = set(Movie.objects
+                       .filter(id__in=[i for i in movie_ids if i is not None])
+                       .values_list('id', flat=True))
+        content_type = ContentType.objects.get_for_model(Movie)
+        comments = []
+        for index, (item, movie_id) in enumerate(zip(items, movie_ids)):
+            serializer = CommentCreateSerializer(data=item)
+            if not serializer.is_valid():
+                return Response({"error": f"Comment {index}: 'text' is required."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if movie_id not in existing:
+                return Response({"error": f"Comment {index}: no movie with the given 'movie_id'."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            comment = Comment(content_type=content_type, object_id=movie_id,
+                              **serializer.validated_data)
+            comment.set_movie()
+            comments.append(comment)
+        saved = save_comments(comments)
+        return Response(CommentCreateSerializer(saved, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+
+@versioned(movie_list_versions)
+@cached_response('movies', 'MOVIES_CACHE_TTL', movie_list_versions)
+class MovieAPIView(SparseFieldsetViewMixin, CreateModelMixin, ListModelMixin, GenericAPIView):
     queryset = Movie.objects.order_by('title')
     serializer_class = MovieListSerializer
+    # query parameter: (lookup on an indexed typed column, parser)
+    range_filters = {
+        'year_min': ('year_number__gte', bounded_int),
+        'year_max': ('year_number__lte', bounded_int),
+        'min_rating': ('imdbrating_number__gte', finite_float),
+        'min_votes': ('imdbvotes_number__gte', bounded_int),
+    }
+    # value of 'order' (optionally prefixed with '-'): column
+    orderings = {
+        'title': 'title',
+        'year': 'year_number',
+        'runtime': 'runtime_minutes',
+        'metascore': 'metascore_number',
+        'imdbrating': 'imdbrating_number',
+        'imdbvotes': 'imdbvotes_number',
+        'comments': 'comment_count',
+    }
     
     def get(self, request):
-        return self.list(request)
+        try:
+            if 'ids' in request.GET:
+                return self.details(request)
+            return self.list(request)
+        except BadFilterException as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def details(self, request):
+        """
+        Details of the movies given by 'ids', in that order (ids of missing movies
+        are left out), loaded with a query for the movies and one for their comments.
+        Other filters and 'order' don't apply.
+        """
+        ids = movie_ids(request.GET['ids'])
+        fields = self.requested_fields(MovieDetailSerializer)
+        queryset = self.project(Movie.objects.filter(id__in=ids), MovieDetailSerializer)
+        movies = queryset.in_bulk()
+        movies = [movies[i] for i in ids if i in movies]
+        prefetch_latest_comments(movies, fields)
+        serializer = MovieDetailSerializer(movies, many=True, fields=fields)
+        return Response(serializer.data)
     
     def get_queryset(self):
-        """ Enable getting movies by genre or/and director """
+        """
+        Enable getting movies by genre or/and director.
+        Values are matched against the Genre and Director lookup tables,
+        by substring or, with 'match=exact', as a whole (case-insensitive) name.
+        
+        Range filters and 'order' work on the typed number columns,
+        so they are done by the database, using its indexes.
+        Movies without a value (OMDb 'N/A') are left out by range filters
+        and put last by 'order', in both directions.
+        """
         genre = self.request.GET.get('genre')
         director = self.request.GET.get('director')
-        queryset = super().get_queryset()
+        exact = self.request.GET.get('match') == 'exact'
+        queryset = self.order(self.project(super().get_queryset()), self.request.GET.get('order'))
+        for param, (lookup, parse) in self.range_filters.items():
+            value = self.request.GET.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: parse(value)})
+                except ValueError:
+                    raise BadFilterException(f"Invalid value of '{param}': {value}.")
         if genre:
-            queryset = queryset.filter(genre__icontains=genre)
+            queryset = queryset.filter(
+                id__in=self.lookup_movie_ids(Movie.genres.through, 'genre', genre, exact))
         if director:
-            queryset = queryset.filter(director__icontains=director)
+            queryset = queryset.filter(
+                id__in=self.lookup_movie_ids(Movie.directors.through, 'director', director, exact))
         return queryset
+
+    def order(self, queryset, order):
+        if not order:
+            return queryset
+        column = self.orderings.get(order.lstrip('-'))
+        if column is None:
+            raise BadFilterException("Invalid order. The available orderings are: {}.".format(
+                ', '.join(self.orderings)))
+        if order.startswith('-'):
+            return queryset.order_by(F(column).desc(nulls_last=True), 'id')
+        return queryset.order_by(F(column).asc(nulls_last=True), 'id')
+
+    @staticmethod
+    def lookup_movie_ids(through, lookup, name, exact):
+        """ Ids of movies linked to the matching names by a many-to-many 'through' table """
+        name_lookup = f'{lookup}__name' if exact else f'{lookup}__name__contains'
+        return through.objects.filter(**{name_lookup: name.strip().lower()}).values('movie_id')
     
     def post(self, request):
         title = request.POST.get('title')
-        query_result = Movie.objects.filter(title__icontains=title)
+        fields = self.requested_fields(MovieDetailSerializer)
+        queryset = self.project(Movie.objects.filter(title_key=normalize_title(title)),
+                                MovieDetailSerializer)
+        movie_obj = queryset.order_by('id').first()
         # check if movie with this title already exists in the PostgreSQL database:
-        if query_result.exists():
-            movie_obj = query_result.first()
-            serializer = MovieDetailSerializer(movie_obj)
+        if movie_obj is not None:
+            prefetch_latest_comments([movie_obj], fields)
+            serializer = MovieDetailSerializer(movie_obj, fields=fields)
             return Response(serializer.data)
+        # in asynchronous mode, unless it's in the OMDb cache, queue a job to get it:
+        elif wants_async(request) and cached_movie(title) is None:
+            job = IngestJob.objects.enqueue(title)
+            serializer = IngestJobSerializer(job, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED,
+                            headers={'Location': serializer.data['url']})
         # if not, get it from the omdbapi:
         else:
-            movie_data = fetch_movie(title)
+            try:
+                movie_data = fetch_movie(title)
+            except OmdbUnavailable:
+                return Response({
+                    "error": "The movie database is unavailable. Please try again later."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
             if movie_data['response'] == 'True' and movie_data['type'] == 'movie':
-                movie_data['ratings'] = json.dumps(movie_data['ratings'])
-                movie_obj = Movie.objects.create(**movie_data)
-                serializer = MovieDetailSerializer(movie_obj)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+                movie_obj, created = Movie.get_or_create_from_omdb(movie_data)
+                # the movie may have been there already under another title, with comments
+                prefetch_latest_comments([movie_obj], fields)
+                serializer = MovieDetailSerializer(movie_obj, fields=fields)
+                return Response(serializer.data,
+                                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
             return Response(status=status.HTTP_404_NOT_FOUND)
 
 
-class MovieDeleteUpdateAPIView(DestroyModelMixin, UpdateModelMixin, GenericAPIView):
+class IngestJobAPIView(RetrieveAPIView):
+    """
+    State of a fetch queued by POST /movies in asynchronous mode;
+    once it's 'done', 'movie' is the id of the movie.
+    """
+    queryset = IngestJob.objects.all()
+    serializer_class = IngestJobSerializer
+
+
+class MovieBulkImportAPIView(APIView):
+    """
+    Import many movies from OMDb at once.
+    Titles are passed as a list 'titles' (JSON or repeated form field)
+    and the response holds a report with a status of every title.
+    """
+    max_titles = 1000
+
+    def post(self, request):
+        if hasattr(request.data, 'getlist'):
+            titles = request.data.getlist('titles')
+        else:
+            titles = request.data.get('titles')
+        if (not titles or not isinstance(titles, list)
+                or not all(isinstance(title, str) and title.strip() for title in titles)):
+            return Response({
+                "error": "The request must include 'titles' - a list of movie titles."},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(titles) > self.max_titles:
+            return Response({
+                "error": f"Up to {self.max_titles} titles can be imported at once."},
+                status=status.HTTP_400_BAD_REQUEST)
+        return Response(import_titles(titles))
+
+
+class MovieExportView(View):
+    """
+    Stream the whole catalog as NDJSON (default) or a JSON array,
+    optionally with comments of every movie ('comments=1').
+    It is a plain Django view, because DRF would read
+    the 'format' parameter as its own and build the whole response
+    in memory before sending it.
+    """
+    def get(self, request):
+        output_format = request.GET.get('format', NDJSON)
+        if output_format not in FORMATS:
+            return JsonResponse({
+                "error": "Invalid format. The available formats are: {}.".format(
+                    ', '.join(FORMATS))},
+                status=status.HTTP_400_BAD_REQUEST)
+        with_comments = request.GET.get('comments') in ('1', 'true')
+        return StreamingHttpResponse(export_movies(output_format, with_comments),
+                                     content_type=FORMATS[output_format])
+
+
+@versioned([ResourceVersion.MOVIES, ResourceVersion.COMMENTS])
+class MovieSearchAPIView(SparseFieldsetViewMixin, GenericAPIView):
+    """
+    Full-text search over title, plot, actors and writer
+    of the movies, best matches first (see movies.search).
+    Results are paged with 'page' and 'page_size';
+    'next' links to the following page, if there is one.
+    """
+    serializer_class = MovieSearchSerializer
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return Response({
+                "error": "No search query specified. The query must include the 'q' parameter."},
+                status=status.HTTP_400_BAD_REQUEST)
+        page = self.positive_int(request.GET.get('page'), 1)
+        if page > MAX_INT_PARAM:
+            return Response({"error": f"'page' has to be at most {MAX_INT_PARAM}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(self.positive_int(request.GET.get('page_size'), self.page_size),
+                        self.max_page_size)
+        # the search index is read with raw SQL, from the database the router reads movies from
+        hits = search_movies(connections[router.db_for_read(Movie)], query,
+                             limit=page_size + 1, offset=(page - 1) * page_size)
+        next_link = None
+        if len(hits) > page_size:
+            hits = hits[:page_size]
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+        movies = self.project(Movie.objects.all()).in_bulk([movie_id for movie_id, score in hits])
+        results = []
+        for movie_id, score in hits:
+            if movie_id in movies:
+                movies[movie_id].rank = score
+                results.append(movies[movie_id])
+        serializer = self.get_serializer(results, many=True)
+        return Response({'next': next_link, 'results': serializer.data})
+
+    @staticmethod
+    def positive_int(value, default):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return default
+        return value if value > 0 else default
+
+
+@versioned(movie_detail_versions)
+class MovieDeleteUpdateAPIView(SparseFieldsetViewMixin, DestroyModelMixin, GenericAPIView):
+    """
+    For PUT and DELETE the movie is always loaded whole, as saving it
+    needs all of its fields - 'fields' only trims the response.
+    GET loads only the columns of the returned fields.
+    """
     queryset = Movie.objects.all()
     serializer_class = MovieDetailSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            return self.project(queryset)
+        return queryset
+
+    def get(self, request, pk):
+        movie = self.get_object()
+        prefetch_latest_comments([movie], self.requested_fields())
+        return Response(self.get_serializer(movie).data)
     
     def delete(self, request, pk):
         return self.destroy(request, pk)
     
-    def put(self, request, *args, **kwargs):
-        return self.update(request, partial=True, **kwargs)
+    def put(self, request, pk):
+        """
+        A partial update. The comments are prefetched after saving,
+        as UpdateModelMixin would drop them and return all of them.
+        """
+        movie = self.get_object()
+        serializer = self.get_serializer(movie, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        prefetch_latest_comments([movie], self.requested_fields())
+        return Response(serializer.data)
 
 
+@versioned(top_versions)
+@cached_response('top', 'TOP_CACHE_TTL', top_versions)
 class MovieTopAPIView(ListAPIView):
     """
     Top movies present in the database based
@@ -148,22 +679,64 @@ class MovieTopAPIView(ListAPIView):
         rank values with desired behaviour.
         Raising custom exceptions enables 'get()' function
         to return proper error messages.
+        
+        Comment counts are summed from the daily rollup
+        (DailyCommentCount) of the days in range, grouped by movie,
+        and only the requested slice ('offset', 'limit') of the ranked
+        groups is fetched, so the cost depends on the number of movies
+        commented in range, not on the size of the catalog or of the
+        comments table. The ranks are computed over all the groups,
+        so they stay correct across ties on any page.
+        Movies without comments in range follow, ordered by id,
+        sharing the rank after the last commented movie,
+        unless 'exclude_empty' is set.
         """
         date_from = self.request.GET.get('from')
         date_to = self.request.GET.get('to')
         if not date_from or not date_to:
             raise NoDateRangeException()
-        window = Window(expression=DenseRank(), order_by=F('comment_count').desc())
         try:
             date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
             date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
         except ValueError:
             raise BadDateFormatException()
-        queryset = Movie.objects.annotate(
-            comment_count=Count('comments',
-                                filter=Q(comments__created__date__range=(date_from, date_to))),
-            rank=window)
-        return queryset
+        limit = self.non_negative_int('limit')
+        offset = self.non_negative_int('offset') or 0
+        exclude_empty = self.request.GET.get('exclude_empty') in ('1', 'true')
+
+        totals = (DailyCommentCount.objects
+                  .filter(day__range=(date_from, date_to))
+                  .values('movie_id')
+                  .annotate(total_comments=Sum('count'))
+                  .filter(total_comments__gt=0))
+        window = Window(expression=DenseRank(), order_by=F('total_comments').desc())
+        ranked = totals.annotate(rank=window)
+        end = None if limit is None else offset + limit
+        rows = list(ranked.order_by('rank', 'movie_id')[offset:end])
+        if exclude_empty or (limit is not None and len(rows) == limit):
+            return rows
+
+        if rows:
+            empty_rank, empty_offset = rows[-1]['rank'] + 1, 0
+        else:
+            last = ranked.order_by('total_comments').first()
+            empty_rank = last['rank'] + 1 if last else 1
+            empty_offset = offset - totals.count()
+        empty_end = None if limit is None else empty_offset + limit - len(rows)
+        empty = (Movie.objects
+                 .exclude(id__in=totals.values('movie_id'))
+                 .order_by('id')
+                 .values_list('id', flat=True)[empty_offset:empty_end])
+        return rows + [{'movie_id': movie_id, 'total_comments': 0, 'rank': empty_rank}
+                       for movie_id in empty]
+
+    def non_negative_int(self, name):
+        value = self.request.GET.get(name)
+        if value is None or value == '':
+            return None
+        if not value.isdecimal() or int(value) > MAX_INT_PARAM:
+            raise BadFilterException(f"'{name}' has to be an integer from 0 to {MAX_INT_PARAM}.")
+        return int(value)
 
     def get(self, request, *args, **kwargs):
         """
@@ -181,4 +754,6 @@ class MovieTopAPIView(ListAPIView):
             return Response({
                 "error": "Invalid date format. The right format is 'YYYY-MM-DD'."},
                 status=status.HTTP_400_BAD_REQUEST)
+        except BadFilterException as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         return response